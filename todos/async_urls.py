@@ -0,0 +1,13 @@
+"""
+URL configuration used under ASGI: the same routes as todos.urls, with the
+todo views served by their native async versions.
+"""
+
+from django.contrib import admin
+from django.urls import include, path
+
+
+urlpatterns = [
+    path("", include("todosapp.async_urls")),
+    path("admin/", admin.site.urls),
+]
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,12 +45,16 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'todosapp.authcache.AuthenticationMiddleware',
+    'todosapp.metrics.request_metrics_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'todosapp.routers.replica_routing_middleware',
 ]
 
-ROOT_URLCONF = 'todos.urls'
+# todos.asgi serves the todo views with their native async versions
+# (todosapp.async_views); set TODOS_ASYNC_VIEWS=0 to use the sync ones.
+ROOT_URLCONF = 'todos.async_urls' if os.environ.get('TODOS_ASYNC_VIEWS') == '1' else 'todos.urls'
 
 TEMPLATES = [
     {
@@ -72,13 +77,161 @@ WSGI_APPLICATION = 'todos.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite tuning, applied as each connection opens; every value can be
+# overridden per deployment, and TODOS_SQLITE_TUNING=0 turns it all off.
+# WAL lets readers run alongside the single writer, synchronous=NORMAL is
+# durable across application crashes under WAL (only a power loss can drop
+# the last commits), and IMMEDIATE transactions take the write lock up
+# front so a busy database waits out the timeout instead of failing with
+# "database is locked" when a read transaction tries to upgrade.
+TODOS_SQLITE_TUNING = os.environ.get('TODOS_SQLITE_TUNING', '1') == '1'
+TODOS_SQLITE_JOURNAL_MODE = os.environ.get('TODOS_SQLITE_JOURNAL_MODE', 'WAL')
+TODOS_SQLITE_SYNCHRONOUS = os.environ.get('TODOS_SQLITE_SYNCHRONOUS', 'NORMAL')
+TODOS_SQLITE_BUSY_TIMEOUT = float(os.environ.get('TODOS_SQLITE_BUSY_TIMEOUT', '5'))  # seconds
+TODOS_SQLITE_MMAP_SIZE = int(os.environ.get('TODOS_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))  # bytes
+TODOS_SQLITE_CACHE_SIZE = int(os.environ.get('TODOS_SQLITE_CACHE_SIZE', str(-64 * 1024)))  # pages, or -KiB
+
+# Seconds to keep a connection open between requests. Under ASGI, Django
+# opens connections on worker threads outside the request cycle that would
+# close them, so persistent connections are off there by default.
+TODOS_CONN_MAX_AGE = int(os.environ.get(
+    'TODOS_CONN_MAX_AGE', '0' if os.environ.get('TODOS_ASYNC_VIEWS') == '1' else '60'
+))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('TODOS_SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        'CONN_MAX_AGE': TODOS_CONN_MAX_AGE,
+        # Ping a reused connection before the first query of each request
+        'CONN_HEALTH_CHECKS': TODOS_CONN_MAX_AGE > 0,
+        'OPTIONS': {
+            'timeout': TODOS_SQLITE_BUSY_TIMEOUT,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join([
+                'PRAGMA journal_mode = %s' % TODOS_SQLITE_JOURNAL_MODE,
+                'PRAGMA synchronous = %s' % TODOS_SQLITE_SYNCHRONOUS,
+                'PRAGMA mmap_size = %d' % TODOS_SQLITE_MMAP_SIZE,
+                'PRAGMA cache_size = %d' % TODOS_SQLITE_CACHE_SIZE,
+            ]),
+        } if TODOS_SQLITE_TUNING else {},
     }
 }
 
+# Read replica for the list and detail views (todosapp.routers). Without
+# TODOS_REPLICA_PATH the alias is just a second connection to the primary
+# and reads are not routed to it; the test suite gives it its own file.
+TODOS_REPLICA_PATH = os.environ.get('TODOS_REPLICA_PATH')
+TODOS_READ_REPLICA = os.environ.get(
+    'TODOS_READ_REPLICA', '1' if TODOS_REPLICA_PATH else '0'
+) == '1'
+# Seconds a client keeps reading from the primary after it writes
+TODOS_REPLICA_STICKY_SECONDS = int(os.environ.get('TODOS_REPLICA_STICKY_SECONDS', '10'))
+
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': TODOS_REPLICA_PATH or DATABASES['default']['NAME'],
+    'TEST': {'NAME': BASE_DIR / 'test_replica.sqlite3'},
+}
+
+# Per-user shards for the todo tables (todosapp.sharding): a comma separated
+# list of SQLite files, which become aliases shard1, shard2, ... next to
+# default. Without it there is a single shard and nothing is routed.
+# todos.test_settings declares a shard1 for the test suite.
+TODOS_SHARD_PATHS = [path for path in os.environ.get('TODOS_SHARDS', '').split(',') if path]
+for number, path in enumerate(TODOS_SHARD_PATHS, 1):
+    DATABASES['shard%d' % number] = {
+        **DATABASES['default'],
+        'NAME': path,
+        'TEST': {'NAME': BASE_DIR / ('test_shard%d.sqlite3' % number)},
+    }
+TODOS_SHARD_ALIASES = ['default'] + ['shard%d' % n for n in range(1, len(TODOS_SHARD_PATHS) + 1)]
+
+DATABASE_ROUTERS = ['todosapp.sharding.ShardRouter', 'todosapp.routers.ReplicaRouter']
+
+
+# Sessions
+# https://docs.djangoproject.com/en/5.2/topics/http/sessions/
+#
+# Database sessions, and the user each one is logged in as, are cached in
+# process for TODOS_AUTH_CACHE_TTL seconds (0 turns that off) so a warm
+# request runs no authentication queries; see todosapp.authcache.
+# TODOS_SESSION_ENGINE=cached_db or signed_cookies selects those engines.
+
+TODOS_SESSION_ENGINES = {
+    'db': 'todosapp.authcache',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_ENGINE = TODOS_SESSION_ENGINES[os.environ.get('TODOS_SESSION_ENGINE', 'db')]
+TODOS_AUTH_CACHE_TTL = float(os.environ.get('TODOS_AUTH_CACHE_TTL', '60'))
+TODOS_AUTH_CACHE_SIZE = int(os.environ.get('TODOS_AUTH_CACHE_SIZE', '10000'))
+
+# login_view and signup_view hash passwords in a pool of this many threads
+# (0 hashes on the request's own thread), with at most TODOS_HASH_QUEUE
+# more waiting before they answer 503; see todosapp.hashing. This only
+# frees request threads under ASGI: under WSGI each login's worker thread
+# still waits for its hash, and only the 503 bound applies.
+TODOS_HASH_WORKERS = int(os.environ.get('TODOS_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+TODOS_HASH_QUEUE = int(os.environ.get('TODOS_HASH_QUEUE', '32'))
+
+# Token-bucket rate limits per view scope, by key ('ip', 'username' or
+# 'user'), as 'count/period' with a period of s, m, h or d. Buckets are
+# per process unless TODOS_RATELIMIT_STORE is todosapp.ratelimit.CacheStore,
+# which keeps them in the TODOS_RATELIMIT_CACHE cache; see todosapp.ratelimit.
+TODOS_RATELIMIT = os.environ.get('TODOS_RATELIMIT', '1') == '1'
+TODOS_RATE_LIMITS = {
+    'login': {'ip': '30/m', 'username': '10/m'},
+    'signup': {'ip': '10/h'},
+    'todo_write': {'user': '600/m'},
+}
+TODOS_RATELIMIT_STORE = os.environ.get('TODOS_RATELIMIT_STORE', 'todosapp.ratelimit.InProcessStore')
+TODOS_RATELIMIT_CACHE = 'todos'
+TODOS_RATELIMIT_MAX_KEYS = 100000
+
+# Responses to todo writes sent with an Idempotency-Key header, replayed to
+# retries with the same key for TODOS_IDEMPOTENCY_TTL seconds. Kept per
+# process unless TODOS_IDEMPOTENCY_STORE is todosapp.idempotency.CacheStore,
+# which keeps them in the TODOS_IDEMPOTENCY_CACHE cache; see
+# todosapp.idempotency.
+TODOS_IDEMPOTENCY_TTL = 24 * 60 * 60
+TODOS_IDEMPOTENCY_STORE = os.environ.get('TODOS_IDEMPOTENCY_STORE', 'todosapp.idempotency.InProcessStore')
+TODOS_IDEMPOTENCY_CACHE = 'todos'
+TODOS_IDEMPOTENCY_MAX_KEYS = 100000
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# The per-user todo list cache defaults to process-local memory. Set
+# TODOS_CACHE=file or TODOS_CACHE=db to share it between worker processes
+# (the db backend needs `python3 manage.py createcachetable`).
+
+TODOS_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'todos',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'todos',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'todos_cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'todos': TODOS_CACHE_BACKENDS[os.environ.get('TODOS_CACHE', 'locmem')],
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -122,6 +275,65 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Authentication settings
+# ModelBackend, with aauthenticate()'s password hashing in the pool below
+AUTHENTICATION_BACKENDS = ['todosapp.hashing.PooledModelBackend']
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/login/'
+
+# Todo list pagination (?after=<cursor>&limit=N)
+TODOS_PAGE_SIZE = 5
+TODOS_MAX_PAGE_SIZE = 100
+
+# Have SQLite (3.44 or later) build JSON list pages with json_group_array
+# rather than rendering rows in Python (todosapp.serializers)
+TODOS_SQL_JSON = os.environ.get('TODOS_SQL_JSON', '1') == '1'
+
+
+# Maximum number of operations accepted by one POST /batch
+TODOS_BATCH_MAX_OPERATIONS = 1000
+
+# Seconds a deleted todo's tombstone is kept for delta sync (/sync). A
+# client whose token predates the tombstones pruned since is told to
+# resync in full.
+TODOS_TOMBSTONE_RETENTION = 30 * 86400
+
+# Cache alias and lifetime (seconds) for rendered todo list pages
+TODOS_CACHE_ALIAS = 'todos'
+TODOS_LIST_CACHE_TIMEOUT = 300
+
+# Seconds between checks of vite-project/dist for a new build (the app
+# shell and the static asset manifest are held in memory in between)
+TODOS_DIST_CHECK_INTERVAL = 1.0
+
+# Server-Sent Events stream of todo changes (/events). The in-process broker
+# only reaches streams held by the same process; use
+# 'todosapp.events.DatabaseBroker' when running several workers. Writes
+# publish events only when TODOS_EVENTS is on, by default when this process
+# serves the async views, as only those serve the stream; turn it on for
+# sync workers that write for streams served by others through the
+# database broker.
+TODOS_EVENTS = os.environ.get('TODOS_EVENTS', os.environ.get('TODOS_ASYNC_VIEWS', '0')) == '1'
+TODOS_EVENTS_BACKEND = os.environ.get('TODOS_EVENTS_BACKEND', 'todosapp.events.InProcessBroker')
+TODOS_EVENTS_HISTORY = 100  # events kept per user for Last-Event-ID resume
+TODOS_EVENTS_POLL_INTERVAL = 1.0  # seconds, DatabaseBroker only
+# Seconds a client can resume from Last-Event-ID: the in-process broker
+# keeps a user's history this long after their last stream closes
+TODOS_EVENTS_RETENTION = 3600
+TODOS_EVENTS_HEARTBEAT = 15  # seconds between keep-alive comments
+TODOS_EVENTS_RETRY_MS = 3000  # client reconnect delay
+
+# Rows fetched per database round trip when streaming an export
+TODOS_EXPORT_CHUNK_SIZE = 2000
+
+# Rows inserted per bulk_create and per transaction when importing
+TODOS_IMPORT_BATCH_SIZE = 1000
+
+# Request timing and query instrumentation (Server-Timing headers and the
+# Prometheus histograms at /metrics) for the views in these modules.
+# TODOS_METRICS_SAMPLE_RATE instruments that fraction of users; /metrics
+# is open to staff and to requests bearing TODOS_METRICS_TOKEN.
+TODOS_METRICS = os.environ.get('TODOS_METRICS', '1') == '1'
+TODOS_METRICS_VIEW_MODULES = ['todosapp.views', 'todosapp.async_views', 'todosapp.auth_views']
+TODOS_METRICS_SAMPLE_RATE = float(os.environ.get('TODOS_METRICS_SAMPLE_RATE', '1'))
+TODOS_METRICS_TOKEN = os.environ.get('TODOS_METRICS_TOKEN')
@@ -0,0 +1,16 @@
+"""
+Settings for the test suite: todos.settings plus a second todo shard.
+
+shard1 is declared as a database in its own file so todosapp.tests can move
+users onto it; it is left out of TODOS_SHARD_ALIASES, and the sharding
+tests add it there themselves, so the rest of the suite runs on a single
+shard as a default deployment does.
+"""
+from todos.settings import *  # noqa: F401,F403
+from todos.settings import BASE_DIR, DATABASES
+
+DATABASES.setdefault('shard1', {
+    **DATABASES['default'],
+    'NAME': BASE_DIR / 'db.shard1.sqlite3',
+    'TEST': {'NAME': BASE_DIR / 'test_shard1.sqlite3'},
+})
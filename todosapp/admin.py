@@ -1,6 +1,10 @@
 from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
 
-from .models import Todo
+from . import cache, events, search
+from .models import Todo, TodoTombstone
 
 
 @admin.register(Todo)
@@ -8,5 +12,29 @@ class TodoAdmin(admin.ModelAdmin):
     list_display = ('title', 'user', 'state', 'pub_date')
     list_filter = ('state', 'pub_date', 'user')
     search_fields = ('title', 'user__username')
-    readonly_fields = ('pub_date',)
+    readonly_fields = ('pub_date', 'updated_at')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Match titles through the full-text index rather than LIKE '%x%'
+        if not search_term or not search.fts_enabled():
+            return super().get_search_results(request, queryset, search_term)
+        try:
+            terms = search.parse_terms(search_term)
+        except search.InvalidQuery:
+            return super().get_search_results(request, queryset, search_term)
+        matches = RawSQL(
+            "SELECT rowid FROM %s WHERE %s MATCH %%s" % (search.TABLE, search.TABLE),
+            [search.title_expression(terms)]
+        )
+        users = User.objects.filter(username__icontains=search_term).values('pk')
+        return queryset.filter(Q(pk__in=matches) | Q(user__in=users)), False
+
+    def delete_queryset(self, request, queryset):
+        deleted = list(queryset.values_list('user_id', 'id'))
+        TodoTombstone.record(deleted)
+        super().delete_queryset(request, queryset)
+        for user_id in {user_id for user_id, _ in deleted}:
+            cache.invalidate_on_commit(user_id)
+        for user_id, todo_id in deleted:
+            events.publish_on_commit(user_id, 'delete', {'id': todo_id})
 
@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_out
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
 
 
 class TodosappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'todosapp'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+
+        from .authcache import forget_user
+        from .metrics import install_execute_wrapper
+        from .sharding import delete_user_data
+
+        pre_delete.connect(delete_user_data, sender=User, dispatch_uid='todosapp_delete_user_data')
+        post_save.connect(forget_user, sender=User, dispatch_uid='todosapp_authcache_save')
+        post_delete.connect(forget_user, sender=User, dispatch_uid='todosapp_authcache_delete')
+        user_logged_out.connect(forget_user, dispatch_uid='todosapp_authcache_logout')
+        connection_created.connect(install_execute_wrapper, dispatch_uid='todosapp_query_metrics')
@@ -0,0 +1,250 @@
+"""
+Serving of the files vite builds into vite-project/dist.
+
+The dist tree is scanned into an in-memory manifest that maps each URL path
+to its size, mtime, content type, ETag and precompressed siblings, so a
+request is a dict lookup and unknown paths 404 without touching the
+filesystem. The tree is rescanned when a build changes it, checked at most
+once every ``check_interval`` seconds.
+
+Files are streamed with FileResponse, so WSGI servers that provide
+``wsgi.file_wrapper`` can hand them to sendfile(). Precompressed ``.br`` and
+``.gz`` siblings written by the build are preferred when the client accepts
+them, conditional requests are answered with 304, single byte ranges are
+supported, and vite's content-hashed ``assets/*`` files are marked
+immutable.
+"""
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_etags
+
+from todos import settings
+
+from .spa import accepted_encodings
+
+# Precompressed siblings, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """A read-only view of ``length`` bytes of a file starting at ``start``"""
+
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def _etag(st, encoding=None):
+    etag = '%x-%x' % (st.st_mtime_ns, st.st_size)
+    return '"%s-%s"' % (etag, encoding) if encoding else '"%s"' % etag
+
+
+class Representation:
+    """One file on disk that can be sent for an asset"""
+
+    def __init__(self, file_path, st, encoding=None):
+        self.file_path = file_path
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.etag = _etag(st, encoding)
+
+
+class Asset:
+    def __init__(self, path, file_path, st):
+        self.path = path
+        content_type, _ = mimetypes.guess_type(file_path)
+        self.content_type = content_type or 'application/octet-stream'
+        self.cache_control = IMMUTABLE if is_immutable(path) else REVALIDATE
+        self.identity = Representation(file_path, st)
+        # encoding -> Representation of the precompressed sibling
+        self.variants = {}
+
+
+def scan(dist_path):
+    """
+    Build the manifest for ``dist_path``: a dict of URL path -> Asset.
+
+    Only regular files whose resolved location is inside ``dist_path`` are
+    included, so symlinks cannot expose anything outside the build.
+    """
+    root = os.path.realpath(dist_path)
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            real_path = os.path.realpath(file_path)
+            if os.path.commonpath([root, real_path]) != root:
+                continue
+            try:
+                st = os.stat(real_path)
+            except FileNotFoundError:
+                continue
+            path = os.path.relpath(file_path, root).replace(os.sep, '/')
+            files[path] = (real_path, st)
+
+    manifest = {}
+    for path, (real_path, st) in files.items():
+        if any(path.endswith(suffix) and path[:-len(suffix)] in files
+               for _, suffix in ENCODINGS):
+            continue
+        asset = Asset(path, real_path, st)
+        for encoding, suffix in ENCODINGS:
+            if path + suffix in files:
+                asset.variants[encoding] = Representation(*files[path + suffix], encoding)
+        manifest[path] = asset
+    return manifest
+
+
+class AssetManifest:
+    def __init__(self, dist_path, check_interval):
+        self.dist_path = dist_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._assets = {}
+        self._stamp = None
+        self._checked_at = None
+
+    def _build_stamp(self):
+        """Changes whenever vite writes a new build into dist"""
+        stamp = []
+        for path in (self.dist_path, os.path.join(self.dist_path, 'index.html')):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                stamp.append(None)
+            else:
+                stamp.append((st.st_mtime_ns, st.st_ino))
+        return tuple(stamp)
+
+    def lookup(self, path):
+        """Return the Asset for URL ``path``, or None"""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            with self._lock:
+                stamp = self._build_stamp()
+                if stamp != self._stamp:
+                    self._assets = scan(self.dist_path) if stamp[0] else {}
+                    self._stamp = stamp
+                self._checked_at = now
+        return self._assets.get(path)
+
+
+def is_immutable(path):
+    """vite puts content-hashed build output under assets/"""
+    return path.startswith('assets/')
+
+
+def parse_range(header, size):
+    """
+    Return ``(start, end)`` (inclusive) for a single ``bytes=`` range, None if
+    the header should be ignored, or ``(size, None)`` if it cannot be
+    satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return size, None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return size, None
+    return start, end
+
+
+def _select(request, asset):
+    """Pick the representation to send: ``(encoding, Representation)``"""
+    if 'Range' not in request.headers and asset.variants:
+        accepted = accepted_encodings(request)
+        for encoding, _ in ENCODINGS:
+            if encoding in accepted and encoding in asset.variants:
+                return encoding, asset.variants[encoding]
+    return None, asset.identity
+
+
+def serve(request, asset):
+    """Serve a manifest Asset"""
+    encoding, representation = _select(request, asset)
+    etag = representation.etag
+    size = representation.size
+
+    def with_headers(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(representation.mtime)
+        response['Cache-Control'] = asset.cache_control
+        response['Accept-Ranges'] = 'bytes'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    conditional = get_conditional_response(
+        request, etag=etag, last_modified=int(representation.mtime)
+    )
+    if conditional is not None:
+        return with_headers(conditional)
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and request.method in ('GET', 'HEAD'):
+        if_range = request.headers.get('If-Range')
+        if not if_range or etag in parse_etags(if_range):
+            byte_range = parse_range(range_header, size)
+
+    if byte_range is not None and byte_range[1] is None:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return with_headers(response)
+
+    # The only filesystem call on the request path
+    try:
+        f = open(representation.file_path, 'rb')
+    except FileNotFoundError:
+        raise Http404("File not found")
+    if byte_range is None:
+        response = FileResponse(f, content_type=asset.content_type)
+        response['Content-Length'] = str(size)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = FileResponse(
+            RangeFile(f, start, length), content_type=asset.content_type, status=206
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return with_headers(response)
+
+
+manifest = AssetManifest(
+    os.path.join(settings.BASE_DIR, 'vite-project', 'dist'),
+    settings.TODOS_DIST_CHECK_INTERVAL
+)
@@ -0,0 +1,23 @@
+"""
+todosapp.urls with the todo views swapped for their native async versions.
+"""
+from django.urls import path
+
+from . import async_views
+from .urls import urlpatterns as sync_urlpatterns
+
+ASYNC_VIEWS = {
+    'index': async_views.index,
+    'detail': async_views.detail,
+    'set_state': async_views.set_state,
+    'update_title': async_views.update_title,
+    'delete_todo': async_views.delete_todo,
+    'events': async_views.event_stream,
+    'export_todos': async_views.export_todos,
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name)
+    if pattern.name in ASYNC_VIEWS else pattern
+    for pattern in sync_urlpatterns
+]
@@ -0,0 +1,302 @@
+"""
+Native async versions of the todo views, for deployments behind ASGI.
+
+These mirror the views in todosapp.views request for request, but use the
+async ORM and the async cache API so that, under todos.asgi, a request is
+handled on the event loop instead of hopping to the sync thread pool.
+They are routed by todos.async_urls, which todos.asgi selects by default.
+"""
+import json
+
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+
+from todos import settings
+
+from . import cache, events, export, serializers, spa
+from .etags import adetail_etag, alist_etag
+from .idempotency import idempotent
+from .models import Todo
+from .pagination import InvalidCursor, parse_limit
+from .ratelimit import rate_limit
+from .routers import reading_from_replica, replica_reads
+
+
+async def _user(request):
+    """
+    Resolve the user without touching the sync session machinery, and pin
+    it on the request so templates and context processors can use it too.
+    """
+    user = await request.auser()
+    request.user = user
+    return user
+
+
+async def _get_todo_or_404(todo_id, user):
+    try:
+        return await Todo.objects.aget(pk=todo_id, user=user)
+    except Todo.DoesNotExist:
+        raise Http404("No Todo matches the given query.")
+
+
+def _conditional(request, etag, response=None):
+    """Apply an ETag the way django.views.decorators.http.condition does"""
+    if etag is None:
+        return response
+    if response is None:
+        return get_conditional_response(request, etag='"%s"' % etag)
+    if request.method in ('GET', 'HEAD') and not response.has_header('ETag'):
+        response['ETag'] = '"%s"' % etag
+    return response
+
+
+def _wants_json_reply(request):
+    return (
+        request.headers.get('Accept') == 'application/json'
+        or request.content_type == 'application/json'
+    )
+
+
+@login_required
+@rate_limit('todo_write')
+@idempotent
+@replica_reads
+async def index(request):
+    user = await _user(request)
+
+    if request.method == 'POST':
+        # Handle JSON POST data
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body)
+                title = data.get('title')
+            except json.JSONDecodeError:
+                return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        else:
+            title = request.POST.get('title')
+
+        if title:
+            todo = await Todo.objects.acreate(
+                user=user,
+                title=title,
+                pub_date=timezone.now()
+            )
+            if _wants_json_reply(request):
+                return serializers.json_response(serializers.todo_data(todo), status=201)
+            return redirect('index')
+
+    if request.headers.get('Accept') != 'application/json':
+        response = spa.spa_shell.response(request)
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+    etag = await alist_etag(request, user)
+    not_modified = _conditional(request, etag)
+    if not_modified is not None:
+        patch_vary_headers(not_modified, ('Accept',))
+        return not_modified
+
+    try:
+        limit = parse_limit(
+            request.GET.get('limit'),
+            settings.TODOS_PAGE_SIZE,
+            settings.TODOS_MAX_PAGE_SIZE
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+
+    after = request.GET.get('after')
+    page = '%s:%s' % (after or '', limit)
+    content, generation = await cache.aget_list(user.id, page)
+    if content is not None:
+        response = HttpResponse(content, content_type='application/json')
+    else:
+        # Get todos for the current user only, one keyset page at a time
+        try:
+            content = await serializers.alist_page(
+                Todo.objects.filter(user=user),
+                after,
+                limit
+            )
+        except InvalidCursor:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+        response = HttpResponse(content, content_type='application/json')
+        # A replica may lag behind the write that bumped the generation
+        if not reading_from_replica():
+            await cache.aset_list(user.id, page, response.content, generation)
+
+    patch_vary_headers(response, ('Accept',))
+    return _conditional(request, etag, response)
+
+
+@login_required
+@rate_limit('todo_write')
+@idempotent
+async def set_state(request, todo_id):
+    todo = await _get_todo_or_404(todo_id, await _user(request))
+
+    if request.method == 'POST':
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body)
+                state = data.get('state')
+            except json.JSONDecodeError:
+                return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        else:
+            state = request.POST.get('state')
+
+        if state is not None:
+            todo.state = state
+            await todo.asave(update_fields=['state', 'updated_at'])
+
+            if _wants_json_reply(request):
+                return serializers.json_response(serializers.todo_data(todo))
+            return redirect('index')
+        else:
+            if _wants_json_reply(request):
+                return JsonResponse({'error': 'State value is required'}, status=400)
+            return HttpResponse("State value is required", status=400)
+
+    if request.headers.get('Accept') == 'application/json':
+        return serializers.json_response(serializers.todo_data(todo))
+
+    return HttpResponse("state for %s." % todo.id)
+
+
+@login_required
+@replica_reads
+async def detail(request, todo_id):
+    user = await _user(request)
+
+    etag = None
+    if request.headers.get('Accept') == 'application/json':
+        etag = await adetail_etag(request, todo_id, user)
+        not_modified = _conditional(request, etag)
+        if not_modified is not None:
+            patch_vary_headers(not_modified, ('Accept',))
+            return not_modified
+
+    todo = await _get_todo_or_404(todo_id, user)
+
+    # Return JSON if client accepts JSON
+    if request.headers.get('Accept') == 'application/json':
+        response = JsonResponse({
+            'id': todo.id,
+            'title': todo.title,
+            'pub_date': todo.pub_date.isoformat()
+        })
+    else:
+        response = render(request, 'todosapp/detail.html', {'todo': todo})
+
+    patch_vary_headers(response, ('Accept',))
+    return _conditional(request, etag, response)
+
+
+@login_required
+@rate_limit('todo_write')
+@idempotent
+async def delete_todo(request, todo_id):
+    todo = await _get_todo_or_404(todo_id, await _user(request))
+
+    if request.method == 'POST' or request.method == 'DELETE':
+        await todo.adelete()
+
+        if _wants_json_reply(request):
+            return JsonResponse({'message': 'Todo deleted successfully'}, status=200)
+        return redirect('index')
+
+    if request.headers.get('Accept') == 'application/json':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    return HttpResponse("Method not allowed", status=405)
+
+
+@login_required
+@rate_limit('todo_write')
+@idempotent
+async def update_title(request, todo_id):
+    todo = await _get_todo_or_404(todo_id, await _user(request))
+
+    if request.method == 'POST' or request.method == 'PUT':
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body)
+                title = data.get('title')
+            except json.JSONDecodeError:
+                return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        else:
+            title = request.POST.get('title')
+
+        if title is not None and title.strip():
+            todo.title = title.strip()
+            await todo.asave(update_fields=['title', 'updated_at'])
+
+            if _wants_json_reply(request):
+                return serializers.json_response(serializers.todo_data(todo))
+            return redirect('index')
+        else:
+            if _wants_json_reply(request):
+                return JsonResponse({'error': 'Title value is required and cannot be empty'}, status=400)
+            return HttpResponse("Title value is required and cannot be empty", status=400)
+
+    if request.headers.get('Accept') == 'application/json':
+        return serializers.json_response(serializers.todo_data(todo))
+
+    return HttpResponse("title for %s." % todo.id)
+
+
+@login_required
+async def export_todos(request):
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in export.FORMATS:
+        return JsonResponse({'error': 'Unsupported format'}, status=400)
+    
+    response = StreamingHttpResponse(
+        export.aexport(await _user(request), export_format, settings.TODOS_EXPORT_CHUNK_SIZE),
+        content_type=export.FORMATS[export_format]
+    )
+    response['Content-Disposition'] = 'attachment; filename="todos.%s"' % export_format
+    return response
+
+
+def _last_event_id(request):
+    """The id to resume after: Last-Event-ID, or ?last_event_id= for polyfills"""
+    value = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+@login_required
+async def event_stream(request):
+    """
+    Server-Sent Events stream of the user's todo changes.
+
+    Meant to be served by todos.asgi, where an open stream costs a coroutine
+    rather than a worker thread.
+    """
+    user = await _user(request)
+    subscription = await events.get_broker().subscribe(user.id, _last_event_id(request))
+
+    async def stream():
+        try:
+            yield 'retry: %d\n\n' % settings.TODOS_EVENTS_RETRY_MS
+            while True:
+                event = await subscription.next(settings.TODOS_EVENTS_HEARTBEAT)
+                if event is None:
+                    yield ': heartbeat\n\n'
+                else:
+                    yield events.format_event(event)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx and friends from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,13 +1,43 @@
+import math
+
 from django.shortcuts import render, redirect
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import aauthenticate, alogin, logout
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_protect
 
+from . import hashing
+from .ratelimit import rate_limit
+
+BUSY_MESSAGE = 'Too many sign-ins right now. Please try again in a moment.'
+THROTTLED_MESSAGE = 'Too many attempts. Please wait a moment and try again.'
+
+
+async def _user(request):
+    # Resolved asynchronously so the template's context processors find it
+    # (and the session) already loaded
+    user = await request.auser()
+    request.user = user
+    return user
+
+
+def _turn_away(request, template, message, status, retry_after=1):
+    messages.error(request, message)
+    response = render(request, template, status=status)
+    response['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+def _throttled(template):
+    def rejected(request, retry_after):
+        return _turn_away(request, template, THROTTLED_MESSAGE, 429, retry_after)
+    return rejected
+
 
 @csrf_protect
-def login_view(request):
-    if request.user.is_authenticated:
+@rate_limit('login', methods=('POST',), rejected=_throttled('todosapp/login.html'))
+async def login_view(request):
+    if (await _user(request)).is_authenticated:
         return redirect('index')
     
     if request.method == 'POST':
@@ -15,9 +45,12 @@ def login_view(request):
         password = request.POST.get('password')
         
         if username and password:
-            user = authenticate(request, username=username, password=password)
+            try:
+                user = await aauthenticate(request, username=username, password=password)
+            except hashing.Saturated:
+                return _turn_away(request, 'todosapp/login.html', BUSY_MESSAGE, 503)
             if user is not None:
-                login(request, user)
+                await alogin(request, user)
                 return redirect('index')
             else:
                 messages.error(request, 'Invalid username or password.')
@@ -28,8 +61,9 @@ def login_view(request):
 
 
 @csrf_protect
-def signup_view(request):
-    if request.user.is_authenticated:
+@rate_limit('signup', methods=('POST',), rejected=_throttled('todosapp/signup.html'))
+async def signup_view(request):
+    if (await _user(request)).is_authenticated:
         return redirect('index')
     
     if request.method == 'POST':
@@ -41,17 +75,16 @@ def signup_view(request):
         if username and password and password_confirm:
             if password != password_confirm:
                 messages.error(request, 'Passwords do not match.')
-            elif User.objects.filter(username=username).exists():
+            elif await User.objects.filter(username=username).aexists():
                 messages.error(request, 'Username already exists.')
             elif len(password) < 6:
                 messages.error(request, 'Password must be at least 6 characters long.')
             else:
-                user = User.objects.create_user(
-                    username=username,
-                    password=password,
-                    email=email
-                )
-                login(request, user)
+                try:
+                    user = await hashing.create_user(username, password, email)
+                except hashing.Saturated:
+                    return _turn_away(request, 'todosapp/signup.html', BUSY_MESSAGE, 503)
+                await alogin(request, user, backend='todosapp.hashing.PooledModelBackend')
                 messages.success(request, 'Account created successfully!')
                 return redirect('index')
         else:
@@ -0,0 +1,240 @@
+"""
+Process-local cache of sessions and the users they are logged in as.
+
+Without it every login_required view starts with two queries, one for the
+session row and one for the user. This module's SessionStore, the default
+SESSION_ENGINE, keeps decoded sessions in an in-process LRU for up to
+``TODOS_AUTH_CACHE_TTL`` seconds, and its AuthenticationMiddleware keeps
+the user a session resolved to in the same entry, so a request with a warm
+cache runs no authentication queries at all.
+
+Within a process an entry is dropped as soon as its session is saved or
+deleted (login, logout, key rotation), and all of a user's entries when the
+user is saved (a password change included), deleted or logged out. Other
+processes only notice when their entry expires, so the TTL bounds how long
+a logout or password change elsewhere takes to apply. A TTL of 0 turns the
+cache off.
+
+``TODOS_SESSION_ENGINE`` selects Django's cached_db or signed_cookies
+session engines instead; users are still cached against their session key.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import partial
+
+from django.contrib import auth
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.sessions.backends import db
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from todos import settings
+
+
+def enabled():
+    return settings.TODOS_AUTH_CACHE_TTL > 0
+
+
+class _Entry:
+    __slots__ = ('expires', 'session', 'user')
+
+    def __init__(self, expires, session=None, user=None):
+        self.expires = expires
+        self.session = session
+        self.user = user
+
+
+class SessionCache:
+    """A thread-safe LRU of session key -> (session data, user) with expiry"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # user id -> session keys with that user cached
+        self._by_user = defaultdict(set)
+
+    def _expiry(self, expire_date=None):
+        ttl = settings.TODOS_AUTH_CACHE_TTL
+        if expire_date is not None:
+            ttl = min(ttl, (expire_date - timezone.now()).total_seconds())
+        return time.monotonic() + ttl
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, entry):
+        self._remove(key)
+        self._entries[key] = entry
+        while len(self._entries) > settings.TODOS_AUTH_CACHE_SIZE:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.user is not None:
+            keys = self._by_user[entry.user.pk]
+            keys.discard(key)
+            if not keys:
+                del self._by_user[entry.user.pk]
+
+    def session(self, key):
+        """A copy of the cached session data, or None"""
+        with self._lock:
+            entry = self._get(key)
+            if entry is None or entry.session is None:
+                return None
+            return dict(entry.session)
+
+    def set_session(self, key, data, expire_date):
+        with self._lock:
+            self._put(key, _Entry(self._expiry(expire_date), session=dict(data)))
+
+    def user(self, key):
+        """A copy of the user cached for a session, or None"""
+        with self._lock:
+            entry = self._get(key)
+            user = entry.user if entry is not None else None
+        # Each request gets its own instance to modify
+        return copy.copy(user) if user is not None else None
+
+    def set_user(self, key, user):
+        with self._lock:
+            entry = self._get(key)
+            if entry is None:
+                entry = _Entry(self._expiry())
+                self._put(key, entry)
+            elif entry.user is not None:
+                self._by_user[entry.user.pk].discard(key)
+            entry.user = copy.copy(user)
+            self._by_user[user.pk].add(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+sessions = SessionCache()
+
+
+class SessionStore(db.SessionStore):
+    """Database sessions read through the process-local cache"""
+
+    def _cached(self):
+        if not enabled() or self.session_key is None:
+            return None
+        return sessions.session(self.session_key)
+
+    def _remember(self, s):
+        if s is None:
+            return {}
+        data = self.decode(s.session_data)
+        if enabled():
+            sessions.set_session(s.session_key, data, s.expire_date)
+        return data
+
+    def load(self):
+        data = self._cached()
+        if data is None:
+            data = self._remember(self._get_session_from_db())
+        return data
+
+    async def aload(self):
+        data = self._cached()
+        if data is None:
+            data = self._remember(await self._aget_session_from_db())
+        return data
+
+    def save(self, must_create=False):
+        super().save(must_create)
+        sessions.delete(self.session_key)
+
+    async def asave(self, must_create=False):
+        await super().asave(must_create)
+        sessions.delete(self.session_key)
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        super().delete(session_key)
+        sessions.delete(session_key)
+
+    async def adelete(self, session_key=None):
+        session_key = session_key or self.session_key
+        await super().adelete(session_key)
+        sessions.delete(session_key)
+
+
+def _cached_user(request, user_id):
+    key = request.session.session_key
+    if not enabled() or key is None or user_id is None:
+        return None
+    user = sessions.user(key)
+    if user is None or str(user.pk) != str(user_id):
+        return None
+    return user
+
+
+def _remember_user(request, user):
+    key = request.session.session_key
+    if enabled() and key is not None and user.is_authenticated:
+        sessions.set_user(key, user)
+    return user
+
+
+def get_user(request):
+    if not hasattr(request, '_cached_user'):
+        user_id = request.session.get(auth.SESSION_KEY)
+        request._cached_user = (
+            _cached_user(request, user_id)
+            or _remember_user(request, auth.get_user(request))
+        )
+    return request._cached_user
+
+
+async def auser(request):
+    if not hasattr(request, '_acached_user'):
+        user_id = await request.session.aget(auth.SESSION_KEY)
+        request._acached_user = (
+            _cached_user(request, user_id)
+            or _remember_user(request, await auth.aget_user(request))
+        )
+    return request._acached_user
+
+
+class AuthenticationMiddleware(auth_middleware.AuthenticationMiddleware):
+    """Django's AuthenticationMiddleware, resolving users through the cache"""
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+        request.auser = partial(auser, request)
+
+
+def forget_user(sender, instance=None, user=None, **kwargs):
+    """
+    post_save/post_delete receiver for User, and user_logged_out receiver:
+    drop every session cached for the user
+    """
+    user = instance or user
+    if user is not None and user.pk is not None:
+        sessions.delete_user(user.pk)
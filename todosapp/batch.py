@@ -0,0 +1,140 @@
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache, events
+from .models import Todo, TodoTombstone
+from .serializers import todo_data
+from .sharding import shard_for
+
+
+OPERATIONS = ('create', 'set_state', 'update_title', 'delete')
+
+
+class BatchError(ValueError):
+    """Raised for an operation that cannot be applied; reported per operation."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _clean_title(operation):
+    title = operation.get('title')
+    if not isinstance(title, str) or not title.strip():
+        raise BatchError('Title value is required and cannot be empty')
+    return title.strip()
+
+
+def _todo_id(operation):
+    todo_id = operation.get('id')
+    if not isinstance(todo_id, int) or isinstance(todo_id, bool):
+        raise BatchError('Todo id is required')
+    return todo_id
+
+
+def apply_batch(user, operations):
+    """
+    Apply a list of todo operations for ``user`` in a single transaction
+    and return one result dict per operation, in order.
+
+    Each operation is a dict with an ``op`` key of ``create``, ``set_state``,
+    ``update_title`` or ``delete``. Operations are folded in memory first and
+    then written with one ``bulk_create``, one ``bulk_update`` and one
+    ``DELETE ... WHERE id IN (...)`` plus its tombstone insert, so the number
+    of queries does not grow with the size of the batch. An operation that cannot be applied (unknown
+    op, missing todo, bad value) gets an error result and does not affect
+    the others.
+    """
+    todo_ids = {
+        operation.get('id') for operation in operations
+        if isinstance(operation, dict) and operation.get('op') != 'create'
+    }
+    todo_ids = {todo_id for todo_id in todo_ids if isinstance(todo_id, int)}
+    using = shard_for(user.id)
+    todos = {}
+    if todo_ids:
+        todos = {
+            todo.id: todo
+            for todo in Todo.objects.using(using).filter(user=user, id__in=todo_ids)
+        }
+
+    now = timezone.now()
+    results = []
+    created = []
+    updated_fields = {}
+    deleted = set()
+
+    for operation in operations:
+        try:
+            if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+                raise BatchError('Unknown operation')
+            op = operation['op']
+
+            if op == 'create':
+                todo = Todo(user=user, title=_clean_title(operation), pub_date=now)
+                created.append(todo)
+                # Filled in once the row has an id
+                results.append(todo)
+                continue
+
+            todo_id = _todo_id(operation)
+            todo = todos.get(todo_id)
+            if todo is None or todo_id in deleted:
+                raise BatchError('Todo not found', status=404)
+
+            if op == 'delete':
+                deleted.add(todo_id)
+                updated_fields.pop(todo_id, None)
+                results.append({'op': op, 'status': 200, 'id': todo_id})
+                continue
+
+            if op == 'set_state':
+                state = operation.get('state')
+                if not isinstance(state, bool):
+                    raise BatchError('State value is required')
+                todo.state = state
+                updated_fields.setdefault(todo_id, set()).add('state')
+            else:
+                todo.title = _clean_title(operation)
+                updated_fields.setdefault(todo_id, set()).add('title')
+            todo.updated_at = now
+            results.append({'op': op, 'status': 200, 'todo': todo_data(todo)})
+        except BatchError as e:
+            results.append({
+                'op': operation.get('op') if isinstance(operation, dict) else None,
+                'status': e.status,
+                'error': str(e)
+            })
+
+    with transaction.atomic(using=using):
+        if created:
+            Todo.objects.using(using).bulk_create(created)
+        if updated_fields:
+            # bulk_update skips auto_now, so updated_at is set explicitly
+            fields = set().union(*updated_fields.values(), {'updated_at'})
+            Todo.objects.using(using).bulk_update(
+                [todos[todo_id] for todo_id in updated_fields],
+                sorted(fields)
+            )
+        if deleted:
+            TodoTombstone.record(((user.id, todo_id) for todo_id in deleted), using=using)
+            Todo.objects.using(using).filter(user=user, id__in=deleted).delete()
+        results = [
+            {'op': 'create', 'status': 201, 'todo': todo_data(result)}
+            if isinstance(result, Todo) else result
+            for result in results
+        ]
+        if created or updated_fields or deleted:
+            # Bulk writes bypass Todo.save() and Todo.delete(), which normally do this
+            cache.invalidate_on_commit(user.id, using=using)
+            for result in results:
+                if 'error' in result:
+                    continue
+                op = result['op']
+                if op == 'delete':
+                    events.publish_on_commit(user.id, 'delete', {'id': result['id']}, using=using)
+                else:
+                    event_type = {'set_state': 'state', 'update_title': 'title'}.get(op, op)
+                    events.publish_on_commit(user.id, event_type, result['todo'], using=using)
+
+    return results
@@ -0,0 +1,47 @@
+"""
+Small helpers shared by the benchmarking management commands.
+"""
+import math
+
+# Vocabulary for generated todo titles
+WORDS = (
+    "buy milk eggs bread call mom dentist appointment book flights pay rent "
+    "invoice review pull request fix bug deploy release water plants walk dog "
+    "clean kitchen laundry groceries birthday gift email report meeting notes "
+    "renew passport insurance car service gym yoga read chapter write blog "
+    "backup laptop update budget taxes plan trip garden paint fence"
+).split()
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(latencies, elapsed):
+    """Throughput and latency percentiles (in milliseconds) for one run"""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def format_summary(label, summary):
+    return (
+        "%-28s %6d req  %8.1f req/s  p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms" % (
+            label, summary['requests'], summary['rps'],
+            summary['p50'], summary['p95'], summary['p99']
+        )
+    )
+
+
+def random_title(rng):
+    """A plausible todo title of two to five words"""
+    return ' '.join(rng.sample(WORDS, rng.randint(2, 5))).capitalize()
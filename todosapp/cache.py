@@ -0,0 +1,121 @@
+"""
+Per-user cache of rendered JSON todo list pages.
+
+Every page of a user's list is stored under a key that includes the user's
+current *generation*, a random token kept in the cache next to the pages.
+Invalidating a user just replaces the generation, which makes all of their
+cached pages unreachable at once; they then age out through the normal
+timeout. A reader remembers the generation it saw before querying the
+database and stores its page under that generation, so a page rendered
+concurrently with a write can never be served after the write.
+"""
+import threading
+import uuid
+
+from django.core.cache import caches
+from django.db import transaction
+
+from todos import settings
+
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def _cache():
+    return caches[settings.TODOS_CACHE_ALIAS]
+
+
+def _generation_key(user_id):
+    return 'todos:gen:%s' % user_id
+
+
+def _page_key(user_id, generation, page):
+    return 'todos:list:%s:%s:%s' % (user_id, generation, page)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_list(user_id, page):
+    """
+    Return ``(content, generation)`` for a cached list page, where content is
+    None on a miss. Pass ``generation`` back to set_list after rendering.
+    """
+    cache = _cache()
+    generation = cache.get(_generation_key(user_id))
+    content = None
+    if generation is not None:
+        content = cache.get(_page_key(user_id, generation, page))
+    _count('misses' if content is None else 'hits')
+    return content, generation
+
+
+def set_list(user_id, page, content, generation):
+    """Store a rendered list page under the generation get_list returned"""
+    cache = _cache()
+    if generation is None:
+        generation = uuid.uuid4().hex
+        if not cache.add(_generation_key(user_id), generation, None):
+            # Another request started a generation first; ours may be stale
+            return
+    cache.set(
+        _page_key(user_id, generation, page),
+        content,
+        settings.TODOS_LIST_CACHE_TIMEOUT
+    )
+
+
+async def aget_list(user_id, page):
+    """Async version of get_list, for backends that do I/O"""
+    cache = _cache()
+    generation = await cache.aget(_generation_key(user_id))
+    content = None
+    if generation is not None:
+        content = await cache.aget(_page_key(user_id, generation, page))
+    _count('misses' if content is None else 'hits')
+    return content, generation
+
+
+async def aset_list(user_id, page, content, generation):
+    """Async version of set_list"""
+    cache = _cache()
+    if generation is None:
+        generation = uuid.uuid4().hex
+        if not await cache.aadd(_generation_key(user_id), generation, None):
+            return
+    await cache.aset(
+        _page_key(user_id, generation, page),
+        content,
+        settings.TODOS_LIST_CACHE_TIMEOUT
+    )
+
+
+def invalidate(user_id):
+    """Drop every cached list page for ``user_id``"""
+    _cache().set(_generation_key(user_id), uuid.uuid4().hex, None)
+    _count('invalidations')
+
+
+def invalidate_on_commit(user_id, using=None):
+    """
+    Drop ``user_id``'s pages now and again once the current transaction on
+    ``using`` commits, so a page rendered from the pre-commit state in
+    between cannot survive the write.
+    """
+    invalidate(user_id)
+    transaction.on_commit(lambda: invalidate(user_id), using=using)
+
+
+def stats():
+    """Hit, miss and invalidation counts for this process"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
@@ -0,0 +1,100 @@
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.db.models import OuterRef, Subquery, Value
+
+from .models import Todo, TodoTombstone
+
+
+def _wants_json(request):
+    return (
+        request.method in ('GET', 'HEAD')
+        and request.headers.get('Accept') == 'application/json'
+    )
+
+
+def _user_version_query(user):
+    # Driven by the user's latest change, so only the todo and tombstone
+    # (user, change_seq) indexes are read; the hint sends it to the user's
+    # shard (todosapp.sharding)
+    todos = Todo.objects.db_manager(hints={'shard_user': user.pk}).filter(user=user)
+    latest_delete = Subquery(
+        TodoTombstone.objects.filter(user=OuterRef('user'))
+        .order_by('-change_seq').values('change_seq')[:1]
+    )
+    # Sequences are per database, so the alias is part of the stamp
+    return todos.order_by('-change_seq').values_list(Value(todos.db), 'change_seq', latest_delete)
+
+
+# A user without todos gets no row; every empty list looks the same
+NO_TODOS = (None, None, None)
+
+
+def user_version(user):
+    """
+    Return a stamp that changes whenever any of ``user``'s todos is created,
+    modified or deleted: the highest ``change_seq`` among the todos and
+    among the tombstones. Change sequences are assigned in commit order
+    (see models.Counter), so unlike timestamps taken before a transaction
+    a later commit always raises one of them.
+
+    Both halves are single seeks on the (user, change_seq) indexes,
+    fetched together in one query.
+    """
+    return _user_version_query(user).first() or NO_TODOS
+
+
+async def auser_version(user):
+    # Naming the alias routes the query, which may look up the user's shard
+    return await sync_to_async(user_version)(user)
+
+
+def _etag(*parts):
+    return hashlib.sha1(':'.join(map(str, parts)).encode('utf-8')).hexdigest()
+
+
+def _list_etag(request, user, version):
+    return _etag(
+        'list',
+        user.pk,
+        *version,
+        request.GET.get('after', ''),
+        request.GET.get('limit', '')
+    )
+
+
+def _todo_version(todo_id, user):
+    todos = Todo.objects.filter(pk=todo_id, user=user)
+    return todos.values_list(Value(todos.db), 'change_seq').first()
+
+
+def list_etag(request):
+    """ETag for the JSON todo list, or None for any other representation"""
+    if not _wants_json(request):
+        return None
+    return _list_etag(request, request.user, user_version(request.user))
+
+
+async def alist_etag(request, user):
+    if not _wants_json(request):
+        return None
+    return _list_etag(request, user, await auser_version(user))
+
+
+def detail_etag(request, todo_id):
+    """ETag for one todo's JSON, or None if it is missing or not JSON"""
+    if not _wants_json(request):
+        return None
+    version = _todo_version(todo_id, request.user)
+    if version is None:
+        return None
+    return _etag('detail', todo_id, *version)
+
+
+async def adetail_etag(request, todo_id, user):
+    if not _wants_json(request):
+        return None
+    version = await sync_to_async(_todo_version)(todo_id, user)
+    if version is None:
+        return None
+    return _etag('detail', todo_id, *version)
@@ -0,0 +1,211 @@
+"""
+Fan-out of todo change events to the Server-Sent Events stream.
+
+Writes publish an event (create, state, title, update or delete) for the
+todo's owner once their transaction commits; every open stream for that user
+receives it. The broker is pluggable through ``TODOS_EVENTS_BACKEND``:
+
+- ``InProcessBroker`` (the default) fans out in memory, which is enough
+  when every stream and every write is handled by one process.
+- ``DatabaseBroker`` appends events to the ``TodoEvent`` table and has
+  subscribers poll it, a local stand-in for a real message bus when several
+  worker processes share one database.
+
+Both keep enough history for a reconnecting client to resume from the id in
+its ``Last-Event-ID`` header. The in-process broker keeps history only for
+users with a stream open, or closed less than ``TODOS_EVENTS_RETENTION``
+ago, so memory follows the streams rather than every user who writes.
+Nothing is published unless ``TODOS_EVENTS`` is on.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from todos import settings
+
+
+class Event:
+    def __init__(self, id, user_id, type, data):
+        self.id = id
+        self.user_id = user_id
+        self.type = type
+        self.data = data
+
+
+class InProcessSubscription:
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def deliver(self, event):
+        # Publishers may run on any thread; hand the event to our loop
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def next(self, timeout):
+        """The next event, or None if none arrived within ``timeout`` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+
+class InProcessBroker:
+    def __init__(self, history=None, retention=None):
+        self.history_size = history or settings.TODOS_EVENTS_HISTORY
+        self.retention = retention or settings.TODOS_EVENTS_RETENTION
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # Only for users who have a stream open or had one lately
+        self._history = {}
+        self._subscribers = defaultdict(set)
+        # user_id -> when their last stream closed, oldest first
+        self._idle = OrderedDict()
+
+    def _expire(self, now):
+        while self._idle:
+            user_id, since = next(iter(self._idle.items()))
+            if since > now - self.retention:
+                break
+            del self._idle[user_id]
+            del self._history[user_id]
+
+    def publish(self, user_id, type, data):
+        with self._lock:
+            event = Event(next(self._ids), user_id, type, data)
+            self._expire(time.monotonic())
+            history = self._history.get(user_id)
+            if history is None:
+                # No stream to deliver to or resume
+                return event
+            history.append(event)
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return event
+
+    async def subscribe(self, user_id, last_event_id=None):
+        subscription = InProcessSubscription(self, user_id)
+        # Replaying and registering under one lock means no event is missed
+        # or delivered twice around the moment of subscribing
+        with self._lock:
+            self._expire(time.monotonic())
+            self._idle.pop(user_id, None)
+            history = self._history.setdefault(user_id, deque(maxlen=self.history_size))
+            if last_event_id is not None:
+                for event in history:
+                    if event.id > last_event_id:
+                        subscription.queue.put_nowait(event)
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+                    # Kept for a while so a dropped stream can resume
+                    self._idle[subscription.user_id] = time.monotonic()
+
+
+class DatabaseSubscription:
+    def __init__(self, broker, user_id, last_event_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.last_event_id = last_event_id
+        self.pending = deque()
+
+    async def next(self, timeout):
+        from .models import TodoEvent
+
+        deadline = time.monotonic() + timeout
+        while not self.pending:
+            rows = TodoEvent.objects.filter(
+                user_id=self.user_id, id__gt=self.last_event_id
+            ).order_by('id')[:100]
+            async for row in rows:
+                self.pending.append(Event(row.id, row.user_id, row.type, row.data))
+            if self.pending:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(self.broker.poll_interval, remaining))
+        event = self.pending.popleft()
+        self.last_event_id = event.id
+        return event
+
+    def close(self):
+        pass
+
+
+class DatabaseBroker:
+    def __init__(self, poll_interval=None, retention=None):
+        self.poll_interval = poll_interval or settings.TODOS_EVENTS_POLL_INTERVAL
+        self.retention = retention or settings.TODOS_EVENTS_RETENTION
+        self._published = itertools.count(1)
+
+    def publish(self, user_id, type, data):
+        from .models import TodoEvent
+
+        row = TodoEvent.objects.create(user_id=user_id, type=type, data=data)
+        if next(self._published) % 500 == 0:
+            self.prune()
+        return Event(row.id, user_id, type, data)
+
+    def prune(self):
+        """Drop events too old for any client to still resume from"""
+        from .models import TodoEvent
+
+        cutoff = timezone.now() - timedelta(seconds=self.retention)
+        TodoEvent.objects.filter(created_at__lt=cutoff).delete()
+
+    async def subscribe(self, user_id, last_event_id=None):
+        from .models import TodoEvent
+
+        if last_event_id is None:
+            # A fresh stream only wants what happens from now on
+            latest = await TodoEvent.objects.order_by('-id').values_list('id', flat=True).afirst()
+            last_event_id = latest or 0
+        return DatabaseSubscription(self, user_id, last_event_id)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.TODOS_EVENTS_BACKEND)()
+    return _broker
+
+
+def publish_on_commit(user_id, type, data, using=None):
+    """Publish an event for ``user_id`` once the transaction on ``using`` commits"""
+    if not settings.TODOS_EVENTS:
+        return
+    transaction.on_commit(lambda: get_broker().publish(user_id, type, data), using=using)
+
+
+def format_event(event):
+    """Render an Event in text/event-stream framing"""
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (
+        event.id, event.type, json.dumps(event.data, separators=(',', ':'))
+    )
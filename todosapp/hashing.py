@@ -0,0 +1,127 @@
+"""
+Password hashing off the request path.
+
+Password hashes are slow on purpose (PBKDF2 runs a million iterations), so
+a burst of logins hashing on the threads that serve requests stalls the
+cheap todo reads queued behind them. login_view and signup_view instead
+await their hashing from a small thread pool, login_view through
+``aauthenticate`` and PooledModelBackend; hashlib releases the GIL while it
+hashes, so threads use every core without a process pool. Only the hashing
+leaves the request: user lookups and saves stay on the usual async ORM
+path.
+
+That frees the request's thread only under ASGI (todos.asgi), where the
+views run on the event loop. Under WSGI, the default deployment, each
+request has its own worker thread and it waits for its hash as it would
+without the pool; what still applies there is the bound below, which
+turns away logins past it instead of letting them tie up workers.
+
+At most ``TODOS_HASH_WORKERS`` hashes run at once and ``TODOS_HASH_QUEUE``
+more may wait. Past that run() raises Saturated straight away and the
+views answer 503, rather than queueing logins for longer than a client
+would wait for them. ``TODOS_HASH_WORKERS = 0`` hashes on the calling
+thread, as Django does.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import hashers
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+
+from todos import settings
+
+
+class Saturated(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+
+_lock = threading.Lock()
+_pending = 0
+# (size, executor), rebuilt if TODOS_HASH_WORKERS changes
+_executor = (0, None)
+
+
+def _get_executor():
+    global _executor
+    size = settings.TODOS_HASH_WORKERS
+    with _lock:
+        if _executor[0] != size:
+            _executor = (size, ThreadPoolExecutor(size, thread_name_prefix='todos-hash'))
+        return _executor[1]
+
+
+def _release(future):
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+def pending():
+    """Hashes running or waiting"""
+    return _pending
+
+
+async def run(func, *args):
+    """Await ``func(*args)`` run in the hashing pool, or raise Saturated"""
+    global _pending
+    if settings.TODOS_HASH_WORKERS <= 0:
+        return func(*args)
+    executor = _get_executor()
+    with _lock:
+        if _pending >= settings.TODOS_HASH_WORKERS + settings.TODOS_HASH_QUEUE:
+            raise Saturated()
+        _pending += 1
+    # The copied context keeps request metrics and routing with the job
+    future = executor.submit(contextvars.copy_context().run, func, *args)
+    future.add_done_callback(_release)
+    return await asyncio.wrap_future(future)
+
+
+def _check(password, encoded):
+    """check_password, also reporting whether the hash should be upgraded"""
+    outdated = []
+    correct = hashers.check_password(password, encoded, setter=outdated.append)
+    return correct, bool(outdated)
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend whose aauthenticate() hashes with run(), so that
+    ``django.contrib.auth.aauthenticate`` keeps the hashing in the pool while
+    honoring AUTHENTICATION_BACKENDS. Raises Saturated like run().
+    authenticate(), as the admin's sync login uses, hashes on the calling
+    thread as usual.
+    """
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await User._default_manager.aget_by_natural_key(username)
+        except User.DoesNotExist:
+            # Hash anyway, so a missing user takes as long as a wrong password
+            await run(hashers.make_password, password)
+            return None
+        correct, outdated = await run(_check, password, user.password)
+        if correct and outdated:
+            user.password = await run(hashers.make_password, password)
+            await user.asave(update_fields=['password'])
+        if correct and self.user_can_authenticate(user):
+            return user
+        return None
+
+
+async def create_user(username, password, email=''):
+    """``User.objects.create_user`` with the hashing run by run()"""
+    user = User(
+        username=User.normalize_username(username),
+        email=User.objects.normalize_email(email),
+    )
+    user.password = await run(hashers.make_password, password)
+    await user.asave()
+    return user
@@ -0,0 +1,268 @@
+"""
+Idempotency keys for the todo write views.
+
+A client that may retry a write sends an ``Idempotency-Key`` header, a
+value it makes up once per logical request (a UUID, say). The first request
+with a key runs the view and its response is kept; a retry with the same
+key, from the same user, gets the kept response back, marked
+``Idempotent-Replayed: true``, without the view running again. So a create
+retried after a lost response does not make a second todo.
+
+- A key reused with a different method, path or body answers 422.
+- A retry while the first request is still running answers 409.
+- A response of 500 or above, or an exception, is not kept, so the client
+  can retry with the same key.
+- Requests without the header, and safe methods, are not affected.
+
+Responses are kept for ``TODOS_IDEMPOTENCY_TTL`` seconds by
+``TODOS_IDEMPOTENCY_STORE``. InProcessStore, the default, keeps at most
+``TODOS_IDEMPOTENCY_MAX_KEYS`` of them in this process, least recently used
+dropped first, so it only catches retries that reach the same worker.
+CacheStore keeps them in the ``TODOS_IDEMPOTENCY_CACHE`` cache, shared by
+the workers using it.
+"""
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+from django.utils.module_loading import import_string
+
+from todos import settings
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+INVALID_KEY = 'Idempotency-Key must be 1 to %d characters' % MAX_KEY_LENGTH
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+# Headers kept with a response and replayed
+KEPT_HEADERS = ('Content-Type', 'Location')
+
+
+class Stored:
+    """A kept response: the request it answered and what to replay"""
+    __slots__ = ('fingerprint', 'status', 'headers', 'content')
+
+    def __init__(self, fingerprint, status=None, headers=(), content=b''):
+        self.fingerprint = fingerprint
+        self.status = status
+        self.headers = headers
+        self.content = content
+
+    @property
+    def pending(self):
+        """True while the first request with the key is still running"""
+        return self.status is None
+
+
+class InProcessStore:
+    """Kept responses in this process's memory, least recently used dropped first"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (expires, Stored)
+        self._entries = OrderedDict()
+
+    def _get(self, key, now):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        if item[0] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return item[1]
+
+    def begin(self, key, fingerprint):
+        """
+        Claim ``key`` for a request, returning None, or return what is
+        already stored under it
+        """
+        now = time.monotonic()
+        with self._lock:
+            stored = self._get(key, now)
+            if stored is not None:
+                return stored
+            self._entries[key] = (now + settings.TODOS_IDEMPOTENCY_TTL, Stored(fingerprint))
+            while len(self._entries) > settings.TODOS_IDEMPOTENCY_MAX_KEYS:
+                self._entries.popitem(last=False)
+        return None
+
+    def finish(self, key, stored):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + settings.TODOS_IDEMPOTENCY_TTL, stored)
+
+    def release(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    async def abegin(self, key, fingerprint):
+        return self.begin(key, fingerprint)
+
+    async def afinish(self, key, stored):
+        self.finish(key, stored)
+
+    async def arelease(self, key):
+        self.release(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CacheStore:
+    """Kept responses in a Django cache, shared by every worker using it"""
+
+    def _cache(self):
+        return caches[settings.TODOS_IDEMPOTENCY_CACHE]
+
+    def _key(self, key):
+        return 'idempotency:%s' % key
+
+    def begin(self, key, fingerprint):
+        cache = self._cache()
+        # add() claims the key for one request only, where the backend can
+        if cache.add(self._key(key), Stored(fingerprint), settings.TODOS_IDEMPOTENCY_TTL):
+            return None
+        # Evicted in between: the next retry claims it again
+        return cache.get(self._key(key)) or Stored(fingerprint)
+
+    def finish(self, key, stored):
+        self._cache().set(self._key(key), stored, settings.TODOS_IDEMPOTENCY_TTL)
+
+    def release(self, key):
+        self._cache().delete(self._key(key))
+
+    async def abegin(self, key, fingerprint):
+        return await sync_to_async(self.begin)(key, fingerprint)
+
+    async def afinish(self, key, stored):
+        await sync_to_async(self.finish)(key, stored)
+
+    async def arelease(self, key):
+        await sync_to_async(self.release)(key)
+
+    def clear(self):
+        pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = import_string(settings.TODOS_IDEMPOTENCY_STORE)()
+    return _store
+
+
+def fingerprint(request):
+    """A digest of what makes two requests the same one"""
+    digest = hashlib.sha256()
+    for part in (request.method, request.get_full_path(), request.content_type):
+        digest.update(part.encode('utf-8') + b'\0')
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def _replay(stored, request_fingerprint):
+    if stored.pending:
+        return _error('A request with this Idempotency-Key is still in progress', 409)
+    if stored.fingerprint != request_fingerprint:
+        return _error('Idempotency-Key was used for a different request', 422)
+    response = HttpResponse(stored.content, status=stored.status)
+    for header, value in stored.headers:
+        response[header] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _keep(response, request_fingerprint):
+    """What to keep of ``response``, or None if it should not be kept"""
+    if response.status_code >= 500 or response.streaming:
+        return None
+    return Stored(
+        request_fingerprint,
+        response.status_code,
+        tuple((header, response[header]) for header in KEPT_HEADERS if response.has_header(header)),
+        response.content
+    )
+
+
+def _applies(request):
+    return request.method in UNSAFE_METHODS and HEADER in request.headers
+
+
+def _store_key(request, user):
+    """The key's name in the store, scoped per user, or None if it is invalid"""
+    key = request.headers[HEADER]
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None
+    return '%s:%s' % (user.pk, key)
+
+
+def idempotent(view_func):
+    """
+    Replay the kept response to a write retried with the same
+    Idempotency-Key, instead of running the view again. Keys are scoped
+    per user: use it below login_required.
+    """
+    if iscoroutinefunction(view_func):
+        async def wrapper(request, *args, **kwargs):
+            if not _applies(request):
+                return await view_func(request, *args, **kwargs)
+            key = _store_key(request, await request.auser())
+            if key is None:
+                return _error(INVALID_KEY, 400)
+            store = get_store()
+            request_fingerprint = fingerprint(request)
+            stored = await store.abegin(key, request_fingerprint)
+            if stored is not None:
+                return _replay(stored, request_fingerprint)
+            try:
+                response = await view_func(request, *args, **kwargs)
+            except BaseException:
+                await store.arelease(key)
+                raise
+            stored = _keep(response, request_fingerprint)
+            if stored is None:
+                await store.arelease(key)
+            else:
+                await store.afinish(key, stored)
+            return response
+    else:
+        def wrapper(request, *args, **kwargs):
+            if not _applies(request):
+                return view_func(request, *args, **kwargs)
+            key = _store_key(request, request.user)
+            if key is None:
+                return _error(INVALID_KEY, 400)
+            store = get_store()
+            request_fingerprint = fingerprint(request)
+            stored = store.begin(key, request_fingerprint)
+            if stored is not None:
+                return _replay(stored, request_fingerprint)
+            try:
+                response = view_func(request, *args, **kwargs)
+            except BaseException:
+                store.release(key)
+                raise
+            stored = _keep(response, request_fingerprint)
+            if stored is None:
+                store.release(key)
+            else:
+                store.finish(key, stored)
+            return response
+
+    return functools.wraps(view_func)(wrapper)
@@ -0,0 +1,248 @@
+"""
+Bulk import of todos from NDJSON or CSV, in the format export.py writes.
+
+Input is consumed as a stream of lines. Records are validated as they
+arrive and inserted with ``bulk_create`` in batches of ``batch_size``, one
+transaction per batch, so memory and transaction size stay bounded however
+large the input is. Invalid records are reported by line number and
+skipped. ``id`` and ``updated_at`` columns are ignored; imported todos get
+new ids.
+"""
+import codecs
+import csv
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import cache, events
+from .models import Todo
+
+FORMATS = ('ndjson', 'csv')
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n', ''}
+
+# How many error details to keep; the total is always counted
+MAX_ERRORS = 100
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.imported / self.elapsed if self.elapsed else 0.0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        return {
+            'imported': self.imported,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'elapsed': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def decode_lines(byte_lines):
+    """Decode an iterable of UTF-8 byte lines, split across chunks or not"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for line in byte_lines:
+        yield decoder.decode(line)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def parse_ndjson(lines):
+    """``(line_number, record or InvalidRecord)`` for each non-blank line"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            yield number, InvalidRecord('Invalid JSON')
+            continue
+        if not isinstance(record, dict):
+            yield number, InvalidRecord('Expected a JSON object')
+            continue
+        yield number, record
+
+
+def parse_csv(lines):
+    """
+    ``(line_number, record or InvalidRecord)`` for each CSV data row. A
+    header the csv module rejects ends the input, as no row can be read
+    without it; a rejected row is reported and the rows after it still read.
+    """
+    reader = csv.DictReader(lines)
+    try:
+        reader.fieldnames
+    except csv.Error as e:
+        yield reader.reader.line_num, InvalidRecord(str(e))
+        return
+    while True:
+        try:
+            record = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield reader.reader.line_num, InvalidRecord(str(e))
+            continue
+        yield reader.line_num, record
+
+
+def _state(value):
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return False
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise InvalidRecord('Invalid state %r' % value)
+
+
+def _pub_date(value, default):
+    if value in (None, ''):
+        return default
+    try:
+        pub_date = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise InvalidRecord('Invalid pub_date %r' % value)
+    if timezone.is_naive(pub_date):
+        pub_date = timezone.make_aware(pub_date)
+    return pub_date
+
+
+def build_todo(user, record, now):
+    """Validate one record into an unsaved Todo, or raise InvalidRecord"""
+    title = record.get('title')
+    if not isinstance(title, str) or not title.strip():
+        raise InvalidRecord('Title value is required and cannot be empty')
+    title = title.strip()
+    max_length = Todo._meta.get_field('title').max_length
+    if len(title) > max_length:
+        raise InvalidRecord('Title is longer than %d characters' % max_length)
+    return Todo(
+        user=user,
+        title=title,
+        state=_state(record.get('state')),
+        pub_date=_pub_date(record.get('pub_date'), now),
+    )
+
+
+def import_todos(user, records, batch_size, progress=None, using='default'):
+    """
+    Insert todos for ``user`` from ``(line_number, record)`` pairs and return
+    an ImportResult. ``progress(result)`` is called after every batch.
+    """
+    result = ImportResult()
+    now = timezone.now()
+    batch = []
+
+    def flush():
+        with transaction.atomic(using=using):
+            Todo.objects.using(using).bulk_create(batch, batch_size=batch_size)
+            # bulk_create skips Todo.save(), which normally does both of
+            # these. Per batch, as each commits on its own: an import cut
+            # short still invalidates and announces what it committed.
+            cache.invalidate_on_commit(user.id, using=using)
+            events.publish_on_commit(user.id, 'import', {'imported': len(batch)}, using=using)
+        result.imported += len(batch)
+        result.elapsed = time.perf_counter() - result.started
+        batch.clear()
+        if progress is not None:
+            progress(result)
+
+    for number, record in records:
+        try:
+            if isinstance(record, InvalidRecord):
+                raise record
+            batch.append(build_todo(user, record, now))
+        except InvalidRecord as e:
+            result.add_error(number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    result.elapsed = time.perf_counter() - result.started
+    return result
+
+
+@contextmanager
+def sqlite_bulk_load(using='default', defer_indexes=False):
+    """
+    Tune an SQLite connection for a large load and undo it afterwards.
+
+    Enlarges the page cache to 256MB and, outside a transaction, relaxes
+    fsync (``synchronous=OFF``) and keeps temporary structures in memory.
+    With ``defer_indexes`` the secondary indexes on the todo table are
+    dropped for the load and rebuilt once at the end, which is much cheaper
+    than maintaining them row by row but makes every other user's queries
+    scan the table meanwhile, and a process killed before the end leaves
+    them dropped; only use it when nothing else is using the database.
+    A crash with fsync relaxed can lose or corrupt what other connections
+    committed too, so this is for the management commands and benchmarks,
+    never for requests.
+    Does nothing on other databases.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        yield
+        return
+
+    table = Todo._meta.db_table
+    with connection.cursor() as cursor:
+        tuning = {'cache_size': -262144}
+        # SQLite refuses to change these two inside a transaction
+        if not connection.in_atomic_block:
+            tuning.update(synchronous=0, temp_store=2)
+        saved = {}
+        for pragma, value in tuning.items():
+            cursor.execute('PRAGMA %s' % pragma)
+            saved[pragma] = cursor.fetchone()[0]
+            cursor.execute('PRAGMA %s = %d' % (pragma, value))
+
+        indexes = []
+        if defer_indexes:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master "
+                "WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+                [table]
+            )
+            indexes = cursor.fetchall()
+            for name, _ in indexes:
+                cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for _, sql in indexes:
+                cursor.execute(sql)
+            if indexes:
+                cursor.execute('ANALYZE %s' % connection.ops.quote_name(table))
+            for pragma, value in saved.items():
+                cursor.execute('PRAGMA %s = %s' % (pragma, int(value)))
@@ -0,0 +1,108 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.utils import timezone
+
+from todosapp.bench import format_summary, summarize
+from todosapp.models import Todo
+
+JSON = {'Accept': 'application/json'}
+
+
+def check(response):
+    if response.status_code != 200:
+        raise CommandError("Unexpected %d response" % response.status_code)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync todo views under WSGI with the async views under "
+        "ASGI at a given concurrency, in process, against the configured database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--todos', type=int, default=200,
+                            help="Todos to seed for the benchmark user")
+
+    def paths(self, count, todo_ids):
+        """Alternate list pages and detail reads"""
+        for i in range(count):
+            if i % 2:
+                yield '/%d/' % todo_ids[i % len(todo_ids)]
+            else:
+                yield '/?limit=50'
+
+    def run_wsgi(self, user, paths, concurrency):
+        def worker(chunk):
+            client = Client()
+            client.force_login(user)
+            latencies = []
+            try:
+                for path in chunk:
+                    start = time.perf_counter()
+                    response = client.get(path, headers=JSON)
+                    latencies.append(time.perf_counter() - start)
+                    check(response)
+            finally:
+                connection.close()
+            return latencies
+
+        chunks = [paths[i::concurrency] for i in range(concurrency)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            latencies = [latency for result in pool.map(worker, chunks) for latency in result]
+        return summarize(latencies, time.perf_counter() - start)
+
+    async def run_asgi(self, user, paths, concurrency):
+        async def worker(chunk):
+            client = AsyncClient()
+            await client.aforce_login(user)
+            latencies = []
+            for path in chunk:
+                start = time.perf_counter()
+                response = await client.get(path, headers=JSON)
+                latencies.append(time.perf_counter() - start)
+                check(response)
+            return latencies
+
+        chunks = [paths[i::concurrency] for i in range(concurrency)]
+        start = time.perf_counter()
+        results = await asyncio.gather(*(worker(chunk) for chunk in chunks))
+        latencies = [latency for result in results for latency in result]
+        return summarize(latencies, time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username='bench-%s' % uuid.uuid4().hex[:12])
+        try:
+            now = timezone.now()
+            todos = Todo.objects.bulk_create(
+                Todo(user=user, title="Bench todo %d" % i, pub_date=now)
+                for i in range(options['todos'])
+            )
+            paths = list(self.paths(options['requests'], [todo.id for todo in todos]))
+            concurrency = options['concurrency']
+
+            self.stdout.write("%d requests at concurrency %d, %d todos" % (
+                len(paths), concurrency, len(todos)
+            ))
+            with override_settings(ROOT_URLCONF='todos.urls', ALLOWED_HOSTS=['testserver']):
+                self.stdout.write(format_summary(
+                    "sync views / WSGI", self.run_wsgi(user, paths, concurrency)
+                ))
+                self.stdout.write(format_summary(
+                    "sync views / ASGI", asyncio.run(self.run_asgi(user, paths, concurrency))
+                ))
+            with override_settings(ROOT_URLCONF='todos.async_urls', ALLOWED_HOSTS=['testserver']):
+                self.stdout.write(format_summary(
+                    "async views / ASGI", asyncio.run(self.run_asgi(user, paths, concurrency))
+                ))
+        finally:
+            user.delete()
@@ -0,0 +1,99 @@
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.http import JsonResponse
+from django.utils import timezone
+
+from todos import settings
+from todosapp import importer, serializers
+from todosapp.bench import format_summary, random_title, summarize
+from todosapp.models import Todo
+from todosapp.pagination import keyset_page
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare ways of rendering a long JSON todo list page: model "
+        "instances through JsonResponse, values_list through the standard "
+        "library and orjson, and SQLite's json_group_array, against the "
+        "configured database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help="Todos on the page")
+        parser.add_argument('--rounds', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def instances(self, queryset, limit):
+        # The list view before todosapp.serializers
+        todos, next_cursor = keyset_page(queryset, None, limit)
+        return JsonResponse({'todos': [{
+            'id': todo.id,
+            'title': todo.title,
+            'state': todo.state,
+            'pub_date': todo.pub_date.isoformat()
+        } for todo in todos], 'next': next_cursor}).content
+
+    def run(self, render, rounds):
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(rounds):
+            round_start = time.perf_counter()
+            render()
+            latencies.append(time.perf_counter() - round_start)
+        return summarize(latencies, time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        user = User.objects.create_user(username='bench-%s' % uuid.uuid4().hex[:12])
+        try:
+            now = timezone.now()
+            with importer.sqlite_bulk_load():
+                Todo.objects.bulk_create((
+                    Todo(
+                        user=user,
+                        title=random_title(rng),
+                        state=rng.random() < 0.3,
+                        pub_date=now - timedelta(seconds=rng.randint(0, 86400 * 365))
+                    )
+                    for _ in range(options['rows'] + 1)
+                ), batch_size=1000)
+
+            queryset = Todo.objects.filter(user=user)
+            limit = options['rows']
+            page = lambda: serializers.list_page(queryset, None, limit)
+            encoder = serializers.orjson
+            sql_json = settings.TODOS_SQL_JSON
+            self.stdout.write("%d todos per page, %d rounds" % (limit, options['rounds']))
+            try:
+                self.stdout.write(format_summary(
+                    "instances + JsonResponse",
+                    self.run(lambda: self.instances(queryset, limit), options['rounds'])
+                ))
+                settings.TODOS_SQL_JSON = False
+                serializers.orjson = None
+                self.stdout.write(format_summary(
+                    "values_list + json", self.run(page, options['rounds'])
+                ))
+                serializers.orjson = encoder
+                if encoder is not None:
+                    self.stdout.write(format_summary(
+                        "values_list + orjson", self.run(page, options['rounds'])
+                    ))
+                settings.TODOS_SQL_JSON = True
+                if serializers.sql_json(queryset):
+                    self.stdout.write(format_summary(
+                        "json_group_array", self.run(page, options['rounds'])
+                    ))
+                else:
+                    self.stdout.write("json_group_array: needs SQLite 3.44 or later, skipped")
+            finally:
+                serializers.orjson = encoder
+                settings.TODOS_SQL_JSON = sql_json
+        finally:
+            user.delete()
@@ -0,0 +1,104 @@
+import asyncio
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+from django.utils import timezone
+
+from todos import settings
+from todosapp.bench import format_summary, summarize
+from todosapp.models import Todo
+
+JSON = {'Accept': 'application/json'}
+PASSWORD = 'storm-password'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure todo list latency under ASGI while a storm of concurrent "
+        "logins runs, with password hashing in the hashing pool and on the "
+        "request thread, against the configured database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0,
+                            help="Length of each phase")
+        parser.add_argument('--readers', type=int, default=4,
+                            help="Concurrent clients reading the todo list")
+        parser.add_argument('--logins', type=int, default=16,
+                            help="Concurrent clients logging in over and over")
+
+    async def read(self, client, deadline, latencies):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get('/?limit=50', headers=JSON)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise CommandError("Unexpected %d response to a read" % response.status_code)
+
+    async def storm(self, username, deadline, outcomes):
+        client = AsyncClient()
+        while time.perf_counter() < deadline:
+            response = await client.post('/login/', {'username': username, 'password': PASSWORD})
+            outcomes[response.status_code] = outcomes.get(response.status_code, 0) + 1
+            await client.alogout()
+
+    async def phase(self, reader, username, options, storm):
+        readers = []
+        for _ in range(options['readers']):
+            client = AsyncClient()
+            await client.aforce_login(reader)
+            readers.append(client)
+
+        latencies = []
+        outcomes = {}
+        start = time.perf_counter()
+        deadline = start + options['seconds']
+        await asyncio.gather(
+            *(self.read(client, deadline, latencies) for client in readers),
+            *(self.storm(username, deadline, outcomes) for _ in range(options['logins'] if storm else 0))
+        )
+        return summarize(latencies, time.perf_counter() - start), outcomes
+
+    def report(self, label, result):
+        summary, outcomes = result
+        line = format_summary(label, summary)
+        if outcomes:
+            line += "  logins: %s" % ', '.join(
+                '%d x %d' % (count, status) for status, count in sorted(outcomes.items())
+            )
+        self.stdout.write(line)
+
+    def handle(self, *args, **options):
+        prefix = 'bench-%s' % uuid.uuid4().hex[:12]
+        reader = User.objects.create_user(username='%s-reader' % prefix)
+        storm_user = User.objects.create_user(username='%s-storm' % prefix, password=PASSWORD)
+        try:
+            now = timezone.now()
+            Todo.objects.bulk_create(
+                Todo(user=reader, title="Bench todo %d" % i, pub_date=now) for i in range(200)
+            )
+            self.stdout.write("%.0fs per phase, %d readers, %d logging in, %d hashing threads" % (
+                options['seconds'], options['readers'], options['logins'], settings.TODOS_HASH_WORKERS
+            ))
+            # The storm is one user from one address: left on, the login
+            # rate limits would turn it away before any hashing
+            ratelimit = settings.TODOS_RATELIMIT
+            settings.TODOS_RATELIMIT = False
+            try:
+                with override_settings(ROOT_URLCONF='todos.async_urls', ALLOWED_HOSTS=['testserver']):
+                    run = lambda storm: asyncio.run(self.phase(reader, storm_user.username, options, storm))
+                    self.report("reads, no logins", run(False))
+                    self.report("reads, hashing pool", run(True))
+                    workers = settings.TODOS_HASH_WORKERS
+                    settings.TODOS_HASH_WORKERS = 0
+                    try:
+                        self.report("reads, hashing inline", run(True))
+                    finally:
+                        settings.TODOS_HASH_WORKERS = workers
+            finally:
+                settings.TODOS_RATELIMIT = ratelimit
+        finally:
+            User.objects.filter(username__startswith=prefix).delete()
@@ -0,0 +1,100 @@
+import random
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from todosapp import importer, search
+from todosapp.bench import WORDS, format_summary, summarize
+from todosapp.models import Todo
+
+SYLLABLES = "ka ro mi tu sel van dor pe li no bra qua zen fo ghi wu ja xe ly ost".split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare full-text search with the per-term icontains fallback over a "
+        "seeded todo table, against the configured database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=100,
+                            help="Users to spread the rows over")
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def rare_words(self, rng, count=4000):
+        """Made-up words, each in only a few hundred titles at 1M rows"""
+        return sorted({
+            ''.join(rng.choice(SYLLABLES) for _ in range(3)) for _ in range(count)
+        })
+
+    def seed(self, users, rows, rare, rng):
+        now = timezone.now()
+        batch_size = 10000
+        with importer.sqlite_bulk_load():
+            for start in range(0, rows, batch_size):
+                Todo.objects.bulk_create([
+                    Todo(
+                        user=users[i % len(users)],
+                        title=' '.join(
+                            rng.sample(WORDS, rng.randint(1, 4)) + [rng.choice(rare)]
+                        ),
+                        pub_date=now
+                    )
+                    for i in range(start, min(start + batch_size, rows))
+                ])
+                self.stderr.write("seeded %d rows" % min(start + batch_size, rows))
+
+    def run(self, run, queries, limit):
+        latencies = []
+        start = time.perf_counter()
+        for user, terms in queries:
+            query_start = time.perf_counter()
+            run(user, terms, limit, 0, 'default')
+            latencies.append(time.perf_counter() - query_start)
+        return summarize(latencies, time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        if not search.fts_enabled():
+            raise CommandError("The full-text index is not available on this database")
+
+        rng = random.Random(options['seed'])
+        prefix = 'bench-%s' % uuid.uuid4().hex[:12]
+        users = User.objects.bulk_create(
+            User(username='%s-%d' % (prefix, i)) for i in range(options['users'])
+        )
+        try:
+            rare = self.rare_words(rng)
+            self.seed(users, options['rows'], rare, rng)
+
+            def queries(vocabulary):
+                # One or two words, some cut down to a prefix
+                for _ in range(options['queries']):
+                    terms = [
+                        word[:rng.randint(3, len(word))] if len(word) > 3 else word
+                        for word in rng.sample(vocabulary, rng.randint(1, 2))
+                    ]
+                    yield rng.choice(users), terms
+
+            self.stdout.write("%d rows, %d users, limit %d" % (
+                options['rows'], len(users), options['limit']
+            ))
+            # Common words match a large share of a user's todos, so LIKE
+            # finds a page quickly; rare words make it scan the whole list
+            for label, vocabulary in (("common", WORDS), ("rare", rare)):
+                batch = list(queries(vocabulary))
+                self.stdout.write(format_summary(
+                    "FTS5, %s terms" % label,
+                    self.run(search._fts_search, batch, options['limit'])
+                ))
+                self.stdout.write(format_summary(
+                    "icontains, %s terms" % label,
+                    self.run(search._fallback_search, batch, options['limit'])
+                ))
+        finally:
+            User.objects.filter(username__startswith=prefix).delete()
@@ -0,0 +1,56 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from todos import settings
+from todosapp.models import Todo
+from todosapp.pagination import encode_cursor, keyset_queryset
+
+
+class Command(BaseCommand):
+    help = "Print the database query plan for the queries each todo view runs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help="Username to plan the queries for (default: the first user)"
+        )
+        parser.add_argument(
+            '--database',
+            default='default',
+            help="Database alias to explain against"
+        )
+
+    def view_queries(self, user):
+        """The querysets the views in todosapp.views build, keyed by label"""
+        todos = Todo.objects.filter(user=user)
+        page_size = settings.TODOS_PAGE_SIZE + 1
+        cursor = encode_cursor(timezone.now(), 1)
+        return [
+            ("index: first page", keyset_queryset(todos)[:page_size]),
+            ("index: page after cursor", keyset_queryset(todos, cursor)[:page_size]),
+            ("detail/set_state/update_title/delete_todo: lookup", todos.filter(pk=1)),
+            ("active todos", keyset_queryset(todos.filter(state=False))[:page_size]),
+            ("completed todos", keyset_queryset(todos.filter(state=True))[:page_size]),
+        ]
+
+    def handle(self, *args, **options):
+        database = options['database']
+        if options['user']:
+            user = User.objects.using(database).get(username=options['user'])
+        else:
+            user = User.objects.using(database).order_by('pk').first() or User(pk=1)
+
+        self.stdout.write(
+            "Query plans on %r (%s) for user %s\n" % (
+                database, connections[database].vendor, user.pk
+            )
+        )
+        for label, queryset in self.view_queries(user):
+            queryset = queryset.using(database)
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write("  %s" % queryset.query)
+            for line in queryset.explain().splitlines():
+                self.stdout.write("  " + line)
+            self.stdout.write("")
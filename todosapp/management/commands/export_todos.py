@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from todos import settings
+from todosapp.export import FORMATS, export
+
+
+class Command(BaseCommand):
+    help = "Stream a user's todos to stdout or a file as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson')
+        parser.add_argument('--output', '-o', help="File to write (default: stdout)")
+        parser.add_argument('--chunk-size', type=int, default=settings.TODOS_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError("No user named %r" % options['username'])
+
+        blocks = export(user, options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for block in blocks:
+                    f.write(block)
+        else:
+            for block in blocks:
+                self.stdout.write(block.decode('utf-8'), ending='')
@@ -0,0 +1,69 @@
+import argparse
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from todos import settings
+from todosapp import importer
+from todosapp.sharding import shard_for
+
+
+class Command(BaseCommand):
+    help = "Bulk load todos for a user from an NDJSON or CSV file (or stdin)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path', nargs='?', default='-',
+                            help="File to read, or - for stdin (the default)")
+        parser.add_argument('--format', choices=importer.FORMATS,
+                            help="Input format (default: from the file extension, else ndjson)")
+        parser.add_argument('--batch-size', type=int, default=settings.TODOS_IMPORT_BATCH_SIZE)
+        parser.add_argument('--database', help="Database to load into (default: the user's shard)")
+        parser.add_argument(
+            '--defer-indexes', action=argparse.BooleanOptionalAction, default=False,
+            help="Offline loads only: on SQLite, drop the todo indexes, which every "
+                 "user's queries use, during the load and rebuild them after. A load "
+                 "killed part way leaves them dropped."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError("No user named %r" % options['username'])
+        database = options['database'] or shard_for(user.pk)
+
+        path = options['path']
+        import_format = options['format']
+        if import_format is None:
+            import_format = 'csv' if path.endswith('.csv') else 'ndjson'
+        parse = importer.parse_csv if import_format == 'csv' else importer.parse_ndjson
+
+        def progress(result):
+            self.stderr.write("%d imported, %d rejected, %.0f rows/s" % (
+                result.imported, result.error_count, result.rows_per_second
+            ))
+
+        f = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            with importer.sqlite_bulk_load(database, options['defer_indexes']):
+                result = importer.import_todos(
+                    user,
+                    parse(importer.decode_lines(f)),
+                    options['batch_size'],
+                    progress=progress,
+                    using=database
+                )
+        finally:
+            if f is not sys.stdin.buffer:
+                f.close()
+
+        for error in result.errors:
+            self.stderr.write("line %(line)d: %(error)s" % error)
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %d todos for %s in %.2fs (%.0f rows/s), %d rejected" % (
+                result.imported, user.username, result.elapsed,
+                result.rows_per_second, result.error_count
+            )
+        ))
@@ -0,0 +1,170 @@
+import json
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+
+from todos import settings
+from todosapp.bench import format_summary, random_title, summarize
+
+OPERATIONS = ('list', 'create', 'toggle', 'rename', 'delete')
+DEFAULT_MIX = 'list=60,create=10,toggle=20,rename=5,delete=5'
+
+JSON = {'Accept': 'application/json'}
+
+
+def parse_mix(text):
+    """'list=60,create=10' -> {'list': 60, 'create': 10}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise CommandError("Unknown operation %r in --mix (choose from %s)" % (
+                name, ', '.join(OPERATIONS)
+            ))
+        try:
+            mix[name] = int(weight)
+        except ValueError:
+            raise CommandError("Invalid weight for %r in --mix" % name)
+        if mix[name] < 0:
+            raise CommandError("Invalid weight for %r in --mix" % name)
+    if not sum(mix.values()):
+        raise CommandError("--mix needs at least one positive weight")
+    return mix
+
+
+class Worker:
+    """One simulated client, logged in as one user, acting on todos it has seen"""
+
+    def __init__(self, user, rng):
+        self.client = Client()
+        self.client.force_login(user)
+        self.rng = rng
+        self.todo_ids = []
+
+    def post(self, path, data):
+        return self.client.post(path, data=json.dumps(data), content_type='application/json')
+
+    def list(self):
+        response = self.client.get('/', {'limit': 50}, headers=JSON)
+        if response.status_code == 200:
+            self.todo_ids = [todo['id'] for todo in json.loads(response.content)['todos']]
+        return response
+
+    def create(self):
+        response = self.post('/', {'title': random_title(self.rng)})
+        if response.status_code == 201:
+            self.todo_ids.append(json.loads(response.content)['id'])
+        return response
+
+    def toggle(self, todo_id):
+        return self.post('/%d/set_state' % todo_id, {'state': self.rng.random() < 0.5})
+
+    def rename(self, todo_id):
+        return self.post('/%d/update_title' % todo_id, {'title': random_title(self.rng)})
+
+    def delete(self, todo_id):
+        self.todo_ids.remove(todo_id)
+        return self.post('/%d/delete' % todo_id, {})
+
+    def request(self, operation):
+        """Run ``operation``; one needing a todo lists first when none is known"""
+        if operation in ('list', 'create'):
+            return operation, getattr(self, operation)()
+        if not self.todo_ids:
+            return 'list', self.list()
+        return operation, getattr(self, operation)(self.rng.choice(self.todo_ids))
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive a mix of list, create, toggle, rename and delete requests at "
+        "the todo views from concurrent in-process clients, as seeded users "
+        "(see seed_todos), and report throughput and latency percentiles"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help="Relative weights of each operation (default: %s)" % DEFAULT_MIX)
+        parser.add_argument('--prefix', default='seed',
+                            help="Act as the users seed_todos created with this prefix")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def run_worker(self, user, count, operations, weights, seed):
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        try:
+            worker = Worker(user, random.Random(seed))
+            for operation in worker.rng.choices(operations, weights, k=count):
+                start = time.perf_counter()
+                operation, response = worker.request(operation)
+                latencies[operation].append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors[operation] += 1
+        finally:
+            connections.close_all()
+        return latencies, errors
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        concurrency = options['concurrency']
+        if concurrency < 1 or options['requests'] < 1:
+            raise CommandError("--requests and --concurrency must be positive")
+        users = list(User.objects.filter(username__startswith='%s-' % options['prefix']))
+        if not users:
+            raise CommandError(
+                "No users named %s-*; create them with seed_todos first" % options['prefix']
+            )
+
+        rng = random.Random(options['seed'])
+        rng.shuffle(users)
+        counts = [len(range(i, options['requests'], concurrency)) for i in range(concurrency)]
+        operations, weights = zip(*mix.items())
+
+        self.stdout.write("%d requests at concurrency %d over %d users, mix %s" % (
+            options['requests'], concurrency, len(users), options['mix']
+        ))
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        # A few users writing as fast as they can: left on, the todo_write
+        # rate limits would measure 429s rather than the views
+        ratelimit = settings.TODOS_RATELIMIT
+        settings.TODOS_RATELIMIT = False
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                start = time.perf_counter()
+                with ThreadPoolExecutor(concurrency) as pool:
+                    results = pool.map(
+                        self.run_worker,
+                        [users[i % len(users)] for i in range(concurrency)],
+                        counts,
+                        [operations] * concurrency,
+                        [weights] * concurrency,
+                        [options['seed'] + i for i in range(concurrency)]
+                    )
+                    for worker_latencies, worker_errors in results:
+                        for operation, values in worker_latencies.items():
+                            latencies[operation] += values
+                        for operation, count in worker_errors.items():
+                            errors[operation] += count
+                elapsed = time.perf_counter() - start
+        finally:
+            settings.TODOS_RATELIMIT = ratelimit
+
+        for operation in OPERATIONS:
+            if latencies[operation]:
+                self.stdout.write(format_summary(
+                    operation, summarize(latencies[operation], elapsed)
+                ) + ("  %d errors" % errors[operation] if errors[operation] else ""))
+        everything = [latency for values in latencies.values() for latency in values]
+        self.stdout.write(format_summary("all", summarize(everything, elapsed)))
+        if sum(errors.values()):
+            self.stderr.write("%d requests failed" % sum(errors.values()))
@@ -0,0 +1,102 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from todos import settings
+from todosapp import sharding
+from todosapp.models import Todo, UserShard
+
+
+class Command(BaseCommand):
+    help = (
+        "Move users' todos to the shard the hash ring places them on, or "
+        "the given users to a given shard, while the app keeps serving them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                            help="Only move this user (repeatable)")
+        parser.add_argument('--to', help="Shard alias to move the given users to")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Print the moves without making them")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--grace', type=float, default=5.0,
+                            help="Seconds to wait before moving writes that raced a switch")
+
+    def logger(self, user_id):
+        return lambda message: self.stderr.write("user %d: %s" % (user_id, message))
+
+    def current_shards(self):
+        """user id -> alias for every user with todos anywhere"""
+        shards = dict(UserShard.objects.values_list('user_id', 'alias'))
+        unpinned = (
+            Todo.objects.using(DEFAULT_DB_ALIAS)
+            .exclude(user_id__in=list(shards))
+            .values_list('user_id', flat=True)
+            .distinct()
+        )
+        for user_id in unpinned:
+            shards[user_id] = DEFAULT_DB_ALIAS
+        return shards
+
+    def planned_moves(self, options):
+        shards = self.current_shards()
+        if options['usernames']:
+            users = dict(
+                User.objects.filter(username__in=options['usernames']).values_list('username', 'pk')
+            )
+            missing = set(options['usernames']) - set(users)
+            if missing:
+                raise CommandError("No user named %s" % ', '.join(sorted(missing)))
+            user_ids = sorted(users.values())
+        else:
+            if options['to']:
+                raise CommandError("--to needs --user")
+            user_ids = sorted(shards)
+
+        ring = sharding.ring()
+        for user_id in user_ids:
+            source = shards.get(user_id)
+            target = options['to'] or ring.get(user_id)
+            if source is not None and source != target:
+                yield user_id, source, target
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError("Sharding is not enabled; set TODOS_SHARDS")
+        if options['to'] and options['to'] not in settings.TODOS_SHARD_ALIASES:
+            raise CommandError("Unknown shard %r" % options['to'])
+
+        moves = []
+        # Moves an earlier run left unfinished go first
+        for move, switched in sharding.resume_moves(batch_size=options['batch_size']):
+            self.stdout.write("user %d: resuming %s -> %s" % (move.user_id, move.source, move.target))
+            if options['dry_run']:
+                continue
+            move.log = self.logger(move.user_id)
+            if not switched:
+                move.start()
+            moves.append(move)
+
+        for user_id, source, target in self.planned_moves(options):
+            self.stdout.write("user %d: %s -> %s" % (user_id, source, target))
+            if options['dry_run']:
+                continue
+            move = sharding.ShardMove(
+                user_id, source, target,
+                batch_size=options['batch_size'],
+                log=self.logger(user_id)
+            )
+            move.start()
+            moves.append(move)
+
+        if moves:
+            # One grace period covers every switch made above
+            time.sleep(options['grace'])
+            for move in moves:
+                late = move.sweep()
+                if late:
+                    move.log("%d late writes moved" % late)
+        self.stdout.write(self.style.SUCCESS("%d users moved" % len(moves)))
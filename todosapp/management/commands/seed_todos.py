@@ -0,0 +1,102 @@
+import argparse
+import itertools
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from todosapp import importer
+from todosapp.bench import random_title
+from todosapp.models import Todo
+from todosapp.sharding import shard_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Create N users with M generated todos each, using bulk inserts, "
+        "to reproduce a production-sized dataset locally"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, required=True)
+        parser.add_argument('--todos-per-user', type=int, required=True)
+        parser.add_argument('--prefix', default='seed',
+                            help="Usernames are <prefix>-<n>; reruns continue the numbering")
+        parser.add_argument('--password',
+                            help="Password for every seeded user (default: unusable)")
+        parser.add_argument('--done', type=float, default=0.3,
+                            help="Fraction of todos marked done")
+        parser.add_argument('--days', type=int, default=365,
+                            help="Spread pub_date over this many past days")
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--defer-indexes', action=argparse.BooleanOptionalAction, default=False,
+            help="Offline loads only: on SQLite, drop the todo indexes, which every "
+                 "user's queries use, during the load and rebuild them after. A load "
+                 "killed part way leaves them dropped."
+        )
+
+    def create_users(self, options):
+        prefix = options['prefix']
+        first = User.objects.filter(username__startswith='%s-' % prefix).count()
+        # Hashing is deliberately slow, so every user shares one hash
+        password = make_password(options['password'])
+        users = []
+        for start in range(first, first + options['users'], options['batch_size']):
+            stop = min(start + options['batch_size'], first + options['users'])
+            users += User.objects.bulk_create(
+                User(username='%s-%d' % (prefix, n), password=password) for n in range(start, stop)
+            )
+        return users
+
+    def todos(self, users, options, rng):
+        now = timezone.now()
+        seconds = options['days'] * 86400
+        for user in users:
+            for _ in range(options['todos_per_user']):
+                yield Todo(
+                    user_id=user.pk,
+                    title=random_title(rng),
+                    state=rng.random() < options['done'],
+                    pub_date=now - timedelta(seconds=rng.randrange(seconds or 1))
+                )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['todos_per_user'] < 0:
+            raise CommandError("--users must be positive and --todos-per-user not negative")
+        if not 0 <= options['done'] <= 1:
+            raise CommandError("--done must be between 0 and 1")
+
+        rng = random.Random(options['seed'])
+        start = time.perf_counter()
+        users = self.create_users(options)
+        self.stderr.write("%d users created" % len(users))
+
+        # Placing a user pins their shard, so do it before loading anything
+        shards = defaultdict(list)
+        for user in users:
+            shards[shard_for(user.pk)].append(user)
+
+        created = 0
+        for alias, shard_users in shards.items():
+            with importer.sqlite_bulk_load(alias, options['defer_indexes']):
+                todos = self.todos(shard_users, options, rng)
+                while batch := list(itertools.islice(todos, options['batch_size'])):
+                    with transaction.atomic(using=alias):
+                        Todo.objects.using(alias).bulk_create(batch)
+                    created += len(batch)
+                    self.stderr.write("%d todos inserted" % created)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            "Seeded %d users and %d todos in %.2fs (%.0f todos/s)" % (
+                len(users), created, elapsed, created / elapsed if elapsed else 0
+            )
+        ))
@@ -0,0 +1,226 @@
+"""
+Per-request timing and database query instrumentation.
+
+request_metrics_middleware times every request and, through a database
+execute wrapper installed on each connection as it opens, counts the
+queries run on its behalf and the time spent in them, on every alias and
+in the worker threads async views run their queries in. For views defined
+in ``TODOS_METRICS_VIEW_MODULES`` it then
+
+- adds a ``Server-Timing`` header (``db``, ``app`` and ``total``), and
+- records wall time, query count, query time and response size in
+  in-process histograms, served in the Prometheus text format by
+  ``/metrics``.
+
+``TODOS_METRICS_SAMPLE_RATE`` instruments a fraction of users, chosen by a
+hash of their id so a sampled user stays sampled; anonymous requests are
+sampled at random at the same rate.
+
+The histograms are per process, so each worker is scraped separately.
+Queries a streaming response makes after the view has returned, such as an
+export, are not attributed to its request.
+"""
+import bisect
+import contextvars
+import hashlib
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from todos import settings
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """A Prometheus-style cumulative histogram with one series per label set"""
+
+    def __init__(self, name, help, buckets, labels):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        # label values -> [count per bucket (+Inf last), sum, count]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def _label_text(self, label_values, extra=()):
+        pairs = list(zip(self.labels, label_values)) + list(extra)
+        return '{%s}' % ','.join(
+            '%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+            for name, value in pairs
+        )
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.help),
+            '# TYPE %s histogram' % self.name,
+        ]
+        with self._lock:
+            series = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in self._series.items())
+        for label_values, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket%s %d' % (
+                    self.name, self._label_text(label_values, [('le', bound)]), cumulative
+                ))
+            lines.append('%s_sum%s %r' % (self.name, self._label_text(label_values), total))
+            lines.append('%s_count%s %d' % (self.name, self._label_text(label_values), count))
+        return '\n'.join(lines) + '\n'
+
+
+REQUEST_DURATION = Histogram(
+    'todos_request_duration_seconds', 'Wall time spent handling a request.',
+    DURATION_BUCKETS, ('view', 'method')
+)
+DB_QUERIES = Histogram(
+    'todos_db_queries', 'Database queries run per request.',
+    QUERY_BUCKETS, ('view', 'method')
+)
+DB_DURATION = Histogram(
+    'todos_db_duration_seconds', 'Time spent in database queries per request.',
+    DURATION_BUCKETS, ('view', 'method')
+)
+RESPONSE_SIZE = Histogram(
+    'todos_response_size_bytes', 'Size of non-streaming response bodies.',
+    SIZE_BUCKETS, ('view', 'method')
+)
+
+HISTOGRAMS = (REQUEST_DURATION, DB_QUERIES, DB_DURATION, RESPONSE_SIZE)
+
+
+def render():
+    """All histograms in the Prometheus text exposition format"""
+    return ''.join(histogram.render() for histogram in HISTOGRAMS)
+
+
+def reset():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+
+class RequestMetrics:
+    """What one request has spent so far"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_current = contextvars.ContextVar('todos_request_metrics', default=None)
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """Database execute wrapper charging each query to the current request"""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - start
+        metrics.queries += 1
+
+
+def install_execute_wrapper(sender, connection, **kwargs):
+    """connection_created receiver: instrument every new connection"""
+    # A connection object reconnects after closing; wrap it once
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+def _sampled(request):
+    rate = settings.TODOS_METRICS_SAMPLE_RATE
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return random.random() < rate
+    digest = hashlib.md5(str(user.pk).encode('ascii')).digest()
+    return int.from_bytes(digest[:4], 'big') < rate * 2 ** 32
+
+
+def _view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None or match.func.__module__ not in settings.TODOS_METRICS_VIEW_MODULES:
+        return None
+    return match.url_name or match.func.__name__
+
+
+def _begin(request):
+    if not settings.TODOS_METRICS:
+        return None
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def _end(started):
+    if started is not None:
+        _current.reset(started[1])
+
+
+def _record(started, request, response):
+    if started is None:
+        return response
+    view = _view_label(request)
+    if view is None or not _sampled(request):
+        return response
+
+    metrics = started[0]
+    total = time.perf_counter() - metrics.start
+    REQUEST_DURATION.observe(total, view, request.method)
+    DB_QUERIES.observe(metrics.queries, view, request.method)
+    DB_DURATION.observe(metrics.db_time, view, request.method)
+    if not response.streaming:
+        RESPONSE_SIZE.observe(len(response.content), view, request.method)
+
+    response['Server-Timing'] = 'db;dur=%.2f;desc="%d queries", app;dur=%.2f, total;dur=%.2f' % (
+        metrics.db_time * 1000, metrics.queries,
+        (total - metrics.db_time) * 1000, total * 1000
+    )
+    return response
+
+
+@sync_and_async_middleware
+def request_metrics_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = _begin(request)
+            try:
+                response = await get_response(request)
+            finally:
+                _end(started)
+            return _record(started, request, response)
+    else:
+        def middleware(request):
+            started = _begin(request)
+            try:
+                response = get_response(request)
+            finally:
+                _end(started)
+            return _record(started, request, response)
+    return middleware
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.2 on 2026-10-16 22:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todosapp', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['user', '-pub_date', '-id'], name='todo_user_pub_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['user', 'state'], name='todo_user_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(condition=models.Q(('state', False)), fields=['user', '-pub_date', '-id'], name='todo_user_active_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from todosapp import search
+
+
+def create_search_index(apps, schema_editor):
+    search.create_index(schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    search.drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todosapp', '0004_todo_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
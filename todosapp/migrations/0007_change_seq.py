@@ -0,0 +1,58 @@
+# Generated by Django 5.2.2 on 2026-10-17 00:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+from todosapp import search
+
+
+def create_counters(apps, schema_editor):
+    Counter = apps.get_model('todosapp', 'Counter')
+    Counter.objects.using(schema_editor.connection.alias).bulk_create([
+        Counter(name='changes', value=0),
+        Counter(name='tombstones_pruned', value=0),
+    ])
+
+
+def create_search_index(apps, schema_editor):
+    # Adding the column rebuilds the todo table on SQLite, dropping the
+    # search triggers along with it
+    search.create_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todosapp', '0006_user_shard'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='todo',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='todotombstone',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['user', 'change_seq'], name='todo_user_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todotombstone',
+            index=models.Index(fields=['user', 'change_seq'], name='tombstone_user_change_idx'),
+        ),
+        migrations.RunPython(create_counters, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, migrations.RunPython.noop),
+    ]
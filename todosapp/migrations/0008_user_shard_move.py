@@ -0,0 +1,23 @@
+# Generated by Django 5.2.2 on 2026-10-17 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todosapp', '0007_change_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usershard',
+            name='moving_from',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='usershard',
+            name='moving_to',
+            field=models.CharField(max_length=64, null=True),
+        ),
+    ]
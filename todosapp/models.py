@@ -1,7 +1,139 @@
 
 
-from django.db import models
+import itertools
+from datetime import timedelta
+
+from django.db import connections, models, router, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from todos import settings
+
+from . import cache, events
+from .serializers import todo_data
+
+
+class Counter(models.Model):
+    """
+    A named counter, kept in each database that holds todos.
+
+    ``changes`` is the change sequence: every write to a todo or tombstone
+    advances it inside its own transaction and stamps the rows it writes
+    with the new value. The counter's row stays locked until the write
+    commits, so values are handed out in commit order and a reader that has
+    seen a value has seen every change at or below it.
+    """
+    CHANGES = 'changes'
+    # The highest change_seq among tombstones pruned so far
+    TOMBSTONES_PRUNED = 'tombstones_pruned'
+    # The last todo id handed out, when sharding is enabled
+    TODO_IDS = 'todo_ids'
+
+    name = models.CharField(max_length=32, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    @classmethod
+    def advance(cls, name, using, count=1, initial=0):
+        """
+        Add ``count`` to the counter ``name`` on ``using`` and return its new
+        value. Call it inside the transaction that uses the value. A counter
+        that does not exist yet starts at ``initial``, which may be a
+        callable that is only called then.
+        """
+        connection = connections[using]
+        if connection.features.can_return_columns_from_insert:
+            # The backend has RETURNING, so one statement does it
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'UPDATE %s SET value = value + %%s WHERE name = %%s RETURNING value'
+                    % connection.ops.quote_name(cls._meta.db_table),
+                    [count, name]
+                )
+                row = cursor.fetchone()
+            value = row and row[0]
+        else:
+            counters = cls.objects.using(using).filter(name=name)
+            value = None
+            if counters.update(value=F('value') + count):
+                value = counters.values_list('value', flat=True).get()
+        if value is None:
+            if callable(initial):
+                initial = initial()
+            value = cls.objects.using(using).create(name=name, value=initial + count).value
+        return value
+
+    @classmethod
+    def raise_to(cls, name, value, using):
+        """Set the counter ``name`` on ``using`` to ``value`` unless it is already higher"""
+        if not cls.objects.using(using).filter(name=name).update(value=Greatest('value', value)):
+            cls.objects.using(using).create(name=name, value=value)
+
+    @classmethod
+    def get(cls, name, using):
+        return cls.objects.using(using).filter(name=name).values_list('value', flat=True).first() or 0
+
+
+class TodoQuerySet(models.QuerySet):
+    """
+    Stamps change_seq on the bulk writes, which skip Todo.save().
+    bulk_update() is covered by update(), which it runs per batch.
+    """
+
+    def _advance(self):
+        self._for_write = True
+        return Counter.advance(Counter.CHANGES, self.db)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        if not objs:
+            return objs
+        with transaction.atomic(using=self.db, savepoint=False):
+            _assign_ids(objs, self.db)
+            change_seq = self._advance()
+            for obj in objs:
+                obj.change_seq = change_seq
+            return super().bulk_create(objs, *args, **kwargs)
+
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            return super().update(change_seq=self._advance(), **kwargs)
+
+
+# With sharding enabled each shard hands out todo ids from its own block,
+# by its position in TODOS_SHARD_ALIASES (so new shards go at the end).
+# Ids are then unique across shards and a todo keeps its id when its user
+# moves to another shard. default's block starts at 1, like its existing ids.
+TODO_ID_BLOCK = 1 << 40
+
+
+def allocate_todo_ids(using, count):
+    """
+    Reserve ``count`` todo ids from ``using``'s block and return the first.
+    Call it inside the transaction that uses them.
+    """
+    low = settings.TODOS_SHARD_ALIASES.index(using) * TODO_ID_BLOCK
+
+    def highest():
+        # The first allocation on a shard carries on from the ids it has
+        # used, deleted ones included
+        todos = Todo.objects.using(using).filter(pk__gt=low, pk__lt=low + TODO_ID_BLOCK)
+        deleted = TodoTombstone.objects.using(using).filter(todo_id__gt=low, todo_id__lt=low + TODO_ID_BLOCK)
+        return max(
+            todos.aggregate(highest=Max('pk'))['highest'] or low,
+            deleted.aggregate(highest=Max('todo_id'))['highest'] or low
+        )
+
+    return Counter.advance(Counter.TODO_IDS, using, count, initial=highest) - count + 1
+
+
+def _assign_ids(todos, using):
+    new = [todo for todo in todos if todo.pk is None]
+    if len(settings.TODOS_SHARD_ALIASES) < 2 or not new:
+        return
+    for todo_id, todo in enumerate(new, allocate_todo_ids(using, len(new))):
+        todo.pk = todo_id
 
 
 class Todo(models.Model):
@@ -9,4 +141,142 @@ class Todo(models.Model):
     title = models.CharField(max_length=200)
     pub_date = models.DateTimeField("date published")
     state = models.BooleanField(default=False)
+    updated_at = models.DateTimeField("date updated", auto_now=True)
+    # Counter.CHANGES when the todo was last written
+    change_seq = models.BigIntegerField(default=0)
+
+    objects = TodoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The list view and keyset pagination:
+            # WHERE user_id = ? [AND (pub_date, id) < (?, ?)]
+            # ORDER BY pub_date DESC, id DESC
+            models.Index(fields=['user', '-pub_date', '-id'], name='todo_user_pub_id_idx'),
+            # Completed/active filtering within a user's list
+            models.Index(fields=['user', 'state'], name='todo_user_state_idx'),
+            # Only incomplete todos, newest first; stays small as todos get done
+            models.Index(
+                fields=['user', '-pub_date', '-id'],
+                condition=models.Q(state=False),
+                name='todo_user_active_idx'
+            ),
+            # The list ETag: the user's newest updated_at
+            models.Index(fields=['user', 'updated_at'], name='todo_user_updated_idx'),
+            # Delta sync: WHERE user_id = ? AND change_seq > ?
+            models.Index(fields=['user', 'change_seq'], name='todo_user_change_idx'),
+        ]
+
+    def event_data(self):
+        return todo_data(self)
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = [*update_fields, 'change_seq']
+        using = kwargs.pop('using', None) or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            if adding:
+                _assign_ids([self], using)
+            self.change_seq = Counter.advance(Counter.CHANGES, using)
+            super().save(*args, using=using, **kwargs)
+        cache.invalidate_on_commit(self.user_id, using=self._state.db)
+        events.publish_on_commit(
+            self.user_id,
+            self.event_type(adding, update_fields),
+            self.event_data(),
+            using=self._state.db
+        )
+
+    @staticmethod
+    def event_type(adding, update_fields):
+        """create, state or title when the save says so, else update"""
+        if adding:
+            return 'create'
+        changed = set(update_fields or ()) - {'updated_at'}
+        if changed == {'state'}:
+            return 'state'
+        if changed == {'title'}:
+            return 'title'
+        return 'update'
+
+    def delete(self, *args, **kwargs):
+        todo_id = self.id
+        using = self._state.db
+        with transaction.atomic(using=using, savepoint=False):
+            TodoTombstone.record([(self.user_id, todo_id)], using=using)
+            result = super().delete(*args, **kwargs)
+        cache.invalidate_on_commit(self.user_id, using=using)
+        events.publish_on_commit(self.user_id, 'delete', {'id': todo_id}, using=using)
+        return result
+
+
+class TodoTombstone(models.Model):
+    """Record of a deleted todo, so syncing clients can drop their copy"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    todo_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField("date deleted", auto_now_add=True)
+    change_seq = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+            models.Index(fields=['user', 'change_seq'], name='tombstone_user_change_idx'),
+        ]
+
+    @classmethod
+    def record(cls, deleted, using=None):
+        """Record tombstones for an iterable of (user_id, todo_id) pairs"""
+        using = using or router.db_for_write(cls)
+        with transaction.atomic(using=using, savepoint=False):
+            change_seq = Counter.advance(Counter.CHANGES, using)
+            tombstones = cls.objects.using(using).bulk_create([
+                cls(user_id=user_id, todo_id=todo_id, change_seq=change_seq) for user_id, todo_id in deleted
+            ])
+            if next(_recorded) % 500 == 0:
+                cls.prune(using)
+        return tombstones
+
+    @classmethod
+    def prune(cls, using=None):
+        """
+        Drop tombstones older than TODOS_TOMBSTONE_RETENTION. A sync token
+        from before the newest one dropped can no longer be served a delta.
+        """
+        using = using or router.db_for_write(cls)
+        cutoff = timezone.now() - timedelta(seconds=settings.TODOS_TOMBSTONE_RETENTION)
+        with transaction.atomic(using=using):
+            old = cls.objects.using(using).filter(deleted_at__lt=cutoff)
+            horizon = old.aggregate(horizon=Max('change_seq'))['horizon']
+            if horizon is None:
+                return 0
+            Counter.raise_to(Counter.TOMBSTONES_PRUNED, horizon, using)
+            return old.delete()[0]
+
+
+_recorded = itertools.count(1)
+
+
+class TodoEvent(models.Model):
+    """Change event log read by events.DatabaseBroker subscribers"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    type = models.CharField(max_length=16)
+    data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='todoevent_user_id_idx'),
+            models.Index(fields=['created_at'], name='todoevent_created_idx'),
+        ]
+
 
+class UserShard(models.Model):
+    """Which database holds a user's todos when sharding is enabled"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    alias = models.CharField(max_length=64)
+    # A move in progress (sharding.ShardMove): the shard being copied to,
+    # until the switch, then the shard switched from, until the sweep
+    moving_to = models.CharField(max_length=64, null=True)
+    moving_from = models.CharField(max_length=64, null=True)
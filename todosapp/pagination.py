@@ -0,0 +1,86 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client supplies a cursor we did not issue."""
+
+
+def encode_cursor(pub_date, todo_id):
+    """
+    Encode a (pub_date, id) position as an opaque url-safe token; pub_date
+    may be a datetime or its isoformat()
+    """
+    if not isinstance(pub_date, str):
+        pub_date = pub_date.isoformat()
+    raw = json.dumps([pub_date, todo_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a token produced by encode_cursor back into (pub_date, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii'))
+        pub_date, todo_id = json.loads(raw)
+        return datetime.fromisoformat(pub_date), int(todo_id)
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def parse_limit(value, default, maximum):
+    """Parse the ``limit`` query parameter, clamping it to ``maximum``"""
+    if value is None or value == '':
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError(value)
+    return min(limit, maximum)
+
+
+def keyset_queryset(queryset, after=None):
+    """
+    Order ``queryset`` newest first and, when ``after`` is given, restrict it
+    to the rows that sort after that cursor.
+
+    The boundary is written as ``pub_date <= p AND (pub_date < p OR id < i)``
+    rather than a plain OR of the two cases, so the database sees a single
+    range on the (user, pub_date, id) index and can return rows in index
+    order without a separate sort.
+    """
+    queryset = queryset.order_by('-pub_date', '-id')
+    if after:
+        pub_date, todo_id = decode_cursor(after)
+        queryset = queryset.filter(pub_date__lte=pub_date).filter(
+            Q(pub_date__lt=pub_date) | Q(id__lt=todo_id)
+        )
+    return queryset
+
+
+def _page(rows, limit):
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        return rows, encode_cursor(last.pub_date, last.id)
+    return rows, None
+
+
+def keyset_page(queryset, after, limit):
+    """
+    Return one page of ``queryset`` newest first, plus the cursor for the
+    next page (or None when this is the last page).
+
+    Each page is a single range scan of the (user, pub_date, id) index no
+    matter how deep the client has paged.
+    """
+    return _page(list(keyset_queryset(queryset, after)[:limit + 1]), limit)
+
+
+async def akeyset_page(queryset, after, limit):
+    """Async version of keyset_page"""
+    queryset = keyset_queryset(queryset, after)[:limit + 1]
+    return _page([row async for row in queryset], limit)
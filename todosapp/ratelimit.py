@@ -0,0 +1,198 @@
+"""
+Token-bucket rate limiting for views.
+
+A view decorated with ``rate_limit(scope)`` is limited by the rates in
+``TODOS_RATE_LIMITS[scope]``, one per key its requests are counted by:
+
+- ``ip``: the client's address
+- ``username``: the username the request posts, lower-cased
+- ``user``: the logged-in user
+
+A rate such as ``'10/m'`` is a bucket of 10 tokens refilled at 10 a minute:
+a burst of 10 requests goes through, then one every 6 seconds. Each limited
+request takes a token from each of its buckets, and is answered 429 with a
+Retry-After header, before the view runs, when any of them is empty.
+
+Buckets are kept by ``TODOS_RATELIMIT_STORE``. InProcessStore, the default,
+counts per process. CacheStore keeps them in the ``TODOS_RATELIMIT_CACHE``
+cache, so workers sharing that cache (the file or db backend) share their
+limits; it costs a cache round trip per bucket, and two workers updating a
+bucket at once can let a request or two too many through.
+"""
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, JsonResponse
+from django.utils.module_loading import import_string
+
+from todos import settings
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+@functools.lru_cache(maxsize=None)
+def parse_rate(rate):
+    """'10/m' -> (capacity 10, refill 10/60 tokens per second)"""
+    count, _, period = rate.partition('/')
+    try:
+        capacity = int(count)
+        seconds = PERIODS[period]
+    except (KeyError, ValueError):
+        raise ImproperlyConfigured("Invalid rate %r" % rate)
+    if capacity < 1:
+        raise ImproperlyConfigured("Invalid rate %r" % rate)
+    return capacity, capacity / seconds
+
+
+def take_token(state, capacity, per_second, now):
+    """
+    Refill a bucket's ``(tokens, updated)`` state up to ``now`` and take a
+    token from it. Returns the new state and 0, or the seconds until a
+    token is available if the bucket is empty.
+    """
+    if state is None:
+        tokens = capacity
+    else:
+        # Clocks can step back (CacheStore compares workers' wall clocks)
+        tokens = min(capacity, state[0] + max(now - state[1], 0) * per_second)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / per_second
+
+
+class InProcessStore:
+    """Buckets in this process's memory, least recently used dropped first"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, capacity, per_second):
+        now = time.monotonic()
+        with self._lock:
+            state, retry_after = take_token(self._buckets.pop(key, None), capacity, per_second, now)
+            self._buckets[key] = state
+            while len(self._buckets) > settings.TODOS_RATELIMIT_MAX_KEYS:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    async def atake(self, key, capacity, per_second):
+        return self.take(key, capacity, per_second)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheStore:
+    """Buckets in a Django cache, shared by every worker using it"""
+
+    def _cache(self):
+        return caches[settings.TODOS_RATELIMIT_CACHE]
+
+    def take(self, key, capacity, per_second):
+        cache = self._cache()
+        cache_key = 'ratelimit:%s' % key
+        state, retry_after = take_token(cache.get(cache_key), capacity, per_second, time.time())
+        # An untouched bucket is full again after this long
+        cache.set(cache_key, state, timeout=math.ceil(capacity / per_second) + 1)
+        return retry_after
+
+    async def atake(self, key, capacity, per_second):
+        return await sync_to_async(self.take)(key, capacity, per_second)
+
+    def clear(self):
+        pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = import_string(settings.TODOS_RATELIMIT_STORE)()
+    return _store
+
+
+def _ip(request, user):
+    return request.META.get('REMOTE_ADDR') or None
+
+
+def _username(request, user):
+    return (request.POST.get('username') or '').strip().lower()[:150] or None
+
+
+def _user(request, user):
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+KEYS = {'ip': _ip, 'username': _username, 'user': _user}
+
+
+def _buckets(scope, request, user):
+    if not settings.TODOS_RATELIMIT:
+        return
+    for name, rate in settings.TODOS_RATE_LIMITS.get(scope, {}).items():
+        value = KEYS[name](request, user)
+        if value is not None:
+            yield ('%s:%s:%s' % (scope, name, value),) + parse_rate(rate)
+
+
+def check(scope, request):
+    """Take a token from each of the request's buckets; the wait if any was empty"""
+    store = get_store()
+    user = getattr(request, 'user', None)
+    return max((store.take(*bucket) for bucket in _buckets(scope, request, user)), default=0)
+
+
+async def acheck(scope, request):
+    store = get_store()
+    user = await request.auser() if hasattr(request, 'auser') else None
+    return max([await store.atake(*bucket) for bucket in _buckets(scope, request, user)], default=0)
+
+
+def too_many_requests(request, retry_after):
+    """The default rejection: 429, in JSON for JSON clients"""
+    if request.headers.get('Accept') == 'application/json' or request.content_type == 'application/json':
+        response = JsonResponse({'error': 'Too many requests'}, status=429)
+    else:
+        response = HttpResponse('Too many requests', status=429)
+    response['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+def rate_limit(scope, methods=UNSAFE_METHODS, rejected=too_many_requests):
+    """
+    Limit a view's ``methods`` requests by the rates for ``scope``; a
+    rejected request gets ``rejected(request, retry_after)`` instead.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            async def wrapper(request, *args, **kwargs):
+                if request.method in methods:
+                    retry_after = await acheck(scope, request)
+                    if retry_after:
+                        return rejected(request, retry_after)
+                return await view_func(request, *args, **kwargs)
+        else:
+            def wrapper(request, *args, **kwargs):
+                if request.method in methods:
+                    retry_after = check(scope, request)
+                    if retry_after:
+                        return rejected(request, retry_after)
+                return view_func(request, *args, **kwargs)
+
+        return functools.wraps(view_func)(wrapper)
+    return decorator
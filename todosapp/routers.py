@@ -0,0 +1,185 @@
+"""
+Read/write splitting between the primary database and a read replica.
+
+Views decorated with ``replica_reads`` (the list and detail views) run
+their GET and HEAD queries on the ``replica`` alias; every write, and every
+read anywhere else, goes to ``default``. All reads of a decorated view move
+together, so the ETag it computes describes the same snapshot as the body.
+
+A replica lags the primary, so a client that has just written keeps
+reading from the primary for ``TODOS_REPLICA_STICKY_SECONDS``:
+replica_routing_middleware notices writes made while handling a request and
+sets a short-lived cookie, and requests carrying it skip the replica.
+
+Routing is only active with ``TODOS_READ_REPLICA``, which is on when
+``TODOS_REPLICA_PATH`` points the replica alias at a replicated copy.
+
+The per-request state kept here also tells todosapp.sharding whose shard
+unhinted queries belong to.
+"""
+import contextlib
+import contextvars
+import functools
+
+from asgiref.sync import iscoroutinefunction
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.decorators import sync_and_async_middleware
+
+from todos import settings
+
+REPLICA_DB_ALIAS = 'replica'
+STICKY_COOKIE = 'todos_primary'
+
+
+class RequestRouting:
+    """Routing state for one request, shared by its sync and async parts"""
+
+    def __init__(self, request=None, user_id=None, sticky=False):
+        self.request = request
+        self.user_id = user_id
+        self.sticky = sticky
+        self.use_replica = False
+        self.wrote = False
+        # user id -> shard alias, see todosapp.sharding
+        self.shards = {}
+
+
+_routing = contextvars.ContextVar('todos_routing', default=None)
+
+
+def current_routing():
+    return _routing.get()
+
+
+def current_user_id():
+    """The id of the user the current request or user_context acts for"""
+    routing = _routing.get()
+    if routing is None:
+        return None
+    if routing.user_id is not None:
+        return routing.user_id
+    user = getattr(routing.request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+@contextlib.contextmanager
+def user_context(user_id):
+    """
+    Route queries as a request by ``user_id`` would be, for code that runs
+    outside a request, such as management commands.
+    """
+    token = _routing.set(RequestRouting(user_id=user_id))
+    try:
+        yield
+    finally:
+        _routing.reset(token)
+
+
+def _routing_enabled():
+    return settings.TODOS_READ_REPLICA or len(settings.TODOS_SHARD_ALIASES) > 1
+
+
+def reading_from_replica():
+    """True while the current request's reads are routed to the replica"""
+    routing = _routing.get()
+    return routing is not None and routing.use_replica
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if reading_from_replica():
+            return REPLICA_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        # Without this an instance read from the replica would be saved back
+        # to it, since Django defaults to the alias an instance came from
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+def _begin(request):
+    if not _routing_enabled():
+        return None
+    routing = RequestRouting(request, sticky=STICKY_COOKIE in request.COOKIES)
+    return routing, _routing.set(routing)
+
+
+def _end(started):
+    if started is not None:
+        _routing.reset(started[1])
+
+
+def _mark_sticky(started, response):
+    if started is not None and started[0].wrote and settings.TODOS_READ_REPLICA:
+        response.set_cookie(
+            STICKY_COOKIE, '1',
+            max_age=settings.TODOS_REPLICA_STICKY_SECONDS,
+            httponly=True,
+            samesite='Lax'
+        )
+    return response
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = _begin(request)
+            try:
+                response = await get_response(request)
+            finally:
+                _end(started)
+            return _mark_sticky(started, response)
+    else:
+        def middleware(request):
+            started = _begin(request)
+            try:
+                response = get_response(request)
+            finally:
+                _end(started)
+            return _mark_sticky(started, response)
+    return middleware
+
+
+def _route_reads(request):
+    routing = _routing.get()
+    if (routing is not None and settings.TODOS_READ_REPLICA and not routing.sticky
+            and request.method in ('GET', 'HEAD')):
+        routing.use_replica = True
+    return routing
+
+
+def _restore(routing):
+    if routing is not None:
+        routing.use_replica = False
+
+
+def replica_reads(view_func):
+    """Serve the view's GET and HEAD reads from the replica when allowed"""
+    if iscoroutinefunction(view_func):
+        async def wrapper(request, *args, **kwargs):
+            routing = _route_reads(request)
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                _restore(routing)
+    else:
+        def wrapper(request, *args, **kwargs):
+            routing = _route_reads(request)
+            try:
+                return view_func(request, *args, **kwargs)
+            finally:
+                _restore(routing)
+
+    return functools.wraps(view_func)(wrapper)
@@ -0,0 +1,188 @@
+"""
+Full-text search over a user's todo titles.
+
+On SQLite the titles are indexed in an external-content FTS5 table that
+reads them from todosapp_todo and is kept in step by triggers, so
+bulk_create, batch and import writes are indexed as well as save(). The
+owner's id is indexed as a token next to the title, which scopes a search
+to one user inside the index rather than by filtering every user's
+matches. Results are ranked by bm25 and every search term matches as a
+prefix, so "mil" finds "milk".
+
+Other databases, and SQLite builds without FTS5, fall back to one
+``title__icontains`` filter per term, newest first.
+
+Django rebuilds a table on SQLite by copying it and dropping the original,
+which drops the triggers with it: a migration that alters Todo must call
+create_index again afterwards.
+"""
+import base64
+import binascii
+import json
+import re
+
+from django.db import connections
+
+from .models import Todo
+from .pagination import InvalidCursor
+
+TABLE = 'todosapp_todo_fts'
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE todosapp_todo_fts USING fts5(
+        title, user_id,
+        content='todosapp_todo', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER todosapp_todo_fts_insert AFTER INSERT ON todosapp_todo BEGIN
+        INSERT INTO todosapp_todo_fts (rowid, title, user_id)
+        VALUES (new.id, new.title, new.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER todosapp_todo_fts_delete AFTER DELETE ON todosapp_todo BEGIN
+        INSERT INTO todosapp_todo_fts (todosapp_todo_fts, rowid, title, user_id)
+        VALUES ('delete', old.id, old.title, old.user_id);
+    END
+    """,
+    # Toggling state is the most common write and leaves the index alone
+    """
+    CREATE TRIGGER todosapp_todo_fts_update AFTER UPDATE OF title, user_id ON todosapp_todo BEGIN
+        INSERT INTO todosapp_todo_fts (todosapp_todo_fts, rowid, title, user_id)
+        VALUES ('delete', old.id, old.title, old.user_id);
+        INSERT INTO todosapp_todo_fts (rowid, title, user_id)
+        VALUES (new.id, new.title, new.user_id);
+    END
+    """,
+    "INSERT INTO todosapp_todo_fts (todosapp_todo_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS todosapp_todo_fts_update",
+    "DROP TRIGGER IF EXISTS todosapp_todo_fts_delete",
+    "DROP TRIGGER IF EXISTS todosapp_todo_fts_insert",
+    "DROP TABLE IF EXISTS todosapp_todo_fts",
+]
+
+# bm25 weights for (title, user_id); the user token only scopes the search
+SEARCH_SQL = """
+    SELECT t.*, bm25(todosapp_todo_fts, 1.0, 0.0) AS score
+    FROM todosapp_todo_fts
+    JOIN todosapp_todo t ON t.id = todosapp_todo_fts.rowid
+    WHERE todosapp_todo_fts MATCH %s
+    ORDER BY score, t.id
+    LIMIT %s OFFSET %s
+"""
+
+TERM_RE = re.compile(r'\w+')
+
+# Longer queries are cut short rather than rejected
+MAX_TERMS = 16
+
+
+class InvalidQuery(ValueError):
+    """Raised for a search query with nothing to search for."""
+
+
+def fts5_supported(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_index(schema_editor):
+    """(Re)build the FTS table and its triggers from the current todos"""
+    if fts5_supported(schema_editor.connection):
+        for sql in DROP_SQL + CREATE_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_index(schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SQL:
+            schema_editor.execute(sql)
+
+
+# alias -> whether the FTS table exists there
+_fts_enabled = {}
+
+
+def fts_enabled(using='default'):
+    if using not in _fts_enabled:
+        connection = connections[using]
+        _fts_enabled[using] = (
+            connection.vendor == 'sqlite'
+            and TABLE in connection.introspection.table_names()
+        )
+    return _fts_enabled[using]
+
+
+def parse_terms(text):
+    """The words to search for in ``text``, or raise InvalidQuery"""
+    terms = TERM_RE.findall(text or '')[:MAX_TERMS]
+    if not terms:
+        raise InvalidQuery(text)
+    return terms
+
+
+def title_expression(terms):
+    """
+    An FTS5 MATCH expression for titles containing a word starting with each
+    of ``terms``. Terms are quoted, so FTS5 syntax in the user's query is
+    searched for literally.
+    """
+    return 'title : (%s)' % ' '.join('"%s"*' % term for term in terms)
+
+
+def match_expression(user_id, terms):
+    """title_expression restricted to the todos of ``user_id``"""
+    return 'user_id : "%d" AND %s' % (user_id, title_expression(terms))
+
+
+def encode_offset(offset):
+    raw = json.dumps(offset).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_offset(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        offset = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise InvalidCursor(cursor)
+    return offset
+
+
+def _fts_search(user, terms, limit, offset, using):
+    return list(Todo.objects.using(using).raw(
+        SEARCH_SQL, [match_expression(user.id, terms), limit, offset]
+    ))
+
+
+def _fallback_search(user, terms, limit, offset, using):
+    queryset = Todo.objects.using(using).filter(user=user)
+    for term in terms:
+        queryset = queryset.filter(title__icontains=term)
+    return list(queryset.order_by('-pub_date', '-id')[offset:offset + limit])
+
+
+def search(user, text, limit, after=None, using='default'):
+    """
+    Return one page of ``user``'s todos matching ``text``, best match first,
+    plus the cursor for the next page (or None when this is the last page).
+    """
+    terms = parse_terms(text)
+    offset = decode_offset(after) if after else 0
+    run = _fts_search if fts_enabled(using) else _fallback_search
+    todos = run(user, terms, limit + 1, offset, using)
+    if len(todos) > limit:
+        return todos[:limit], encode_offset(offset + limit)
+    return todos, None
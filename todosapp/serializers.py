@@ -0,0 +1,190 @@
+"""
+JSON rendering of todos, shared by the views.
+
+A todo renders as ``{'id', 'title', 'state', 'pub_date'}`` with pub_date in
+``isoformat()``. Lists are read with ``values_list`` rather than as model
+instances, and on SQLite the database returns pub_date already formatted:
+Django stores it there as UTC text, one string replace away from
+isoformat(), so no datetime is parsed or formatted per row. Bodies are
+encoded with orjson when it is installed and the standard library's
+encoder otherwise.
+
+On SQLite 3.44 or later a page of the JSON list goes further: list_page()
+has the database build the whole array with ``json_group_array(... ORDER
+BY ...)`` and returns it spliced into the response body, so the rows never
+become Python objects at all. Older SQLite cannot order an aggregate's
+input, and ``TODOS_SQL_JSON = False`` turns the path off; both render pages
+from values_list instead.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import BooleanField, CharField, F, Func
+from django.db.models.functions import JSONObject
+from django.http import HttpResponse
+
+from todos import settings
+
+from .pagination import encode_cursor, keyset_queryset
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FIELDS = ('id', 'title', 'state', 'pub_date')
+
+_encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+class IsoFormat(Func):
+    """A datetime column as the string isoformat() gives for it (SQLite)"""
+    output_field = CharField()
+    # Stored as str() of the naive UTC datetime: the same digits, with a
+    # space for the T and no offset
+    template = "replace(%(expressions)s, ' ', 'T') || '+00:00'"
+
+
+class JSONBoolean(Func):
+    """A boolean column as JSON true or false inside json_object() (SQLite)"""
+    output_field = BooleanField()
+    template = "CASE WHEN %(expressions)s THEN json('true') ELSE json('false') END"
+
+
+def _sqlite(queryset):
+    return connections[queryset.db].vendor == 'sqlite'
+
+
+def sql_json(queryset):
+    """True if list_page() has the database render pages of ``queryset``"""
+    connection = connections[queryset.db]
+    # ORDER BY inside an aggregate arrived in SQLite 3.44
+    return (
+        settings.TODOS_SQL_JSON
+        and connection.vendor == 'sqlite'
+        and connection.Database.sqlite_version_info >= (3, 44)
+    )
+
+
+def todo_data(todo):
+    return {
+        'id': todo.id,
+        'title': todo.title,
+        'state': todo.state,
+        'pub_date': todo.pub_date.isoformat()
+    }
+
+
+def values(queryset, *extra):
+    """
+    ``queryset`` as tuples of FIELDS followed by ``extra`` fields, with
+    pub_date formatted by the database where it can; pass to data()
+    """
+    if _sqlite(queryset):
+        return queryset.values_list('id', 'title', 'state', IsoFormat('pub_date'), *extra)
+    return queryset.values_list(*FIELDS, *extra)
+
+
+def data(rows):
+    """Todo dicts for rows from values()"""
+    return [{
+        'id': row[0],
+        'title': row[1],
+        'state': row[2],
+        'pub_date': row[3] if isinstance(row[3], str) else row[3].isoformat()
+    } for row in rows]
+
+
+def dumps(obj):
+    """``obj`` as compact UTF-8 JSON"""
+    if orjson is not None:
+        # Anything but plain JSON types, datetimes included, is encoded the
+        # way JsonResponse would
+        return orjson.dumps(obj, default=_encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return _encoder.encode(obj).encode('utf-8')
+
+
+def json_response(obj, status=200):
+    """JsonResponse, encoded with dumps()"""
+    return HttpResponse(dumps(obj), content_type='application/json', status=status)
+
+
+def _page_sql(queryset, limit):
+    connection = connections[queryset.db]
+    ordering = queryset.query.order_by
+    columns = [field.lstrip('-') for field in ordering]
+    rows = queryset.annotate(
+        todo_json=JSONObject(
+            id=F('id'),
+            title=F('title'),
+            state=JSONBoolean('state'),
+            pub_date=IsoFormat('pub_date')
+        )
+    ).values_list('todo_json', *columns)[:limit + 1]
+    sql, params = rows.query.sql_with_params()
+    # An aggregate's input order is otherwise undefined, whatever the
+    # subquery's, so the page's ordering is repeated inside it. json() marks
+    # each row as JSON again, which it stops being outside the subquery.
+    order_by = ', '.join(
+        connection.ops.quote_name(column) + (' DESC' if field.startswith('-') else '')
+        for field, column in zip(ordering, columns)
+    )
+    return (
+        'SELECT json_group_array(json(todo_json) ORDER BY %s), count(*) FROM (%s)' % (order_by, sql),
+        params
+    )
+
+
+# Starts every element but the first; quotes in titles are escaped, so
+# it cannot occur inside one
+_ELEMENT = ',{"id":'
+
+
+def _sql_page(queryset, limit):
+    sql, params = _page_sql(queryset, limit)
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        array, count = cursor.fetchone()
+    next_cursor = None
+    if count > limit:
+        # Cut off the extra row, which only says there is a next page, and
+        # read the cursor from the row before it
+        extra = array.rindex(_ELEMENT)
+        last = json.loads(array[array.rindex('{"id":', 0, extra):extra])
+        array = array[:extra] + ']'
+        next_cursor = encode_cursor(last['pub_date'], last['id'])
+    return b'{"todos":%s,"next":%s}' % (array.encode('utf-8'), dumps(next_cursor))
+
+
+def list_page(queryset, after, limit):
+    """
+    The JSON body of one keyset page of ``queryset``, as the list view
+    returns it: ``{'todos': [...], 'next': cursor}``. Raises InvalidCursor
+    like keyset_page().
+    """
+    queryset = keyset_queryset(queryset, after)
+    if sql_json(queryset):
+        return _sql_page(queryset, limit)
+    return _rows_page(list(values(queryset)[:limit + 1]), limit)
+
+
+def _rows_page(rows, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][3], rows[-1][0])
+    return dumps({'todos': data(rows), 'next': next_cursor})
+
+
+async def alist_page(queryset, after, limit):
+    """
+    Async version of list_page. The json_group_array query is a raw cursor,
+    which Django only runs in a thread, so that path still takes one; the
+    values_list path iterates the queryset asynchronously instead.
+    """
+    queryset = keyset_queryset(queryset, after)
+    if sql_json(queryset):
+        return await sync_to_async(_sql_page)(queryset, limit)
+    return _rows_page([row async for row in values(queryset)[:limit + 1]], limit)
@@ -0,0 +1,330 @@
+"""
+Per-user sharding of the todo tables across several databases.
+
+Every todo query is scoped to one user, so a user's Todo and TodoTombstone
+rows all live on one shard (a database alias in ``TODOS_SHARD_ALIASES``,
+``default`` included) and ShardRouter sends their queries there. Users,
+sessions, UserShard and everything else stay on ``default``.
+
+Each shard hands out todo ids from its own block (models.TODO_ID_BLOCK), so
+ids are unique across shards and survive a move.
+
+Where a user lives is recorded in UserShard, which is the source of truth:
+the first time a user needs a shard they are placed by a consistent hash
+ring, or on ``default`` if they already have todos there, and pinned. Adding
+a shard therefore moves nobody until ``manage.py rebalance_shards`` moves
+the users the ring now places elsewhere.
+
+The router finds the user from the model instance a query is about or, for
+plain ``Todo.objects.filter(user=...)`` queries, from the request being
+handled (see todosapp.routers). Code outside a request either passes
+``using=shard_for(user_id)`` or runs inside ``routers.user_context``.
+
+A shard keeps a copy of its users' auth_user rows, with unusable passwords,
+so foreign keys hold and queries joining todos to their user work there.
+The admin is not shard aware and only sees ``default``.
+"""
+import bisect
+import hashlib
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+
+from todos import settings
+
+from . import cache, routers
+from .models import Counter, Todo, TodoTombstone, UserShard, allocate_todo_ids
+
+SHARDED_MODELS = {'todosapp.todo', 'todosapp.todotombstone'}
+
+# Points per shard on the hash ring; more points spread users more evenly
+RING_REPLICAS = 64
+
+
+def enabled():
+    return len(settings.TODOS_SHARD_ALIASES) > 1
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of user ids onto shard aliases"""
+
+    def __init__(self, aliases, replicas=RING_REPLICAS):
+        self.aliases = tuple(aliases)
+        points = sorted(
+            (_hash('%s:%d' % (alias, i)), alias)
+            for alias in self.aliases for i in range(replicas)
+        )
+        self._keys = [key for key, _ in points]
+        self._aliases = [alias for _, alias in points]
+
+    def get(self, user_id):
+        index = bisect.bisect(self._keys, _hash(str(user_id))) % len(self._keys)
+        return self._aliases[index]
+
+
+_ring = None
+
+
+def ring():
+    global _ring
+    aliases = tuple(settings.TODOS_SHARD_ALIASES)
+    if _ring is None or _ring.aliases != aliases:
+        _ring = HashRing(aliases)
+    return _ring
+
+
+def ensure_user_row(alias, user_id):
+    """Copy ``user_id``'s auth_user row to the shard ``alias`` if missing"""
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    username = User.objects.using(DEFAULT_DB_ALIAS).values_list(
+        'username', flat=True
+    ).get(pk=user_id)
+    User.objects.using(alias).get_or_create(
+        pk=user_id, defaults={'username': username, 'password': make_password(None)}
+    )
+
+
+def _place(user_id):
+    # Users from before sharding was enabled stay where their todos are
+    if Todo.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id).exists():
+        alias = DEFAULT_DB_ALIAS
+    else:
+        alias = ring().get(user_id)
+    ensure_user_row(alias, user_id)
+    shard, _ = UserShard.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+        user_id=user_id, defaults={'alias': alias}
+    )
+    return shard.alias
+
+
+def shard_for(user_id):
+    """The database alias holding ``user_id``'s todos"""
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    routing = routers.current_routing()
+    if routing is not None and user_id in routing.shards:
+        return routing.shards[user_id]
+    alias = UserShard.objects.using(DEFAULT_DB_ALIAS).filter(
+        user_id=user_id
+    ).values_list('alias', flat=True).first()
+    if alias is None:
+        alias = _place(user_id)
+    if routing is not None:
+        routing.shards[user_id] = alias
+    return alias
+
+
+def _user_id(hints):
+    instance = hints.get('instance')
+    if instance is not None:
+        if instance._meta.label_lower == 'auth.user':
+            return instance.pk
+        if getattr(instance, 'user_id', None) is not None:
+            return instance.user_id
+    return routers.current_user_id()
+
+
+class ShardRouter:
+    """
+    Routes sharded models to their user's shard. Any other query can ask to
+    run on a user's shard with ``db_manager(hints={'shard_user': user_id})``.
+    """
+
+    def _db(self, model, hints):
+        if not enabled():
+            return None
+        user_id = hints.get('shard_user')
+        if user_id is None:
+            if model._meta.label_lower not in SHARDED_MODELS:
+                return None
+            user_id = _user_id(hints)
+        return shard_for(user_id) if user_id is not None else None
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = settings.TODOS_SHARD_ALIASES
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+def delete_user_data(sender, instance, using, **kwargs):
+    """pre_delete receiver: drop a deleted user's rows on their shard"""
+    if not enabled() or using != DEFAULT_DB_ALIAS:
+        return
+    shard = UserShard.objects.using(DEFAULT_DB_ALIAS).filter(user=instance).first()
+    if shard is None:
+        return
+    # A move in progress has rows on a second shard
+    for alias in {shard.alias, shard.moving_to, shard.moving_from} - {None, DEFAULT_DB_ALIAS}:
+        # Cascades to the user's todos and tombstones there
+        User.objects.using(alias).filter(pk=instance.pk).delete()
+
+
+class ShardMove:
+    """
+    Move one user's todos from ``source`` to ``target`` while they keep
+    using the app.
+
+    1. Record the move in UserShard.moving_to, then copy every todo to the
+       target in batches, with no locks held.
+    2. Holding the source's write lock, copy what changed during step 1 and
+       drop what was deleted, point UserShard at the target (recording
+       moving_from) and delete the user's rows from the source. Writers to
+       the source wait (up to the busy timeout) for this short step instead
+       of failing.
+    3. After ``grace`` seconds, sweep: carry over anything a request which
+       looked up the old shard just before the switch still wrote to the
+       source, unless the target has a newer write, and clear moving_from.
+
+    Todos keep their ids, which are unique across shards (see
+    models.TODO_ID_BLOCK), and copies overwrite what is already on the
+    target, so every step can be run again. A move interrupted before the
+    switch is started again and one interrupted after it is swept; the
+    rebalance_shards command does both with resume_moves().
+    """
+
+    def __init__(self, user_id, source, target, batch_size=1000, grace=5.0, log=None):
+        self.user_id = user_id
+        self.source = source
+        self.target = target
+        self.batch_size = batch_size
+        self.grace = grace
+        self.log = log or (lambda message: None)
+        self.copied = 0
+
+    def _todos(self, alias):
+        return Todo.objects.using(alias).filter(user_id=self.user_id)
+
+    def _shard(self):
+        return UserShard.objects.using(DEFAULT_DB_ALIAS).filter(user_id=self.user_id)
+
+    def _copy(self, todos):
+        Todo.objects.using(self.target).bulk_create(
+            [
+                Todo(id=todo.id, user_id=self.user_id, title=todo.title, state=todo.state,
+                     pub_date=todo.pub_date)
+                for todo in todos
+            ],
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=['title', 'state', 'pub_date', 'updated_at', 'change_seq']
+        )
+        self.copied += len(todos)
+
+    def copy(self):
+        last_id = 0
+        while True:
+            batch = list(self._todos(self.source).filter(id__gt=last_id).order_by('id')[:self.batch_size])
+            if not batch:
+                break
+            self._copy(batch)
+            last_id = batch[-1].id
+            self.log("%d todos copied" % self.copied)
+
+    def _lock_source(self):
+        """Take the source's write lock for the rest of the transaction"""
+        connection = connections[self.source]
+        if connection.vendor == 'sqlite' and connection.transaction_mode != 'IMMEDIATE':
+            # Any write statement takes it, even one that matches no rows
+            self._todos(self.source).filter(pk=0).update(state=False)
+
+    def switch(self, since):
+        """Step 2, for changes after the source's change sequence ``since``"""
+        with transaction.atomic(using=self.source):
+            self._lock_source()
+            with transaction.atomic(using=self.target):
+                self._copy(list(self._todos(self.source).filter(change_seq__gt=since)))
+                live = set(self._todos(self.source).values_list('id', flat=True))
+                copied = set(self._todos(self.target).values_list('id', flat=True))
+                self._todos(self.target).filter(pk__in=copied - live).delete()
+            # Syncing clients resync in full after a move (sync tokens name
+            # the shard), so the source's tombstones are not carried over
+            self._shard().update(alias=self.target, moving_to=None, moving_from=self.source)
+            self._todos(self.source).delete()
+            TodoTombstone.objects.using(self.source).filter(user_id=self.user_id).delete()
+        cache.invalidate(self.user_id)
+
+    def sweep(self):
+        """Step 3; returns how many late writes it carried over"""
+        with transaction.atomic(using=self.source):
+            stragglers = list(self._todos(self.source))
+            tombstones = TodoTombstone.objects.using(self.source).filter(user_id=self.user_id)
+            deleted = dict(tombstones.values_list('todo_id', 'deleted_at'))
+            with transaction.atomic(using=self.target):
+                ids = [todo.id for todo in stragglers] + list(deleted)
+                current = dict(self._todos(self.target).filter(pk__in=ids).values_list('id', 'updated_at'))
+                dropped = set(TodoTombstone.objects.using(self.target).filter(
+                    user_id=self.user_id, todo_id__in=ids
+                ).values_list('todo_id', flat=True))
+                late = [
+                    todo for todo in stragglers
+                    if todo.id not in dropped and (todo.id not in current or todo.updated_at > current[todo.id])
+                ]
+                self._copy(late)
+                late_deletes = [
+                    todo_id for todo_id, deleted_at in deleted.items()
+                    if todo_id in current and current[todo_id] <= deleted_at
+                ]
+                if late_deletes:
+                    self._todos(self.target).filter(pk__in=late_deletes).delete()
+                    TodoTombstone.record([(self.user_id, todo_id) for todo_id in late_deletes], using=self.target)
+            self._todos(self.source).delete()
+            tombstones.delete()
+        self._shard().filter(moving_from=self.source).update(moving_from=None)
+        if late or late_deletes:
+            cache.invalidate(self.user_id)
+        return len(late) + len(late_deletes)
+
+    def start(self):
+        """Steps 1 and 2; call sweep() once the grace period has passed"""
+        UserShard.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+            user_id=self.user_id, defaults={'alias': self.source}
+        )
+        self._shard().update(moving_to=self.target)
+        ensure_user_row(self.target, self.user_id)
+        with transaction.atomic(using=self.source):
+            # Start the source's id counter, if it has not started, while it
+            # can still see the ids about to leave
+            allocate_todo_ids(self.source, 0)
+        since = Counter.get(Counter.CHANGES, self.source)
+        self.copy()
+        self.switch(since)
+        self.log("switched to %s" % self.target)
+
+    def run(self):
+        self.start()
+        time.sleep(self.grace)
+        moved = self.sweep()
+        if moved:
+            self.log("%d late writes moved" % moved)
+        return self.copied
+
+
+def resume_moves(**kwargs):
+    """
+    ShardMoves for the moves an interruption left unfinished, as
+    ``(move, switched)`` pairs: sweep() the switched ones, start() the rest.
+    ``kwargs`` go to ShardMove.
+    """
+    pending = UserShard.objects.using(DEFAULT_DB_ALIAS).filter(
+        Q(moving_to__isnull=False) | Q(moving_from__isnull=False)
+    )
+    for shard in pending:
+        if shard.moving_from is not None:
+            yield ShardMove(shard.user_id, shard.moving_from, shard.alias, **kwargs), True
+        else:
+            yield ShardMove(shard.user_id, shard.alias, shard.moving_to, **kwargs), False
@@ -0,0 +1,121 @@
+"""
+In-memory copy of the built vite app shell (vite-project/dist/index.html).
+
+The shell is read once, together with a strong ETag and gzip (and, when the
+optional ``brotli`` package is installed, brotli) encodings, and then served
+from memory. The file is only stat()ed again once ``check_interval`` seconds
+have passed, and only re-read when its mtime or size changed, so steady
+state page views make no filesystem calls at all.
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from todos import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def accepted_encodings(request):
+    """The content codings the client accepts, ignoring any with q=0"""
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if coding and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.lower())
+    return accepted
+
+
+def etag_matches(request, etag):
+    """True if the request's If-None-Match covers ``etag``"""
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags
+
+
+class ShellFile:
+    """One loaded copy of the shell and its precomputed representations"""
+
+    def __init__(self, content, stamp):
+        self.stamp = stamp
+        digest = hashlib.sha1(content).hexdigest()
+        self.variants = {None: (content, '"%s"' % digest)}
+        self.variants['gzip'] = (
+            gzip.compress(content, compresslevel=9, mtime=0),
+            '"%s-gz"' % digest
+        )
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(content), '"%s-br"' % digest)
+
+    def variant(self, request):
+        """Pick ``(encoding, content, etag)`` for what the client accepts"""
+        accepted = accepted_encodings(request)
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.variants:
+                return (encoding,) + self.variants[encoding]
+        return (None,) + self.variants[None]
+
+
+class SpaShell:
+    def __init__(self, path, check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._checked_at = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self):
+        """Return the current ShellFile, or None if the app is not built"""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self._file
+        with self._lock:
+            stamp = self._stat()
+            if stamp is None:
+                self._file = None
+            elif self._file is None or self._file.stamp != stamp:
+                with open(self.path, 'rb') as f:
+                    self._file = ShellFile(f.read(), stamp)
+            self._checked_at = now
+            return self._file
+
+    def response(self, request):
+        shell = self.get()
+        if shell is None:
+            raise Http404("vite app not found. Make sure to run 'make runvite' first.")
+
+        encoding, content, etag = shell.variant(request)
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='text/html; charset=utf-8')
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+spa_shell = SpaShell(
+    os.path.join(settings.BASE_DIR, 'vite-project', 'dist', 'index.html'),
+    settings.TODOS_DIST_CHECK_INTERVAL
+)
@@ -0,0 +1,86 @@
+import base64
+import binascii
+from datetime import datetime
+
+from . import serializers
+from .models import Counter, Todo, TodoTombstone
+
+
+class InvalidToken(ValueError):
+    """Raised when a client supplies a sync token we did not issue."""
+
+
+class ExpiredToken(Exception):
+    """
+    Raised for a token that can no longer be served a delta: the tombstones
+    it would need were pruned, the user's todos moved to another shard, or
+    it was issued before change sequences or by a database since restored.
+    The client must sync in full.
+    """
+
+
+def encode_token(alias, watermark):
+    """Encode a database alias and change sequence as an opaque url-safe token"""
+    raw = ('%d@%s' % (watermark, alias)).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_token(token):
+    """Decode a token produced by encode_token back into ``(alias, watermark)``"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        watermark, separator, alias = raw.partition('@')
+        if separator:
+            watermark = int(watermark)
+        else:
+            # Tokens used to carry an updated_at timestamp
+            datetime.fromisoformat(raw)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidToken(token)
+    if not separator:
+        raise ExpiredToken(token)
+    if watermark < 0 or not alias:
+        raise InvalidToken(token)
+    return alias, watermark
+
+
+def changes_since(user, since=None):
+    """
+    Return ``(todos, deleted_ids, token)`` for ``user``: the todos created or
+    modified after the ``(alias, watermark)`` pair ``since`` (as
+    todosapp.serializers dicts), the ids of todos deleted after it, and the
+    token the client sends back next time.
+
+    Changes are found by change_seq, which the database assigns in commit
+    order (see models.Counter). The counter is read first and every query is
+    bounded by it, so everything up to the new token is committed and
+    nothing after it is included, however writes interleave. A change made
+    meanwhile is left for the next sync. No transaction is needed for that,
+    and none is taken: on SQLite one would hold the write lock (settings use
+    IMMEDIATE transactions) and hold up every writer for the whole read.
+    Raises ExpiredToken when ``since`` cannot be served.
+
+    With no ``since`` every live todo is returned and no tombstones, which is
+    the initial full sync; the client should replace its copy wholesale.
+    """
+    todos = Todo.objects.filter(user=user).order_by('change_seq', 'id')
+    using = todos.db
+    watermark = Counter.get(Counter.CHANGES, using)
+    todos = todos.filter(change_seq__lte=watermark)
+    if since is None:
+        return serializers.data(serializers.values(todos)), [], encode_token(using, watermark)
+
+    alias, seen = since
+    # A token ahead of the counter was issued before a restore
+    if alias != using or seen > watermark:
+        raise ExpiredToken(since)
+    rows = list(serializers.values(todos.filter(change_seq__gt=seen)))
+    deleted = list(TodoTombstone.objects.using(using).filter(
+        user=user, change_seq__gt=seen, change_seq__lte=watermark
+    ).values_list('todo_id', flat=True))
+    # Checked after the tombstones are read: a prune committed before that
+    # read has raised the counter by now
+    if seen < Counter.get(Counter.TOMBSTONES_PRUNED, using):
+        raise ExpiredToken(since)
+    return serializers.data(rows), deleted, encode_token(using, watermark)
@@ -1,9 +1,44 @@
+import asyncio
+import base64
+import csv
+import gzip
+import itertools
 import json
-from django.test import TestCase, Client
-from django.urls import reverse
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.backends import BaseBackend
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections, router
+from django.db.models import QuerySet
+from django.test import AsyncClient, TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
 from django.utils import timezone
 from django.http import JsonResponse
-from .models import Todo
+from todos import settings as project_settings
+from . import (
+    assets, authcache, cache as todo_cache, events, export, hashing, idempotency, importer, metrics,
+    models, ratelimit, routers, search, serializers, sharding, spa
+)
+from .assets import AssetManifest
+from .bench import summarize
+from .events import DatabaseBroker, InProcessBroker
+from .models import Counter, Todo, TodoTombstone, UserShard
+from .pagination import keyset_queryset
+from .spa import SpaShell
+from .sync import encode_token as sync_token
 
 
 class TodoModelTest(TestCase):
@@ -615,3 +650,2412 @@ class TodoIntegrationTest(TestCase):
         self.assertEqual(data['todos'][0]['title'], "Third")
         self.assertEqual(data['todos'][1]['title'], "Second")
         self.assertEqual(data['todos'][2]['title'], "First")
+
+
+class TodoCursorPaginationTest(TestCase):
+    """Test keyset pagination of the JSON todo list"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='pager', password='password123')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        self.todos = [
+            Todo.objects.create(
+                user=self.user,
+                title=f"Todo {i}",
+                pub_date=now - timedelta(minutes=i)
+            )
+            for i in range(12)
+        ]
+        # Same timestamp as Todo 3 to exercise the id tie-breaker
+        self.twin = Todo.objects.create(
+            user=self.user,
+            title="Twin",
+            pub_date=self.todos[3].pub_date
+        )
+    
+    def fetch(self, **params):
+        response = self.client.get('/', params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+    
+    def test_walk_all_pages(self):
+        """Test that following next cursors visits every todo exactly once"""
+        seen = []
+        data = self.fetch(limit=4)
+        while True:
+            seen.extend(todo['id'] for todo in data['todos'])
+            if data['next'] is None:
+                break
+            data = self.fetch(limit=4, after=data['next'])
+        
+        self.assertEqual(len(seen), 13)
+        self.assertEqual(len(set(seen)), 13)
+        expected = list(
+            Todo.objects.filter(user=self.user)
+            .order_by('-pub_date', '-id')
+            .values_list('id', flat=True)
+        )
+        self.assertEqual(seen, expected)
+    
+    def test_default_limit(self):
+        """Test that the first page uses the default page size"""
+        data = self.fetch()
+        self.assertEqual(len(data['todos']), 5)
+        self.assertIsNotNone(data['next'])
+    
+    def test_last_page_has_no_cursor(self):
+        """Test that a page covering the remainder has a null next cursor"""
+        data = self.fetch(limit=50)
+        self.assertEqual(len(data['todos']), 13)
+        self.assertIsNone(data['next'])
+    
+    def test_only_own_todos(self):
+        """Test that pages never include another user's todos"""
+        other = User.objects.create_user(username='other', password='password123')
+        Todo.objects.create(user=other, title="Not mine", pub_date=timezone.now())
+        data = self.fetch(limit=50)
+        self.assertNotIn("Not mine", [todo['title'] for todo in data['todos']])
+    
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        response = self.client.get(
+            '/', {'after': 'not-a-cursor'}, HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', json.loads(response.content))
+    
+    def test_invalid_limit(self):
+        """Test that a non-positive or non-numeric limit is rejected"""
+        for limit in ('0', '-1', 'abc'):
+            response = self.client.get(
+                '/', {'limit': limit}, HTTP_ACCEPT='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+class ExplainQueriesCommandTest(TestCase):
+    """Test the explain_queries management command"""
+    
+    def test_plans_use_todo_indexes(self):
+        """Test that the list queries are planned against the todo indexes"""
+        User.objects.create_user(username='planner', password='password123')
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        output = out.getvalue()
+        self.assertIn("index: first page", output)
+        self.assertIn("todo_user_pub_id_idx", output)
+        self.assertIn("todo_user_active_idx", output)
+        self.assertNotIn("TEMP B-TREE", output)
+
+
+class TodoBatchViewTest(TestCase):
+    """Test the batch mutation view"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='batcher', password='password123')
+        self.client.force_login(self.user)
+        self.todo1 = Todo.objects.create(user=self.user, title="One", pub_date=timezone.now())
+        self.todo2 = Todo.objects.create(user=self.user, title="Two", pub_date=timezone.now())
+        self.todo3 = Todo.objects.create(user=self.user, title="Three", pub_date=timezone.now())
+    
+    def post_batch(self, operations):
+        return self.client.post(
+            '/batch',
+            data=json.dumps({'operations': operations}),
+            content_type='application/json',
+            HTTP_ACCEPT='application/json'
+        )
+    
+    def test_mixed_operations(self):
+        """Test creating, toggling, renaming and deleting in one batch"""
+        response = self.post_batch([
+            {'op': 'create', 'title': 'Four'},
+            {'op': 'set_state', 'id': self.todo1.id, 'state': True},
+            {'op': 'update_title', 'id': self.todo2.id, 'title': '  Two renamed  '},
+            {'op': 'delete', 'id': self.todo3.id},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content)['results']
+        self.assertEqual([r['status'] for r in results], [201, 200, 200, 200])
+        
+        self.assertTrue(Todo.objects.filter(id=results[0]['todo']['id'], title='Four').exists())
+        self.todo1.refresh_from_db()
+        self.todo2.refresh_from_db()
+        self.assertTrue(self.todo1.state)
+        self.assertEqual(self.todo2.title, 'Two renamed')
+        self.assertFalse(Todo.objects.filter(id=self.todo3.id).exists())
+    
+    def test_query_count_independent_of_batch_size(self):
+        """Test that a batch uses a fixed number of write queries"""
+        operations = [{'op': 'create', 'title': f'New {i}'} for i in range(50)]
+        operations += [
+            {'op': 'set_state', 'id': todo.id, 'state': True}
+            for todo in (self.todo1, self.todo2)
+        ]
+        operations.append({'op': 'delete', 'id': self.todo3.id})
+        # session + user, todo fetch, savepoint pair, then a change sequence
+        # bump with each of insert, update and tombstone insert, delete
+        with self.assertNumQueries(12):
+            response = self.post_batch(operations)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Todo.objects.filter(user=self.user).count(), 52)
+    
+    def test_per_operation_errors(self):
+        """Test that invalid operations are reported without blocking others"""
+        other = User.objects.create_user(username='other', password='password123')
+        foreign = Todo.objects.create(user=other, title="Foreign", pub_date=timezone.now())
+        response = self.post_batch([
+            {'op': 'set_state', 'id': foreign.id, 'state': True},
+            {'op': 'create', 'title': '   '},
+            {'op': 'explode'},
+            {'op': 'set_state', 'id': self.todo1.id, 'state': 'yes'},
+            {'op': 'delete', 'id': self.todo1.id},
+            {'op': 'update_title', 'id': self.todo1.id, 'title': 'Too late'},
+        ])
+        results = json.loads(response.content)['results']
+        self.assertEqual([r['status'] for r in results], [404, 400, 400, 400, 200, 404])
+        self.assertTrue(all('error' in r for r in results if r['status'] != 200))
+        foreign.refresh_from_db()
+        self.assertFalse(foreign.state)
+        self.assertFalse(Todo.objects.filter(id=self.todo1.id).exists())
+    
+    def test_rejects_bad_payloads(self):
+        """Test that malformed or oversized bodies are rejected"""
+        response = self.client.post('/batch', data='nope', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/batch', data=json.dumps({'operations': 'x'}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/batch')
+        self.assertEqual(response.status_code, 405)
+    
+    def test_requires_login(self):
+        """Test that anonymous batches are redirected to login"""
+        self.client.logout()
+        response = self.post_batch([{'op': 'create', 'title': 'Anon'}])
+        self.assertEqual(response.status_code, 302)
+
+
+class TodoSyncViewTest(TestCase):
+    """Test the delta sync view"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='syncer', password='password123')
+        self.client.force_login(self.user)
+        self.todo1 = Todo.objects.create(user=self.user, title="One", pub_date=timezone.now())
+        self.todo2 = Todo.objects.create(user=self.user, title="Two", pub_date=timezone.now())
+    
+    def sync(self, token=None):
+        params = {'since': token} if token else {}
+        response = self.client.get('/sync', params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+    
+    def test_full_then_empty_delta(self):
+        """Test that an initial sync returns everything and a repeat returns nothing"""
+        data = self.sync()
+        self.assertTrue(data['full'])
+        self.assertEqual({t['id'] for t in data['todos']}, {self.todo1.id, self.todo2.id})
+        
+        data = self.sync(data['token'])
+        self.assertFalse(data['full'])
+        self.assertEqual(data['todos'], [])
+        self.assertEqual(data['deleted'], [])
+    
+    def test_delta_includes_changes_and_deletes(self):
+        """Test that modified, created and deleted todos appear in the delta"""
+        token = self.sync()['token']
+        
+        self.client.post(
+            f'/{self.todo1.id}/set_state',
+            data=json.dumps({'state': True}),
+            content_type='application/json'
+        )
+        self.client.post(f'/{self.todo2.id}/delete', HTTP_ACCEPT='application/json')
+        created = self.client.post(
+            '/',
+            data=json.dumps({'title': 'Three'}),
+            content_type='application/json'
+        )
+        created_id = json.loads(created.content)['id']
+        
+        data = self.sync(token)
+        self.assertEqual([t['id'] for t in data['todos']], [self.todo1.id, created_id])
+        self.assertTrue(data['todos'][0]['state'])
+        self.assertEqual(data['deleted'], [self.todo2.id])
+        
+        data = self.sync(data['token'])
+        self.assertEqual(data['todos'], [])
+        self.assertEqual(data['deleted'], [])
+    
+    def test_batch_changes_are_synced(self):
+        """Test that batch updates and deletes bump the watermark"""
+        token = self.sync()['token']
+        self.client.post(
+            '/batch',
+            data=json.dumps({'operations': [
+                {'op': 'update_title', 'id': self.todo1.id, 'title': 'Renamed'},
+                {'op': 'delete', 'id': self.todo2.id},
+            ]}),
+            content_type='application/json'
+        )
+        data = self.sync(token)
+        self.assertEqual([t['title'] for t in data['todos']], ['Renamed'])
+        self.assertEqual(data['deleted'], [self.todo2.id])
+    
+    def test_other_users_changes_are_hidden(self):
+        """Test that a delta never includes another user's todos"""
+        token = self.sync()['token']
+        other = User.objects.create_user(username='other', password='password123')
+        foreign = Todo.objects.create(user=other, title="Foreign", pub_date=timezone.now())
+        foreign.delete()
+        data = self.sync(token)
+        self.assertEqual(data['todos'], [])
+        self.assertEqual(data['deleted'], [])
+    
+    def test_invalid_token(self):
+        """Test that a malformed token is rejected"""
+        response = self.client.get('/sync', {'since': '%%%'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_changes_at_the_same_instant(self):
+        """Test that a write stamped with the same updated_at as the last sync is not skipped"""
+        now = timezone.now()
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            self.todo1.save()
+            token = self.sync()['token']
+            self.todo2.title = 'Same instant'
+            self.todo2.save()
+        data = self.sync(token)
+        self.assertEqual([t['title'] for t in data['todos']], ['Same instant'])
+    
+    def test_changes_after_the_watermark_wait(self):
+        """Test that changes committed after the counter is read go in the next sync"""
+        token = self.sync()['token']
+        watermark = Counter.get(Counter.CHANGES, 'default')
+        deleted_id = self.todo2.id
+        self.todo1.save()
+        self.todo2.delete()
+        counter_get = Counter.get
+        
+        def stale(name, using):
+            return watermark if name == Counter.CHANGES else counter_get(name, using)
+        
+        with mock.patch.object(Counter, 'get', side_effect=stale):
+            data = self.sync(token)
+            # Even a full sync leaves todo1 for the delta after it
+            self.assertEqual(self.sync()['todos'], [])
+        self.assertEqual((data['todos'], data['deleted'], data['token']), ([], [], token))
+        data = self.sync(token)
+        self.assertEqual([t['id'] for t in data['todos']], [self.todo1.id])
+        self.assertEqual(data['deleted'], [deleted_id])
+    
+    def test_pruned_tombstones_expire_tokens(self):
+        """Test that a token older than the pruned tombstones asks for a full resync"""
+        token = self.sync()['token']
+        self.todo2.delete()
+        kept = self.sync()['token']
+        TodoTombstone.objects.update(deleted_at=timezone.now() - timedelta(days=365))
+        self.assertEqual(TodoTombstone.prune(), 1)
+        
+        response = self.client.get('/sync', {'since': token})
+        self.assertEqual(response.status_code, 410)
+        self.assertIn('full resync', json.loads(response.content)['error'])
+        # Tokens from after the pruned deletes still get deltas
+        self.assertEqual(self.sync(kept)['deleted'], [])
+    
+    def test_timestamp_token_expired(self):
+        """Test that a token from before change sequences asks for a full resync"""
+        token = base64.urlsafe_b64encode(timezone.now().isoformat().encode()).decode()
+        self.assertEqual(self.client.get('/sync', {'since': token}).status_code, 410)
+
+
+class TodoConditionalGetTest(TestCase):
+    """Test ETag handling on the JSON list and detail views"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='poller', password='password123')
+        self.client.force_login(self.user)
+        self.todo = Todo.objects.create(user=self.user, title="Polled", pub_date=timezone.now())
+    
+    def get_json(self, path, etag=None, **params):
+        headers = {'HTTP_ACCEPT': 'application/json'}
+        if etag:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        return self.client.get(path, params, **headers)
+    
+    def test_list_not_modified(self):
+        """Test that an unchanged list answers 304 with a single version query"""
+        etag = self.get_json('/')['ETag']
+        self.assertTrue(etag.startswith('"'))
+        # version stamp; the session and user are cached
+        with self.assertNumQueries(1):
+            response = self.get_json('/', etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+    
+    def test_list_etag_changes_on_write(self):
+        """Test that create, update and delete each change the list ETag"""
+        etags = {self.get_json('/')['ETag']}
+        
+        self.client.post('/', data=json.dumps({'title': 'New'}), content_type='application/json')
+        etags.add(self.get_json('/')['ETag'])
+        self.client.post(
+            f'/{self.todo.id}/update_title',
+            data=json.dumps({'title': 'Renamed'}),
+            content_type='application/json'
+        )
+        etags.add(self.get_json('/')['ETag'])
+        self.client.post(f'/{self.todo.id}/delete', HTTP_ACCEPT='application/json')
+        etags.add(self.get_json('/')['ETag'])
+        
+        self.assertEqual(len(etags), 4)
+    
+    def test_etags_follow_commit_order(self):
+        """Test that a write stamped with an earlier time still changes the ETags"""
+        Todo.objects.create(user=self.user, title='Newer', pub_date=timezone.now())
+        list_etag = self.get_json('/')['ETag']
+        detail_etag = self.get_json(f'/{self.todo.id}/')['ETag']
+        # Like a batch whose timestamp was taken before another write committed
+        Todo.objects.filter(pk=self.todo.pk).update(title='Late', updated_at=self.todo.updated_at)
+        todo_cache.invalidate(self.user.id)
+        self.assertEqual(self.get_json('/', list_etag).status_code, 200)
+        self.assertEqual(self.get_json(f'/{self.todo.id}/', detail_etag).status_code, 200)
+    
+    def test_list_etag_depends_on_page(self):
+        """Test that different pages do not share an ETag"""
+        self.assertNotEqual(self.get_json('/')['ETag'], self.get_json('/', limit=1)['ETag'])
+    
+    def test_detail_not_modified(self):
+        """Test that an unchanged detail answers 304 and a changed one 200"""
+        etag = self.get_json(f'/{self.todo.id}/')['ETag']
+        self.assertEqual(self.get_json(f'/{self.todo.id}/', etag).status_code, 304)
+        
+        self.client.post(
+            f'/{self.todo.id}/set_state',
+            data=json.dumps({'state': True}),
+            content_type='application/json'
+        )
+        response = self.get_json(f'/{self.todo.id}/', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_post_ignores_etag(self):
+        """Test that writes are not affected by conditional headers"""
+        response = self.client.post(
+            '/',
+            data=json.dumps({'title': 'Posted'}),
+            content_type='application/json',
+            HTTP_IF_NONE_MATCH='*'
+        )
+        self.assertEqual(response.status_code, 201)
+
+
+class TodoListCacheTest(TestCase):
+    """Test the per-user cache of JSON list pages"""
+    
+    def setUp(self):
+        caches['todos'].clear()
+        todo_cache.reset_stats()
+        self.client = Client()
+        self.user = User.objects.create_user(username='cached', password='password123')
+        self.client.force_login(self.user)
+        self.todo = Todo.objects.create(user=self.user, title="Cached", pub_date=timezone.now())
+    
+    def get_list(self):
+        response = self.client.get('/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+    
+    def test_second_read_is_a_hit(self):
+        """Test that a repeated list read is served without querying todos"""
+        first = self.get_list()
+        # ETag version stamp only; no todo query, and the session and user
+        # come from the auth cache
+        with self.assertNumQueries(1):
+            second = self.get_list()
+        self.assertEqual(first, second)
+        self.assertEqual(todo_cache.stats()['hits'], 1)
+        self.assertEqual(todo_cache.stats()['misses'], 1)
+    
+    def test_write_paths_invalidate(self):
+        """Test that every write view drops the cached list"""
+        writes = [
+            lambda: self.client.post(
+                '/', data=json.dumps({'title': 'Added'}), content_type='application/json'
+            ),
+            lambda: self.client.post(
+                f'/{self.todo.id}/set_state',
+                data=json.dumps({'state': True}),
+                content_type='application/json'
+            ),
+            lambda: self.client.post(
+                f'/{self.todo.id}/update_title',
+                data=json.dumps({'title': 'Renamed'}),
+                content_type='application/json'
+            ),
+            lambda: self.client.post(
+                '/batch',
+                data=json.dumps({'operations': [{'op': 'create', 'title': 'Batched'}]}),
+                content_type='application/json'
+            ),
+            lambda: self.client.post(f'/{self.todo.id}/delete', HTTP_ACCEPT='application/json'),
+        ]
+        for write in writes:
+            before = self.get_list()
+            write()
+            after = self.get_list()
+            self.assertNotEqual(before, after)
+        # Every read straight after a write missed
+        self.assertEqual(todo_cache.stats()['misses'], 1 + len(writes))
+    
+    def test_users_do_not_share_entries(self):
+        """Test that one user's cached page is never served to another"""
+        self.get_list()
+        other = User.objects.create_user(username='other', password='password123')
+        self.client.force_login(other)
+        self.assertEqual(self.get_list()['todos'], [])
+    
+    def test_stats_view_requires_staff(self):
+        """Test that the cache stats view is limited to staff"""
+        self.assertEqual(self.client.get('/cache_stats').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/cache_stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hits', json.loads(response.content))
+
+
+class SpaShellTest(TestCase):
+    """Test the in-memory vite app shell"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'index.html')
+        self.write_shell(b'<html>v1</html>')
+        self.shell = SpaShell(self.path, check_interval=0)
+        patcher = mock.patch.object(spa, 'spa_shell', self.shell)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def write_shell(self, content, mtime_offset=0):
+        with open(self.path, 'wb') as f:
+            f.write(content)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_offset))
+    
+    def test_serves_shell_with_etag(self):
+        """Test that the shell is served with a strong ETag and 304s"""
+        response = self.client.get('/vite/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'<html>v1</html>')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        
+        response = self.client.get('/vite/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+    
+    def test_gzip_variant(self):
+        """Test that gzip-capable clients get the precompressed shell"""
+        response = self.client.get('/vite/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), b'<html>v1</html>')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        
+        plain = self.client.get('/vite/', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+    
+    def test_reloads_on_build_change(self):
+        """Test that a rebuilt index.html replaces the cached copy"""
+        self.client.get('/vite/')
+        self.write_shell(b'<html>v2</html>', mtime_offset=10**9)
+        self.assertEqual(self.client.get('/vite/').content, b'<html>v2</html>')
+    
+    def test_no_filesystem_calls_between_checks(self):
+        """Test that steady-state requests do not stat or read the file"""
+        self.shell.check_interval = 3600
+        self.client.get('/vite/')
+        with mock.patch('todosapp.spa.os.stat') as stat, mock.patch('builtins.open') as opener:
+            for _ in range(3):
+                self.assertEqual(self.client.get('/vite/').status_code, 200)
+        stat.assert_not_called()
+        opener.assert_not_called()
+    
+    def test_missing_build(self):
+        """Test that a missing build is a 404"""
+        os.remove(self.path)
+        self.assertEqual(self.client.get('/vite/').status_code, 404)
+
+
+class ViteStaticTest(TestCase):
+    """Test serving of built vite assets"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.dist = os.path.join(self.tmpdir.name, 'vite-project', 'dist')
+        os.makedirs(os.path.join(self.dist, 'assets'))
+        self.body = b'console.log("hello");' * 100
+        self.write('assets/index-abc123.js', self.body)
+        self.write('vite.svg', b'<svg/>')
+        self.manifest = AssetManifest(self.dist, check_interval=0)
+        patcher = mock.patch.object(assets, 'manifest', self.manifest)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def write(self, path, content):
+        with open(os.path.join(self.dist, path), 'wb') as f:
+            f.write(content)
+    
+    def read(self, response):
+        return b''.join(response.streaming_content)
+    
+    def test_streams_file_with_cache_headers(self):
+        """Test that hashed assets are streamed and marked immutable"""
+        response = self.client.get('/vite/assets/index-abc123.js')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(self.read(response), self.body)
+        self.assertIn('javascript', response['Content-Type'])
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        
+        response = self.client.get('/vite/vite.svg')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+    
+    def test_conditional_requests(self):
+        """Test If-None-Match and If-Modified-Since"""
+        response = self.client.get('/vite/vite.svg')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        
+        self.assertEqual(
+            self.client.get('/vite/vite.svg', HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+        self.assertEqual(
+            self.client.get('/vite/vite.svg', HTTP_IF_MODIFIED_SINCE=last_modified).status_code,
+            304
+        )
+    
+    def test_precompressed_sibling(self):
+        """Test that a .gz sibling is served to clients accepting gzip"""
+        self.write('assets/index-abc123.js.gz', gzip.compress(self.body))
+        response = self.client.get('/vite/assets/index-abc123.js', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('javascript', response['Content-Type'])
+        self.assertEqual(gzip.decompress(self.read(response)), self.body)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        
+        response = self.client.get('/vite/assets/index-abc123.js')
+        self.assertFalse(response.has_header('Content-Encoding'))
+    
+    def test_byte_ranges(self):
+        """Test single byte ranges, suffix ranges and unsatisfiable ranges"""
+        url = '/vite/assets/index-abc123.js'
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.read(response), self.body[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/%d' % len(self.body))
+        self.assertEqual(response['Content-Length'], '10')
+        
+        response = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(self.read(response), self.body[-5:])
+        
+        response = self.client.get(url, HTTP_RANGE='bytes=%d-' % len(self.body))
+        self.assertEqual(response.status_code, 416)
+        
+        response = self.client.get(url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.read(response), self.body)
+    
+    def test_missing_file(self):
+        """Test that unknown paths 404"""
+        self.assertEqual(self.client.get('/vite/nope.js').status_code, 404)
+    
+    def test_unknown_paths_skip_filesystem(self):
+        """Test that lookups between build checks are served from the manifest"""
+        self.manifest.check_interval = 3600
+        self.client.get('/vite/vite.svg')
+        with mock.patch('todosapp.assets.os') as fake_os:
+            self.assertEqual(self.client.get('/vite/nope.js').status_code, 404)
+            response = self.client.get('/vite/vite.svg', HTTP_IF_NONE_MATCH='*')
+            self.assertEqual(response.status_code, 304)
+        self.assertEqual(fake_os.mock_calls, [])
+    
+    def test_paths_outside_dist(self):
+        """Test that traversal and symlinks out of dist are not served"""
+        secret = os.path.join(self.tmpdir.name, 'secret.txt')
+        with open(secret, 'w') as f:
+            f.write('secret')
+        os.symlink(secret, os.path.join(self.dist, 'link.txt'))
+        self.assertEqual(self.client.get('/vite/../secret.txt').status_code, 404)
+        self.assertEqual(self.client.get('/vite/link.txt').status_code, 404)
+    
+    def test_rescans_on_build_change(self):
+        """Test that files added by a new build are picked up"""
+        self.assertEqual(self.client.get('/vite/new.js').status_code, 404)
+        self.write('new.js', b'new')
+        self.assertEqual(self.client.get('/vite/new.js').status_code, 200)
+
+
+@override_settings(ROOT_URLCONF='todos.async_urls')
+class AsyncTodoViewsTest(TestCase):
+    """Test the native async todo views"""
+    
+    def setUp(self):
+        caches['todos'].clear()
+        self.client = AsyncClient()
+        self.user = User.objects.create_user(username='asyncer', password='password123')
+        self.client.force_login(self.user)
+        self.todo = Todo.objects.create(user=self.user, title="Async", pub_date=timezone.now())
+    
+    def test_routes_use_async_views(self):
+        """Test that the async URLconf resolves the todo views to coroutines"""
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/').func))
+        self.assertTrue(asyncio.iscoroutinefunction(resolve(f'/{self.todo.id}/delete').func))
+    
+    async def test_list_and_create(self):
+        """Test listing and creating todos"""
+        response = await self.client.post(
+            '/', data={'title': 'Created async'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        
+        response = await self.client.get('/', headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        titles = [todo['title'] for todo in json.loads(response.content)['todos']]
+        self.assertEqual(titles, ['Created async', 'Async'])
+        
+        response = await self.client.get(
+            '/', headers={'Accept': 'application/json', 'If-None-Match': response['ETag']}
+        )
+        self.assertEqual(response.status_code, 304)
+    
+    async def test_update_and_delete(self):
+        """Test set_state, update_title and delete_todo"""
+        response = await self.client.post(
+            f'/{self.todo.id}/set_state', data={'state': True}, content_type='application/json'
+        )
+        self.assertTrue(json.loads(response.content)['state'])
+        
+        response = await self.client.post(
+            f'/{self.todo.id}/update_title', data={'title': ' New '}, content_type='application/json'
+        )
+        self.assertEqual(json.loads(response.content)['title'], 'New')
+        
+        response = await self.client.post(
+            f'/{self.todo.id}/delete', headers={'Accept': 'application/json'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(await Todo.objects.filter(id=self.todo.id).aexists())
+        self.assertTrue(await TodoTombstone.objects.filter(todo_id=self.todo.id).aexists())
+    
+    async def test_detail(self):
+        """Test JSON and HTML detail, conditional GET and 404"""
+        response = await self.client.get(
+            f'/{self.todo.id}/', headers={'Accept': 'application/json'}
+        )
+        self.assertEqual(json.loads(response.content)['title'], 'Async')
+        response = await self.client.get(
+            f'/{self.todo.id}/',
+            headers={'Accept': 'application/json', 'If-None-Match': response['ETag']}
+        )
+        self.assertEqual(response.status_code, 304)
+        
+        response = await self.client.get(f'/{self.todo.id}/')
+        self.assertContains(response, 'asyncer')
+        
+        response = await self.client.get('/999999/', headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 404)
+    
+    async def test_other_users_todo(self):
+        """Test that another user's todo is not found"""
+        other = await User.objects.acreate(username='other')
+        foreign = await Todo.objects.acreate(user=other, title="Foreign", pub_date=timezone.now())
+        response = await self.client.post(
+            f'/{foreign.id}/set_state', data={'state': True}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 404)
+    
+    async def test_requires_login(self):
+        """Test that anonymous requests are redirected to login"""
+        await self.client.alogout()
+        response = await self.client.get('/', headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 302)
+
+
+class TodoEventsTest(TestCase):
+    """Test todo change events and the Server-Sent Events stream"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='password123')
+        self.broker = InProcessBroker(history=10)
+        for patcher in (
+            mock.patch.object(events, '_broker', self.broker),
+            mock.patch.object(project_settings, 'TODOS_EVENTS', True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    async def test_broker_fan_out_and_resume(self):
+        """Test that subscribers get live events and can resume from an id"""
+        first = await self.broker.subscribe(self.user.id)
+        second = await self.broker.subscribe(self.user.id)
+        other = await self.broker.subscribe(self.user.id + 1)
+        
+        event = self.broker.publish(self.user.id, 'create', {'id': 1})
+        self.broker.publish(self.user.id, 'delete', {'id': 1})
+        self.assertEqual((await first.next(1)).id, event.id)
+        self.assertEqual((await second.next(1)).type, 'create')
+        self.assertIsNone(await other.next(0.01))
+        
+        resumed = await self.broker.subscribe(self.user.id, last_event_id=event.id)
+        self.assertEqual((await resumed.next(1)).type, 'delete')
+        self.assertIsNone(await resumed.next(0.01))
+        for subscription in (first, second, other, resumed):
+            subscription.close()
+        self.assertEqual(dict(self.broker._subscribers), {})
+    
+    async def test_publish_from_another_thread(self):
+        """Test that events published by sync code on other threads are delivered"""
+        subscription = await self.broker.subscribe(self.user.id)
+        await asyncio.to_thread(self.broker.publish, self.user.id, 'title', {'id': 2})
+        self.assertEqual((await subscription.next(1)).type, 'title')
+        subscription.close()
+    
+    def test_writes_publish_typed_events(self):
+        """Test that each write view publishes its event once committed"""
+        client = Client()
+        client.force_login(self.user)
+        patcher = mock.patch.object(self.broker, 'publish', wraps=self.broker.publish)
+        publish = patcher.start()
+        self.addCleanup(patcher.stop)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(
+                '/', data=json.dumps({'title': 'Evented'}), content_type='application/json'
+            )
+        todo_id = json.loads(response.content)['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post(
+                f'/{todo_id}/set_state', data=json.dumps({'state': True}),
+                content_type='application/json'
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post(
+                f'/{todo_id}/update_title', data=json.dumps({'title': 'Renamed'}),
+                content_type='application/json'
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post(f'/{todo_id}/delete', HTTP_ACCEPT='application/json')
+        
+        published = [call.args[1:] for call in publish.call_args_list]
+        self.assertEqual([type for type, data in published], ['create', 'state', 'title', 'delete'])
+        self.assertTrue(published[1][1]['state'])
+        self.assertEqual(published[2][1]['title'], 'Renamed')
+        self.assertEqual(published[3][1], {'id': todo_id})
+    
+    def test_nothing_published_without_streams(self):
+        """Test that writes publish nothing unless this deployment serves streams"""
+        with mock.patch.object(project_settings, 'TODOS_EVENTS', False), \
+                mock.patch.object(self.broker, 'publish') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            Todo.objects.create(user=self.user, title='Quiet', pub_date=timezone.now())
+        publish.assert_not_called()
+    
+    async def test_history_follows_streams(self):
+        """Test that history is kept only while a user's stream is open or lately closed"""
+        self.broker.publish(self.user.id, 'create', {'id': 1})
+        self.assertEqual(self.broker._history, {})
+        
+        subscription = await self.broker.subscribe(self.user.id)
+        event = self.broker.publish(self.user.id, 'create', {'id': 2})
+        subscription.close()
+        self.broker.publish(self.user.id, 'delete', {'id': 2})
+        resumed = await self.broker.subscribe(self.user.id, last_event_id=event.id)
+        self.assertEqual((await resumed.next(1)).type, 'delete')
+        resumed.close()
+        
+        # Closed an hour ago
+        self.broker._idle[self.user.id] -= 3600
+        self.broker.publish(self.user.id, 'create', {'id': 3})
+        self.assertEqual((self.broker._history, dict(self.broker._idle)), ({}, {}))
+    
+    def test_database_broker(self):
+        """Test that the database broker delivers events through the table"""
+        broker = DatabaseBroker(poll_interval=0.01)
+        
+        async def scenario():
+            subscription = await broker.subscribe(self.user.id)
+            await sync_to_async(broker.publish)(self.user.id, 'create', {'id': 5})
+            event = await subscription.next(1)
+            resumed = await broker.subscribe(self.user.id, last_event_id=event.id - 1)
+            return event, await resumed.next(1), await subscription.next(0.05)
+        
+        event, resumed, nothing = async_to_sync(scenario)()
+        self.assertEqual((event.type, event.data), ('create', {'id': 5}))
+        self.assertEqual(resumed.id, event.id)
+        self.assertIsNone(nothing)
+    
+    @override_settings(ROOT_URLCONF='todos.async_urls')
+    async def test_event_stream(self):
+        """Test the SSE stream framing, heartbeat and Last-Event-ID resume"""
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        # A stream that dropped, missing the events after this one
+        (await self.broker.subscribe(self.user.id)).close()
+        earlier = self.broker.publish(self.user.id, 'create', {'id': 7})
+        self.broker.publish(self.user.id, 'title', {'id': 7, 'title': 'x'})
+        
+        with mock.patch.object(project_settings, 'TODOS_EVENTS_HEARTBEAT', 0.01):
+            response = await client.get('/events', headers={'Last-Event-ID': str(earlier.id)})
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            chunks = aiter(response.streaming_content)
+            self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+            self.assertEqual(
+                await anext(chunks),
+                b'id: %d\nevent: title\ndata: {"id":7,"title":"x"}\n\n' % (earlier.id + 1)
+            )
+            self.assertEqual(await anext(chunks), b': heartbeat\n\n')
+            await chunks.aclose()
+    
+    def test_event_stream_needs_asgi(self):
+        """Test that the WSGI routes answer /events with 501 instead of holding a thread"""
+        client = Client()
+        client.force_login(self.user)
+        response = client.get('/events')
+        self.assertEqual(response.status_code, 501)
+        self.assertIn('ASGI', json.loads(response.content)['error'])
+
+
+class TodoExportTest(TestCase):
+    """Test streaming exports of a user's todos"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='exporter', password='password123')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        Todo.objects.bulk_create(
+            Todo(user=self.user, title=f'Todo, "{i}"', pub_date=now, state=bool(i % 2))
+            for i in range(25)
+        )
+        other = User.objects.create_user(username='other', password='password123')
+        Todo.objects.create(user=other, title='Not exported', pub_date=now)
+    
+    def test_ndjson_export(self):
+        """Test that the NDJSON export streams one object per todo"""
+        response = self.client.get('/export')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('attachment', response['Content-Disposition'])
+        
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[0]['title'], 'Todo, "0"')
+        self.assertEqual(set(rows[0]), {'id', 'title', 'state', 'pub_date', 'updated_at'})
+    
+    def test_csv_export(self):
+        """Test that the CSV export has a header and quotes titles"""
+        response = self.client.get('/export', {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0], ['id', 'title', 'state', 'pub_date', 'updated_at'])
+        self.assertEqual(len(rows), 26)
+        self.assertEqual(rows[1][1], 'Todo, "0"')
+    
+    def test_reads_rows_in_chunks(self):
+        """Test that rows are fetched lazily, a chunk at a time"""
+        rows = export.export_rows(self.user, chunk_size=10)
+        self.assertEqual(len(list(itertools.islice(rows, 3))), 3)
+        blocks = list(export.blocks(('x' * 10 for _ in range(100)), block_size=64))
+        self.assertEqual(len(blocks), 15)
+        self.assertEqual(sum(map(len, blocks)), 1000)
+    
+    def test_unsupported_format(self):
+        """Test that unknown formats are rejected"""
+        self.assertEqual(self.client.get('/export', {'format': 'xml'}).status_code, 400)
+    
+    @override_settings(ROOT_URLCONF='todos.async_urls')
+    async def test_async_export(self):
+        """Test that the ASGI routes stream the same export from an async iterator"""
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        for export_format in ('ndjson', 'csv'):
+            response = await client.get('/export', {'format': export_format})
+            self.assertEqual(response['Content-Type'], export.FORMATS[export_format])
+            self.assertTrue(response.is_async)
+            content = b''.join([chunk async for chunk in response.streaming_content])
+            expected = await sync_to_async(
+                lambda: b''.join(export.export(self.user, export_format, 10))
+            )()
+            self.assertEqual(content, expected)
+        self.assertEqual((await client.get('/export', {'format': 'xml'})).status_code, 400)
+    
+    async def test_async_rows_in_chunks(self):
+        """Test that the async export never loads the queryset whole"""
+        blocks = export.aexport(self.user, 'ndjson', chunk_size=10)
+        with mock.patch.object(QuerySet, '_fetch_all', side_effect=AssertionError):
+            lines = b''.join([block async for block in blocks]).splitlines()
+        self.assertEqual(len(lines), 25)
+    
+    def test_export_command(self):
+        """Test the export_todos management command"""
+        out = StringIO()
+        call_command('export_todos', 'exporter', '--format', 'csv', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 26)
+        with self.assertRaises(CommandError):
+            call_command('export_todos', 'nobody', stdout=StringIO())
+
+
+class TodoImportTest(TestCase):
+    """Test bulk imports of todos"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='importer', password='password123')
+        self.client.force_login(self.user)
+    
+    def post_import(self, body, content_type='application/x-ndjson', **params):
+        path = '/import'
+        if params:
+            path += '?' + '&'.join(f'{k}={v}' for k, v in params.items())
+        response = self.client.post(path, data=body, content_type=content_type)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+    
+    def test_ndjson_import(self):
+        """Test importing NDJSON, including invalid lines"""
+        body = '\n'.join([
+            json.dumps({'title': 'First', 'state': True, 'pub_date': '2024-01-02T03:04:05+00:00'}),
+            '',
+            'not json',
+            json.dumps({'title': '   '}),
+            json.dumps({'title': 'Second', 'state': 'maybe'}),
+            json.dumps({'title': 'Third'}),
+        ])
+        data = self.post_import(body)
+        self.assertEqual(data['imported'], 2)
+        self.assertEqual(data['error_count'], 3)
+        self.assertEqual([e['line'] for e in data['errors']], [3, 4, 5])
+        
+        first = Todo.objects.get(user=self.user, title='First')
+        self.assertTrue(first.state)
+        self.assertEqual(first.pub_date.year, 2024)
+        self.assertFalse(Todo.objects.get(user=self.user, title='Third').state)
+    
+    def test_csv_import(self):
+        """Test importing CSV with quoted titles"""
+        body = 'title,state\n"Buy milk, eggs",1\nWalk dog,false\n'
+        data = self.post_import(body, content_type='text/csv')
+        self.assertEqual(data['imported'], 2)
+        self.assertTrue(Todo.objects.filter(user=self.user, title='Buy milk, eggs', state=True).exists())
+    
+    def test_csv_import_continues_past_bad_row(self):
+        """Test that a row the csv module rejects is reported and skipped"""
+        body = 'title\nFirst\n"%s"\nThird\n' % ('x' * (csv.field_size_limit() + 1))
+        data = self.post_import(body, content_type='text/csv')
+        self.assertEqual(data['imported'], 2)
+        self.assertEqual([e['line'] for e in data['errors']], [3])
+        self.assertIn('field limit', data['errors'][0]['error'])
+        self.assertTrue(Todo.objects.filter(user=self.user, title='Third').exists())
+    
+    def test_import_keeps_durability(self):
+        """Test that an HTTP import does not relax SQLite's fsync"""
+        with mock.patch.object(importer, 'sqlite_bulk_load') as bulk_load:
+            data = self.post_import(json.dumps({'title': 'Durable'}))
+        self.assertEqual(data['imported'], 1)
+        bulk_load.assert_not_called()
+    
+    def test_batches_are_bounded(self):
+        """Test that rows are inserted in bulk batches of the configured size"""
+        body = '\n'.join(json.dumps({'title': f'Todo {i}'}) for i in range(25))
+        sizes = []
+        bulk_create = QuerySet.bulk_create
+        
+        def record(queryset, objs, *args, **kwargs):
+            sizes.append(len(objs))
+            return bulk_create(queryset, objs, *args, **kwargs)
+        
+        with mock.patch.object(project_settings, 'TODOS_IMPORT_BATCH_SIZE', 10), \
+                mock.patch.object(QuerySet, 'bulk_create', record):
+            data = self.post_import(body)
+        self.assertEqual(data['imported'], 25)
+        self.assertEqual(sizes, [10, 10, 5])
+    
+    def test_interrupted_import_announces_committed_batches(self):
+        """Test that batches committed before a failure are invalidated and published"""
+        records = ((i, {'title': f'Todo {i}'}) for i in range(1, 26))
+        bulk_create = QuerySet.bulk_create
+        calls = itertools.count(1)
+        
+        def fail_third(queryset, objs, *args, **kwargs):
+            if next(calls) == 3:
+                raise DatabaseError('disk I/O error')
+            return bulk_create(queryset, objs, *args, **kwargs)
+        
+        broker = mock.Mock()
+        with mock.patch.object(QuerySet, 'bulk_create', fail_third), \
+                mock.patch.object(events, 'get_broker', return_value=broker), \
+                mock.patch.object(project_settings, 'TODOS_EVENTS', True), \
+                mock.patch.object(todo_cache, 'invalidate') as invalidate, \
+                self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DatabaseError):
+                importer.import_todos(self.user, records, 10)
+        self.assertEqual(Todo.objects.filter(user=self.user).count(), 20)
+        self.assertEqual(
+            broker.publish.call_args_list,
+            [mock.call(self.user.id, 'import', {'imported': 10})] * 2
+        )
+        invalidate.assert_called_with(self.user.id)
+    
+    def test_round_trip_from_export(self):
+        """Test that an export can be imported back"""
+        Todo.objects.create(user=self.user, title='Exported', pub_date=timezone.now(), state=True)
+        exported = b''.join(self.client.get('/export', {'format': 'csv'}).streaming_content)
+        data = self.post_import(exported.decode('utf-8'), content_type='text/csv')
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(Todo.objects.filter(user=self.user, title='Exported', state=True).count(), 2)
+    
+    def test_import_command_defers_indexes(self):
+        """Test the import_todos command and that deferred indexes are rebuilt"""
+        def index_names():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'todosapp_todo'"
+                )
+                return {row[0] for row in cursor.fetchall()}
+        
+        before = index_names()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('title\n' + ''.join(f'Row {i}\n' for i in range(30)))
+        self.addCleanup(os.remove, f.name)
+        
+        out, err = StringIO(), StringIO()
+        call_command(
+            'import_todos', 'importer', f.name, '--batch-size', '7', '--defer-indexes',
+            stdout=out, stderr=err
+        )
+        self.assertIn('Imported 30 todos', out.getvalue())
+        self.assertIn('rows/s', err.getvalue())
+        self.assertEqual(Todo.objects.filter(user=self.user).count(), 30)
+        self.assertEqual(index_names(), before)
+
+
+class TodoSearchTest(TestCase):
+    """Test full-text search over todo titles"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='searcher', password='password123')
+        self.other = User.objects.create_user(username='other', password='password123')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        for i, title in enumerate(['Buy milk', 'Milk milk milkshake', 'Call the dentist', 'Café visit']):
+            Todo.objects.create(user=self.user, title=title, pub_date=now + timedelta(seconds=i))
+        Todo.objects.create(user=self.other, title='Buy milk too', pub_date=now)
+    
+    def search(self, **params):
+        response = self.client.get('/search', params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+    
+    def titles(self, **params):
+        return [todo['title'] for todo in self.search(**params)['todos']]
+    
+    def test_index_is_available(self):
+        """Test that the migration built the FTS5 index on SQLite"""
+        self.assertTrue(search.fts_enabled())
+    
+    def test_ranked_prefix_search(self):
+        """Test that terms match as prefixes and better matches rank first"""
+        self.assertEqual(self.titles(q='mil'), ['Milk milk milkshake', 'Buy milk'])
+        self.assertEqual(self.titles(q='buy MIL'), ['Buy milk'])
+        self.assertEqual(self.titles(q='cafe'), ['Café visit'])
+    
+    def test_search_is_scoped_to_user(self):
+        """Test that other users' todos are never returned"""
+        self.assertNotIn('Buy milk too', self.titles(q='milk'))
+        self.assertEqual(self.titles(q='too'), [])
+    
+    def test_query_syntax_is_literal(self):
+        """Test that FTS5 operators in the query are searched for as words"""
+        self.assertEqual(self.titles(q='milk OR "dentist'), [])
+        self.assertEqual(self.titles(q='user_id: 1'), [])
+    
+    def test_index_follows_writes(self):
+        """Test that creates, title updates, bulk inserts and deletes are indexed"""
+        todo = Todo.objects.get(title='Call the dentist')
+        todo.title = 'Call the plumber'
+        todo.save(update_fields=['title', 'updated_at'])
+        self.assertEqual(self.titles(q='dentist'), [])
+        self.assertEqual(self.titles(q='plumb'), ['Call the plumber'])
+        
+        Todo.objects.bulk_create([Todo(user=self.user, title='Plumbing quote', pub_date=timezone.now())])
+        self.assertEqual(len(self.titles(q='plumb')), 2)
+        
+        todo.delete()
+        self.assertEqual(self.titles(q='plumb'), ['Plumbing quote'])
+    
+    def test_pagination(self):
+        """Test that results page through an opaque cursor"""
+        first = self.search(q='mil', limit=1)
+        self.assertEqual(len(first['todos']), 1)
+        second = self.search(q='mil', limit=1, after=first['next'])
+        self.assertEqual(len(second['todos']), 1)
+        self.assertIsNone(second['next'])
+        self.assertNotEqual(first['todos'][0]['id'], second['todos'][0]['id'])
+    
+    def test_invalid_requests(self):
+        """Test that a missing query or a bad cursor is rejected"""
+        for params in ({}, {'q': '  !! '}, {'q': 'milk', 'after': 'nope'}, {'q': 'milk', 'limit': '0'}):
+            response = self.client.get('/search', params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', json.loads(response.content))
+    
+    def test_fallback_without_fts(self):
+        """Test the icontains fallback used on databases without FTS5"""
+        with mock.patch.object(search, 'fts_enabled', return_value=False):
+            self.assertEqual(self.titles(q='mil'), ['Milk milk milkshake', 'Buy milk'])
+            self.assertEqual(self.titles(q='milk buy'), ['Buy milk'])
+            self.assertNotIn('Buy milk too', self.titles(q='milk'))
+    
+    def test_admin_search_uses_index(self):
+        """Test that the admin changelist search matches titles and usernames"""
+        admin_user = User.objects.create_superuser(username='admin', password='password123')
+        self.client.force_login(admin_user)
+        response = self.client.get('/admin/todosapp/todo/', {'q': 'milk'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        response = self.client.get('/admin/todosapp/todo/', {'q': 'other'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class SqliteTuningTest(TestCase):
+    """Test the per-connection SQLite tuning in settings.DATABASES"""
+    
+    def pragma(self, name, conn=connection):
+        with conn.cursor() as cursor:
+            cursor.execute('PRAGMA %s' % name)
+            return cursor.fetchone()[0]
+    
+    def test_connection_pragmas(self):
+        """Test that new connections get the configured pragmas and timeout"""
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('cache_size'), project_settings.TODOS_SQLITE_CACHE_SIZE)
+        self.assertEqual(self.pragma('busy_timeout'), project_settings.TODOS_SQLITE_BUSY_TIMEOUT * 1000)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+    
+    def test_file_database_uses_wal(self):
+        """Test that an on-disk database is switched to WAL with mmap enabled"""
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = connections['default'].__class__({
+                **connection.settings_dict, 'NAME': os.path.join(tmp, 'db.sqlite3')
+            })
+            try:
+                self.assertEqual(self.pragma('journal_mode', conn), 'wal')
+                self.assertEqual(self.pragma('mmap_size', conn), project_settings.TODOS_SQLITE_MMAP_SIZE)
+            finally:
+                conn.close()
+    
+    def test_persistent_connections(self):
+        """Test that connections are reused with health checks under WSGI"""
+        database = project_settings.DATABASES['default']
+        self.assertEqual(database['CONN_MAX_AGE'], project_settings.TODOS_CONN_MAX_AGE)
+        self.assertEqual(database['CONN_HEALTH_CHECKS'], project_settings.TODOS_CONN_MAX_AGE > 0)
+
+
+@mock.patch.object(project_settings, 'TODOS_READ_REPLICA', True)
+class ReplicaRoutingTest(TestCase):
+    """Test read routing to the replica alias, a second SQLite file here"""
+    
+    databases = {'default', 'replica'}
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='reader', password='password123')
+        User.objects.using('replica').create(pk=self.user.pk, username='reader')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        self.todo = Todo.objects.create(user=self.user, title='On the primary', pub_date=now)
+        # The replica has not caught up with the latest title yet
+        Todo.objects.using('replica').create(
+            pk=self.todo.pk, user_id=self.user.pk, title='On the replica', pub_date=now
+        )
+    
+    def list_titles(self, client=None):
+        response = (client or self.client).get('/', headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        return [todo['title'] for todo in json.loads(response.content)['todos']]
+    
+    def detail_title(self, client=None):
+        response = (client or self.client).get(f'/{self.todo.pk}/', headers={'Accept': 'application/json'})
+        return json.loads(response.content)['title']
+    
+    def test_list_and_detail_read_from_replica(self):
+        """Test that list and detail GETs are served by the replica"""
+        self.assertEqual(self.list_titles(), ['On the replica'])
+        self.assertEqual(self.detail_title(), 'On the replica')
+    
+    def test_reads_stick_to_primary_after_a_write(self):
+        """Test that a client reads its own writes once it has written"""
+        response = self.client.post(
+            f'/{self.todo.pk}/set_state', data={'state': True}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        cookie = response.cookies[routers.STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], project_settings.TODOS_REPLICA_STICKY_SECONDS)
+        self.assertEqual(self.list_titles(), ['On the primary'])
+        self.assertEqual(self.detail_title(), 'On the primary')
+        
+        # Another client of the same user has not written (the list page
+        # it would get is the one just cached from the primary)
+        other = Client()
+        other.force_login(self.user)
+        self.assertEqual(self.detail_title(other), 'On the replica')
+    
+    def test_reads_do_not_set_sticky_cookie(self):
+        """Test that only requests that write mark the client sticky"""
+        response = self.client.get('/', headers={'Accept': 'application/json'})
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+    
+    def test_writes_go_to_primary(self):
+        """Test that an instance read from the replica is saved to the primary"""
+        todo = Todo.objects.using('replica').get(pk=self.todo.pk)
+        self.assertEqual(router.db_for_write(Todo, instance=todo), 'default')
+        todo.title = 'Saved'
+        todo.save()
+        self.assertEqual(Todo.objects.get(pk=self.todo.pk).title, 'Saved')
+        self.assertEqual(Todo.objects.using('replica').get(pk=self.todo.pk).title, 'On the replica')
+    
+    def test_replica_pages_are_not_cached(self):
+        """Test that a page read from a lagging replica is not cached"""
+        self.list_titles()
+        content, _ = todo_cache.get_list(self.user.id, ':%d' % project_settings.TODOS_PAGE_SIZE)
+        self.assertIsNone(content)
+    
+    def test_disabled(self):
+        """Test that without TODOS_READ_REPLICA every read uses the primary"""
+        with mock.patch.object(project_settings, 'TODOS_READ_REPLICA', False):
+            self.assertEqual(self.list_titles(), ['On the primary'])
+    
+    @override_settings(ROOT_URLCONF='todos.async_urls')
+    def test_async_views(self):
+        """Test that the async list view routes the same way"""
+        client = AsyncClient()
+        async_to_sync(client.aforce_login)(self.user)
+        response = async_to_sync(client.get)('/', headers={'Accept': 'application/json'})
+        self.assertEqual([t['title'] for t in json.loads(response.content)['todos']], ['On the replica'])
+
+
+class HashRingTest(TestCase):
+    """Test the consistent hash ring that places users on shards"""
+    
+    def test_spread_and_stability(self):
+        """Test that users spread over shards and adding one moves few of them"""
+        two = sharding.HashRing(['default', 'shard1'])
+        three = sharding.HashRing(['default', 'shard1', 'shard2'])
+        placed = [two.get(user_id) for user_id in range(3000)]
+        self.assertGreater(placed.count('shard1'), 1000)
+        moved = [user_id for user_id in range(3000) if two.get(user_id) != three.get(user_id)]
+        # Only users taken by the new shard move, about a third of them
+        self.assertTrue(all(three.get(user_id) == 'shard2' for user_id in moved))
+        self.assertLess(len(moved), 1500)
+
+
+# Declared by todos.test_settings
+TEST_SHARDS = [alias for alias in ('default', 'shard1') if alias in project_settings.DATABASES]
+
+
+@skipUnless(len(TEST_SHARDS) > 1, 'Run with --settings=todos.test_settings for a second shard')
+@mock.patch.object(project_settings, 'TODOS_SHARD_ALIASES', TEST_SHARDS)
+class ShardingTest(TestCase):
+    """Test per-user sharding of todos, with shard1 a second SQLite file"""
+    
+    databases = set(TEST_SHARDS)
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='sharded', password='password123')
+        self.client.force_login(self.user)
+    
+    def pin(self, user, alias):
+        UserShard.objects.create(user=user, alias=alias)
+        sharding.ensure_user_row(alias, user.pk)
+    
+    def legacy_todo(self, user, title):
+        # Written before sharding was enabled
+        with mock.patch.object(project_settings, 'TODOS_SHARD_ALIASES', ['default']):
+            return Todo.objects.create(user=user, title=title, pub_date=timezone.now())
+    
+    def post_json(self, path, data):
+        return self.client.post(path, data=json.dumps(data), content_type='application/json')
+    
+    def get_json(self, path, **params):
+        return self.client.get(path, params, headers={'Accept': 'application/json'})
+    
+    def test_placement(self):
+        """Test that new users follow the ring and existing data stays put"""
+        alias = sharding.shard_for(self.user.pk)
+        self.assertEqual(alias, sharding.ring().get(self.user.pk))
+        self.assertEqual(UserShard.objects.get(user=self.user).alias, alias)
+        
+        legacy = User.objects.create_user(username='legacy')
+        self.legacy_todo(legacy, 'Old')
+        self.assertEqual(sharding.shard_for(legacy.pk), 'default')
+    
+    def test_views_use_the_users_shard(self):
+        """Test that every todo endpoint reads and writes the user's shard"""
+        self.pin(self.user, 'shard1')
+        response = self.post_json('/', {'title': 'Sharded milk'})
+        self.assertEqual(response.status_code, 201)
+        todo_id = json.loads(response.content)['id']
+        self.assertTrue(Todo.objects.using('shard1').filter(pk=todo_id, user=self.user).exists())
+        self.assertFalse(Todo.objects.using('default').exists())
+        
+        response = self.get_json('/')
+        self.assertEqual([t['title'] for t in json.loads(response.content)['todos']], ['Sharded milk'])
+        self.assertEqual(self.get_json('/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get('/', headers={
+            'Accept': 'application/json', 'If-None-Match': response['ETag']
+        }).status_code, 304)
+        self.assertEqual(self.get_json(f'/{todo_id}/').status_code, 200)
+        self.assertEqual(self.post_json(f'/{todo_id}/set_state', {'state': True}).status_code, 200)
+        self.assertTrue(Todo.objects.using('shard1').get(pk=todo_id).state)
+        
+        search_results = json.loads(self.get_json('/search', q='mil').content)['todos']
+        self.assertEqual([t['id'] for t in search_results], [todo_id])
+        exported = b''.join(self.client.get('/export').streaming_content)
+        self.assertIn(b'Sharded milk', exported)
+        
+        response = self.post_json('/batch', {'operations': [
+            {'op': 'create', 'title': 'Batched'},
+            {'op': 'delete', 'id': todo_id},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(Todo.objects.using('shard1').values_list('title', flat=True)), ['Batched']
+        )
+        self.assertTrue(TodoTombstone.objects.using('shard1').filter(todo_id=todo_id).exists())
+        
+        sync = json.loads(self.get_json('/sync').content)
+        self.assertEqual([t['title'] for t in sync['todos']], ['Batched'])
+        self.assertFalse(Todo.objects.using('default').exists())
+    
+    @override_settings(ROOT_URLCONF='todos.async_urls')
+    def test_async_views(self):
+        """Test that the async views route to the user's shard too"""
+        self.pin(self.user, 'shard1')
+        Todo.objects.using('shard1').create(user=self.user, title='Async', pub_date=timezone.now())
+        client = AsyncClient()
+        async_to_sync(client.aforce_login)(self.user)
+        response = async_to_sync(client.get)('/', headers={'Accept': 'application/json'})
+        self.assertEqual([t['title'] for t in json.loads(response.content)['todos']], ['Async'])
+    
+    def test_rebalance_moves_user(self):
+        """Test moving a user's todos to another shard"""
+        kept = self.legacy_todo(self.user, 'Kept')
+        gone = self.legacy_todo(self.user, 'Gone')
+        gone.delete()
+        token = json.loads(self.get_json('/sync').content)['token']
+        
+        out = StringIO()
+        call_command('rebalance_shards', '--user', 'sharded', '--to', 'shard1', '--grace', '0',
+                     stdout=out, stderr=StringIO())
+        self.assertIn('default -> shard1', out.getvalue())
+        
+        self.assertEqual(UserShard.objects.get(user=self.user).alias, 'shard1')
+        self.assertFalse(Todo.objects.using('default').filter(user=self.user).exists())
+        self.assertFalse(TodoTombstone.objects.using('default').filter(user=self.user).exists())
+        moved = Todo.objects.using('shard1').get(user=self.user)
+        self.assertEqual((moved.id, moved.title), (kept.id, 'Kept'))
+        self.assertIsNone(UserShard.objects.get(user=self.user).moving_from)
+        
+        # Change sequences are per database: a syncing client starts over
+        self.assertEqual(self.get_json('/sync', since=token).status_code, 410)
+        sync = json.loads(self.get_json('/sync').content)
+        self.assertEqual([t['id'] for t in sync['todos']], [kept.id])
+        self.assertEqual([t['title'] for t in json.loads(self.get_json('/').content)['todos']], ['Kept'])
+    
+    def test_ids_unique_across_shards(self):
+        """Test that each shard hands out todo ids from its own block"""
+        legacy = self.legacy_todo(self.user, 'Legacy')
+        self.pin(self.user, 'default')
+        other = User.objects.create_user(username='elsewhere')
+        self.pin(other, 'shard1')
+        on_default = Todo.objects.create(user=self.user, title='Default', pub_date=timezone.now())
+        on_shard = Todo.objects.using('shard1').create(user_id=other.pk, title='Shard', pub_date=timezone.now())
+        bulk = Todo.objects.using('shard1').bulk_create([
+            Todo(user_id=other.pk, title='Bulk', pub_date=timezone.now())
+        ])
+        self.assertEqual(on_default.id, legacy.id + 1)
+        self.assertEqual(on_shard.id, models.TODO_ID_BLOCK + 1)
+        self.assertEqual(bulk[0].id, models.TODO_ID_BLOCK + 2)
+    
+    def test_interrupted_move_before_switch_resumes(self):
+        """Test that a move stopped while copying is started again"""
+        todo = self.legacy_todo(self.user, 'Half copied')
+        move = sharding.ShardMove(self.user.pk, 'default', 'shard1')
+        UserShard.objects.create(user=self.user, alias='default', moving_to='shard1')
+        sharding.ensure_user_row('shard1', self.user.pk)
+        move.copy()
+        todo.title = 'Renamed since'
+        todo.save()
+        
+        out = StringIO()
+        call_command('rebalance_shards', '--grace', '0', '--user', 'sharded', '--to', 'shard1',
+                     stdout=out, stderr=StringIO())
+        self.assertIn('resuming default -> shard1', out.getvalue())
+        shard = UserShard.objects.get(user=self.user)
+        self.assertEqual((shard.alias, shard.moving_to, shard.moving_from), ('shard1', None, None))
+        self.assertEqual(
+            list(Todo.objects.using('shard1').values_list('id', 'title')), [(todo.id, 'Renamed since')]
+        )
+        self.assertFalse(Todo.objects.using('default').exists())
+    
+    def test_interrupted_move_after_switch_is_swept(self):
+        """Test that a move stopped after pointing UserShard at the target is finished"""
+        first = self.legacy_todo(self.user, 'Stale')
+        second = self.legacy_todo(self.user, 'Deleted on target')
+        sharding.ensure_user_row('shard1', self.user.pk)
+        sharding.ShardMove(self.user.pk, 'default', 'shard1').copy()
+        # The switch committed on default but not on the source
+        UserShard.objects.create(user=self.user, alias='shard1', moving_from='default')
+        copy = Todo.objects.using('shard1').get(pk=first.id)
+        copy.title = 'Renamed on target'
+        copy.save()
+        Todo.objects.using('shard1').get(pk=second.id).delete()
+        
+        call_command('rebalance_shards', '--grace', '0', stdout=StringIO(), stderr=StringIO())
+        self.assertIsNone(UserShard.objects.get(user=self.user).moving_from)
+        self.assertEqual(
+            list(Todo.objects.using('shard1').values_list('id', 'title')), [(first.id, 'Renamed on target')]
+        )
+        self.assertFalse(Todo.objects.using('default').exists())
+    
+    def test_rebalance_follows_ring(self):
+        """Test that without --to users move to their ring placement"""
+        self.pin(self.user, 'shard1' if sharding.ring().get(self.user.pk) == 'default' else 'default')
+        Todo.objects.create(user=self.user, title='Somewhere', pub_date=timezone.now())
+        out = StringIO()
+        call_command('rebalance_shards', '--dry-run', stdout=out)
+        self.assertIn('user %d:' % self.user.pk, out.getvalue())
+        self.assertEqual(Todo.objects.using(sharding.shard_for(self.user.pk)).count(), 1)
+        
+        call_command('rebalance_shards', '--grace', '0', stdout=StringIO(), stderr=StringIO())
+        alias = sharding.ring().get(self.user.pk)
+        self.assertEqual(UserShard.objects.get(user=self.user).alias, alias)
+        self.assertEqual(Todo.objects.using(alias).get(user=self.user).title, 'Somewhere')
+    
+    def test_late_writes_are_swept(self):
+        """Test that a write which raced the switch is moved afterwards"""
+        self.legacy_todo(self.user, 'Early')
+        move = sharding.ShardMove(self.user.pk, 'default', 'shard1', grace=0)
+        move.start()
+        Todo.objects.using('default').create(user=self.user, title='Late', pub_date=timezone.now())
+        self.assertEqual(move.sweep(), 1)
+        self.assertEqual(
+            sorted(Todo.objects.using('shard1').values_list('title', flat=True)), ['Early', 'Late']
+        )
+        self.assertFalse(Todo.objects.using('default').exists())
+    
+    def test_deleting_user_deletes_shard_data(self):
+        """Test that deleting a user removes their rows on their shard"""
+        self.pin(self.user, 'shard1')
+        Todo.objects.using('shard1').create(user_id=self.user.pk, title='Orphan?', pub_date=timezone.now())
+        self.user.delete()
+        self.assertFalse(Todo.objects.using('shard1').exists())
+        self.assertFalse(User.objects.using('shard1').exists())
+
+
+class RequestMetricsTest(TestCase):
+    """Test the request timing middleware, Server-Timing and /metrics"""
+    
+    def setUp(self):
+        metrics.reset()
+        self.client = Client()
+        self.user = User.objects.create_user(username='timed', password='password123')
+        self.client.force_login(self.user)
+        Todo.objects.create(user=self.user, title='Measure me', pub_date=timezone.now())
+    
+    def server_timing(self, response):
+        return dict(
+            (part.split(';')[0].strip(), part) for part in response['Server-Timing'].split(',')
+        )
+    
+    def test_server_timing_counts_queries(self):
+        """Test that Server-Timing reports every query the request ran"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/', headers={'Accept': 'application/json'})
+        timing = self.server_timing(response)
+        self.assertIn('desc="%d queries"' % len(queries), timing['db'])
+        self.assertIn('total;dur=', timing['total'])
+        self.assertIn('app;dur=', timing['app'])
+    
+    @override_settings(ROOT_URLCONF='todos.async_urls')
+    def test_async_view_queries_are_counted(self):
+        """Test that queries async views run in worker threads are counted"""
+        client = AsyncClient()
+        async_to_sync(client.aforce_login)(self.user)
+        response = async_to_sync(client.get)('/', headers={'Accept': 'application/json'})
+        self.assertNotIn('desc="0 queries"', response['Server-Timing'])
+    
+    def test_histograms(self):
+        """Test that instrumented views are recorded and others are not"""
+        self.client.get('/', headers={'Accept': 'application/json'})
+        self.client.get('/')
+        Client().get('/login/')
+        response = Client().get('/admin/login/')
+        self.assertFalse(response.has_header('Server-Timing'))
+        
+        text = metrics.render()
+        self.assertIn('todos_request_duration_seconds_count{view="index",method="GET"} 2', text)
+        self.assertIn('todos_db_queries_count{view="login",method="GET"} 1', text)
+        self.assertIn('todos_response_size_bytes_bucket{view="index",method="GET",le="+Inf"} 2', text)
+        self.assertNotIn('admin', text)
+    
+    def test_histogram_buckets(self):
+        """Test that buckets are cumulative and bounds are inclusive"""
+        histogram = metrics.Histogram('example', 'Example.', (1, 5), ('view',))
+        for value in (0, 1, 3, 9):
+            histogram.observe(value, 'a')
+        text = histogram.render()
+        self.assertIn('example_bucket{view="a",le="1"} 2', text)
+        self.assertIn('example_bucket{view="a",le="5"} 3', text)
+        self.assertIn('example_bucket{view="a",le="+Inf"} 4', text)
+        self.assertIn('example_sum{view="a"} 13', text)
+    
+    def test_sampling_is_per_user(self):
+        """Test that a user is either always or never sampled"""
+        with mock.patch.object(project_settings, 'TODOS_METRICS_SAMPLE_RATE', 0.5):
+            sampled = [
+                self.client.get('/', headers={'Accept': 'application/json'}).has_header('Server-Timing')
+                for _ in range(5)
+            ]
+        self.assertIn(sampled, ([True] * 5, [False] * 5))
+        with mock.patch.object(project_settings, 'TODOS_METRICS_SAMPLE_RATE', 0):
+            self.assertFalse(self.client.get('/').has_header('Server-Timing'))
+    
+    def test_metrics_endpoint_access(self):
+        """Test that /metrics is only served to staff or with the token"""
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with mock.patch.object(project_settings, 'TODOS_METRICS_TOKEN', 'secret'):
+            response = Client().get('/metrics', headers={'Authorization': 'Bearer secret'})
+            self.assertEqual(Client().get('/metrics', headers={'Authorization': 'Bearer nope'}).status_code, 403)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE todos_request_duration_seconds histogram', response.content.decode())
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Exact query budgets per endpoint, so an N+1 or a stray extra query
+    fails here. The first request of a session also pays for the session
+    and the user, which are then cached; events are published after
+    commit, which never happens in a TestCase.
+    """
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='budget', password='password123')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        Todo.objects.bulk_create(
+            Todo(user=self.user, title=f'Budget {i}', pub_date=now - timedelta(minutes=i))
+            for i in range(20)
+        )
+        self.todo = Todo.objects.filter(user=self.user).first()
+        # Checked once per process and alias
+        search.fts_enabled()
+        caches[project_settings.TODOS_CACHE_ALIAS].clear()
+    
+    def get_json(self, path, **params):
+        return self.client.get(path, params, headers={'Accept': 'application/json'})
+    
+    def post_json(self, path, data):
+        return self.client.post(path, data=json.dumps(data), content_type='application/json')
+    
+    def test_list(self):
+        """Test the list's budget, cached or not, and that it ignores page size"""
+        # session, user, version stamp, page
+        with self.assertNumQueries(4):
+            self.get_json('/', limit=2)
+        todo_cache.invalidate(self.user.id)
+        # version stamp, page: only todo rows once authentication is cached
+        with self.assertNumQueries(2):
+            self.get_json('/', limit=20)
+        # version stamp
+        with self.assertNumQueries(1):
+            self.get_json('/', limit=20)
+    
+    def test_detail(self):
+        """Test the detail view's budget"""
+        # session, user, version stamp, todo
+        with self.assertNumQueries(4):
+            self.get_json(f'/{self.todo.id}/')
+    
+    def test_create(self):
+        """Test creating a todo"""
+        # session, user, change sequence, insert
+        with self.assertNumQueries(4):
+            self.post_json('/', {'title': 'Counted'})
+    
+    def test_set_state(self):
+        """Test toggling a todo"""
+        # session, user, todo, change sequence, update
+        with self.assertNumQueries(5):
+            self.post_json(f'/{self.todo.id}/set_state', {'state': True})
+    
+    def test_update_title(self):
+        """Test renaming a todo"""
+        # session, user, todo, change sequence, update
+        with self.assertNumQueries(5):
+            self.post_json(f'/{self.todo.id}/update_title', {'title': 'Renamed'})
+    
+    def test_delete(self):
+        """Test deleting a todo"""
+        # session, user, todo, change sequence, tombstone, delete
+        with self.assertNumQueries(6):
+            self.post_json(f'/{self.todo.id}/delete', {})
+    
+    def test_sync(self):
+        """Test full and incremental sync"""
+        # session, user, change sequence, todos
+        with self.assertNumQueries(4):
+            token = json.loads(self.get_json('/sync').content)['token']
+        # change sequence, pruned sequence, tombstones, todos
+        with self.assertNumQueries(4):
+            self.get_json('/sync', since=token)
+    
+    def test_search(self):
+        """Test a search"""
+        # session, user, search
+        with self.assertNumQueries(3):
+            self.get_json('/search', q='budget')
+    
+    def test_export(self):
+        """Test that an export reads its rows in chunks"""
+        # session, user
+        with self.assertNumQueries(2):
+            response = self.client.get('/export')
+        # the rows, in one chunk
+        with self.assertNumQueries(1):
+            b''.join(response.streaming_content)
+
+
+# Latency budgets: p50 milliseconds over PERF_ROUNDS requests by one user
+# who owns the whole seeded dataset. Wall-clock timings depend on the
+# machine and its load, so they only run when TODOS_PERF_SIZES picks the
+# dataset sizes (make testperf adds 1000000 for the full run);
+# TODOS_PERF_LATENCY_SCALE loosens or tightens every budget for slower or
+# faster machines. The query budgets above always run.
+PERF_SIZES = [int(size) for size in os.environ.get('TODOS_PERF_SIZES', '10,10000').split(',')]
+PERF_LATENCY_SCALE = float(os.environ.get('TODOS_PERF_LATENCY_SCALE', '1'))
+PERF_ROUNDS = 20
+PERF_BUDGETS_MS = {
+    'list': 15,
+    'list_cached': 10,
+    'detail': 10,
+    'set_state': 10,
+    'sync': 10,
+    # bm25 ranks every match, ~1000 of them at 1M todos
+    'search': 150,
+}
+
+
+@skipUnless('TODOS_PERF_SIZES' in os.environ, 'Set TODOS_PERF_SIZES, or run make testperf')
+class LatencyBudgetTest(TestCase):
+    """Time the main endpoints over growing datasets against PERF_BUDGETS_MS"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='timed', password='password123')
+        self.client.force_login(self.user)
+        self.seeded = 0
+    
+    def seed(self, size):
+        now = timezone.now()
+        for start in range(self.seeded, size, 10000):
+            Todo.objects.bulk_create(
+                Todo(user=self.user, title=f'Seeded todo {i} ref{i % 997}', pub_date=now)
+                for i in range(start, min(start + 10000, size))
+            )
+        self.seeded = size
+    
+    def requests(self):
+        """endpoint -> (make one request, undo any state it leaves behind)"""
+        todo = Todo.objects.filter(user=self.user).order_by('-id').first()
+        token = sync_token('default', Counter.get(Counter.CHANGES, 'default'))
+        accept = {'Accept': 'application/json'}
+        
+        def uncache():
+            todo_cache.invalidate(self.user.id)
+        
+        return {
+            'list': (lambda: self.client.get('/', headers=accept), uncache),
+            'list_cached': (lambda: self.client.get('/', headers=accept), None),
+            'detail': (lambda: self.client.get(f'/{todo.id}/', headers=accept), None),
+            'set_state': (lambda: self.client.post(
+                f'/{todo.id}/set_state', data='{"state": true}', content_type='application/json'
+            ), None),
+            'sync': (lambda: self.client.get('/sync', {'since': token}, headers=accept), None),
+            'search': (lambda: self.client.get('/search', {'q': 'ref42'}, headers=accept), None),
+        }
+    
+    def test_latency_budgets(self):
+        """Test that every endpoint stays within budget at every dataset size"""
+        for size in sorted(PERF_SIZES):
+            self.seed(size)
+            for endpoint, (request, reset) in self.requests().items():
+                latencies = []
+                for _ in range(PERF_ROUNDS):
+                    if reset:
+                        reset()
+                    start = time.perf_counter()
+                    response = request()
+                    latencies.append(time.perf_counter() - start)
+                    self.assertLess(response.status_code, 400)
+                p50 = summarize(latencies, sum(latencies))['p50']
+                budget = PERF_BUDGETS_MS[endpoint] * PERF_LATENCY_SCALE
+                with self.subTest(size=size, endpoint=endpoint):
+                    self.assertLessEqual(
+                        p50, budget, "%s p50 %.1f ms over %.1f ms with %d todos" % (endpoint, p50, budget, size)
+                    )
+
+
+class SeedTodosTest(TestCase):
+    """Test the seed_todos management command"""
+    
+    def test_seed(self):
+        """Test that users and their todos are created, and reruns add more"""
+        out = StringIO()
+        call_command('seed_todos', '--users', '3', '--todos-per-user', '4', '--password', 'pw123456',
+                     stdout=out, stderr=StringIO())
+        self.assertIn('Seeded 3 users and 12 todos', out.getvalue())
+        users = User.objects.filter(username__startswith='seed-').order_by('id')
+        self.assertEqual([user.username for user in users], ['seed-0', 'seed-1', 'seed-2'])
+        self.assertTrue(users[0].check_password('pw123456'))
+        for user in users:
+            self.assertEqual(Todo.objects.filter(user=user).count(), 4)
+        self.assertFalse(Todo.objects.filter(title='').exists())
+        
+        call_command('seed_todos', '--users', '1', '--todos-per-user', '2',
+                     stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(User.objects.get(username='seed-3').has_usable_password())
+        self.assertEqual(Todo.objects.count(), 14)
+
+
+class LoadTestCommandTest(TransactionTestCase):
+    """Test the loadtest management command"""
+    
+    def test_loadtest(self):
+        """Test a short run reports every operation in the mix"""
+        call_command('seed_todos', '--users', '2', '--todos-per-user', '5',
+                     stdout=StringIO(), stderr=StringIO())
+        out = StringIO()
+        err = StringIO()
+        call_command('loadtest', '--requests', '40', '--concurrency', '1',
+                     '--mix', 'list=1,create=1,toggle=1,rename=1,delete=1', stdout=out, stderr=err)
+        output = out.getvalue()
+        for operation in ('list', 'create', 'toggle', 'rename', 'delete', 'all'):
+            self.assertIn('\n%s ' % operation, '\n' + output)
+        self.assertIn('all                              40 req', output)
+        self.assertEqual(err.getvalue(), '')
+    
+    @mock.patch.object(project_settings, 'TODOS_RATE_LIMITS', {'todo_write': {'user': '1/m'}})
+    def test_rate_limits_lifted_for_the_run(self):
+        """Test that the write limits do not turn the run's requests away, and come back after"""
+        call_command('seed_todos', '--users', '1', '--todos-per-user', '5',
+                     stdout=StringIO(), stderr=StringIO())
+        err = StringIO()
+        call_command('loadtest', '--requests', '10', '--concurrency', '1', '--mix', 'create=1',
+                     stdout=StringIO(), stderr=err)
+        self.assertEqual(err.getvalue(), '')
+        self.assertTrue(project_settings.TODOS_RATELIMIT)
+    
+    def test_invalid_options(self):
+        """Test that a bad mix or missing seed data is reported"""
+        with self.assertRaises(CommandError):
+            call_command('loadtest', '--mix', 'list=1,explode=2')
+        with self.assertRaises(CommandError):
+            call_command('loadtest', '--mix', 'list=0')
+        with self.assertRaisesMessage(CommandError, 'seed_todos'):
+            call_command('loadtest', '--prefix', 'nobody')
+
+
+class AuthCacheTest(TestCase):
+    """Test the process-local session and user cache"""
+    
+    def setUp(self):
+        authcache.sessions.clear()
+        ratelimit.get_store().clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='cached', password='password123')
+        self.client.post('/login/', {'username': 'cached', 'password': 'password123'})
+        Todo.objects.create(user=self.user, title='Warm', pub_date=timezone.now())
+    
+    def get_json(self, path):
+        return self.client.get(path, headers={'Accept': 'application/json'})
+    
+    def test_warm_list_only_queries_todos(self):
+        """Test that a warm list request reads nothing but todo tables"""
+        self.get_json('/')
+        todo_cache.invalidate(self.user.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_json('/')
+        self.assertEqual(json.loads(response.content)['todos'][0]['title'], 'Warm')
+        self.assertEqual(len(queries), 2)
+        for query in queries:
+            self.assertNotIn('django_session', query['sql'])
+            self.assertNotIn('auth_user', query['sql'])
+    
+    @override_settings(ROOT_URLCONF='todos.async_urls')
+    def test_async_views_use_cache(self):
+        """Test that the async views resolve the user from the cache too"""
+        client = AsyncClient()
+        client.cookies = self.client.cookies
+        async_to_sync(client.get)('/', headers={'Accept': 'application/json'})
+        todo_cache.invalidate(self.user.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = async_to_sync(client.get)('/', headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if 'django_session' in q['sql'] or 'FROM "auth_user"' in q['sql']])
+    
+    def test_logout_invalidates(self):
+        """Test that logging out drops the cached session"""
+        self.get_json('/')
+        stale = self.client.cookies['sessionid'].value
+        self.client.post('/logout/')
+        # Replaying the old cookie must not find a cached login
+        self.client.cookies['sessionid'] = stale
+        self.assertEqual(self.get_json('/').status_code, 302)
+    
+    def test_password_change_invalidates(self):
+        """Test that changing the password logs out other cached sessions"""
+        self.get_json('/')
+        self.user.set_password('new-password')
+        self.user.save()
+        self.assertEqual(self.get_json('/').status_code, 302)
+    
+    def test_ttl_and_disable(self):
+        """Test that entries expire and a zero TTL bypasses the cache"""
+        self.get_json('/')
+        with mock.patch.object(authcache.time, 'monotonic', return_value=authcache.time.monotonic() + 3600):
+            # session, user, version stamp
+            with self.assertNumQueries(3):
+                self.get_json('/')
+        with mock.patch.object(project_settings, 'TODOS_AUTH_CACHE_TTL', 0):
+            with self.assertNumQueries(3):
+                self.get_json('/')
+    
+    def test_lru_eviction(self):
+        """Test that the least recently used session is evicted first"""
+        cache = authcache.SessionCache()
+        with mock.patch.object(project_settings, 'TODOS_AUTH_CACHE_SIZE', 2):
+            expires = timezone.now() + timedelta(days=1)
+            cache.set_session('a', {'n': 1}, expires)
+            cache.set_session('b', {'n': 2}, expires)
+            cache.session('a')
+            cache.set_user('c', self.user)
+        self.assertEqual(cache.session('a'), {'n': 1})
+        self.assertIsNone(cache.session('b'))
+        self.assertEqual(cache.user('c').pk, self.user.pk)
+        cache.delete_user(self.user.pk)
+        self.assertIsNone(cache.user('c'))
+        self.assertEqual(len(cache), 1)
+
+
+class DenyHasherBackend(BaseBackend):
+    """Turns away the user 'hasher' before any other backend is asked"""
+    
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username == 'hasher':
+            raise PermissionDenied
+        return None
+
+
+class PasswordHashingTest(TestCase):
+    """Test login and signup hashing off the request thread"""
+    
+    def setUp(self):
+        ratelimit.get_store().clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='hasher', password='password123')
+    
+    def login(self, password='password123'):
+        return self.client.post('/login/', {'username': 'hasher', 'password': password})
+    
+    def test_login_hashes_in_pool(self):
+        """Test that logging in checks the password on a hashing thread"""
+        threads = []
+        check = hashing._check
+        
+        def record(*args):
+            threads.append(threading.current_thread().name)
+            return check(*args)
+        
+        with mock.patch.object(hashing, '_check', record):
+            response = self.login()
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertTrue(threads[0].startswith('todos-hash'))
+        self.assertEqual(self.client.get('/', headers={'Accept': 'application/json'}).status_code, 200)
+    
+    def test_wrong_password_and_unknown_user(self):
+        """Test that failed logins are rejected, unknown users after hashing too"""
+        response = self.login('wrong-password')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Invalid username or password.')
+        with mock.patch.object(hashing.hashers, 'make_password', wraps=hashing.hashers.make_password) as make:
+            response = self.client.post('/login/', {'username': 'nobody', 'password': 'password123'})
+        self.assertContains(response, 'Invalid username or password.')
+        make.assert_called_once_with('password123')
+    
+    def test_configured_backends_are_honored(self):
+        """Test that login goes through AUTHENTICATION_BACKENDS, not just the model backend"""
+        backends = ['todosapp.tests.DenyHasherBackend', 'todosapp.hashing.PooledModelBackend']
+        with override_settings(AUTHENTICATION_BACKENDS=backends):
+            response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Invalid username or password.')
+        failed = mock.Mock()
+        user_login_failed.connect(failed)
+        self.addCleanup(user_login_failed.disconnect, failed)
+        self.login('wrong-password')
+        failed.assert_called_once()
+    
+    def test_outdated_hash_is_upgraded(self):
+        """Test that a password stored with an older hasher is rehashed on login"""
+        self.user.password = make_password('password123', hasher='pbkdf2_sha1')
+        self.user.save()
+        self.assertRedirects(self.login(), '/', fetch_redirect_response=False)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+    
+    def test_signup(self):
+        """Test that signing up stores a usable hash and logs the user in"""
+        response = self.client.post('/signup/', {
+            'username': 'newbie', 'password': 'secret123', 'password_confirm': 'secret123',
+            'email': 'New@EXAMPLE.com'
+        })
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        user = User.objects.get(username='newbie')
+        self.assertTrue(user.check_password('secret123'))
+        self.assertEqual(user.email, 'New@example.com')
+        self.assertEqual(self.client.get('/', headers={'Accept': 'application/json'}).status_code, 200)
+    
+    @mock.patch.object(project_settings, 'TODOS_HASH_WORKERS', 1)
+    @mock.patch.object(project_settings, 'TODOS_HASH_QUEUE', 0)
+    def test_saturated_pool_answers_503(self):
+        """Test that logins and signups are turned away while the pool is full"""
+        with mock.patch.object(hashing, '_pending', 1):
+            response = self.login()
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertContains(response, 'Too many sign-ins', status_code=503)
+            response = self.client.post('/signup/', {
+                'username': 'late', 'password': 'secret123', 'password_confirm': 'secret123'
+            })
+            self.assertEqual(response.status_code, 503)
+        self.assertFalse(User.objects.filter(username='late').exists())
+        self.assertRedirects(self.login(), '/', fetch_redirect_response=False)
+
+
+class RateLimitTest(TestCase):
+    """Test the token-bucket rate limits on login, signup and todo writes"""
+    
+    def setUp(self):
+        ratelimit.get_store().clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='limited', password='password123')
+    
+    def login(self, username='limited', password='password123', **extra):
+        return self.client.post('/login/', {'username': username, 'password': password}, **extra)
+    
+    def test_parse_rate(self):
+        """Test that rates parse to a capacity and a refill per second"""
+        self.assertEqual(ratelimit.parse_rate('10/m'), (10, 10 / 60))
+        self.assertEqual(ratelimit.parse_rate('2/s'), (2, 2))
+        for rate in ('10', 'ten/m', '10/w', '0/s'):
+            with self.assertRaises(ImproperlyConfigured):
+                ratelimit.parse_rate(rate)
+    
+    def test_bucket_refills(self):
+        """Test that a bucket allows a burst, then refills at its rate"""
+        state = None
+        for _ in range(3):
+            state, wait = ratelimit.take_token(state, 3, 1.0, 100.0)
+            self.assertEqual(wait, 0)
+        state, wait = ratelimit.take_token(state, 3, 1.0, 100.0)
+        self.assertEqual(wait, 1.0)
+        state, wait = ratelimit.take_token(state, 3, 1.0, 100.5)
+        self.assertAlmostEqual(wait, 0.5)
+        state, wait = ratelimit.take_token(state, 3, 1.0, 101.0)
+        self.assertEqual(wait, 0)
+    
+    def test_clock_stepping_back(self):
+        """Test that an earlier clock reading refills nothing rather than draining the bucket"""
+        state, _ = ratelimit.take_token(None, 3, 1.0, 100.0)
+        # A worker whose wall clock is 50 seconds behind the last one's
+        state, wait = ratelimit.take_token(state, 3, 1.0, 50.0)
+        self.assertEqual(wait, 0)
+        self.assertEqual(state[0], 1)
+        state, wait = ratelimit.take_token(state, 3, 1.0, 50.0)
+        self.assertEqual(wait, 0)
+        self.assertEqual(ratelimit.take_token(state, 3, 1.0, 50.0)[1], 1.0)
+    
+    @mock.patch.object(project_settings, 'TODOS_RATE_LIMITS', {'login': {'ip': '2/m'}})
+    # Stop the clock, or slow hashing refills the bucket between logins
+    @mock.patch.object(ratelimit, 'time', mock.Mock(monotonic=lambda: 1000.0, time=lambda: 1000.0))
+    def test_login_rejected_before_hashing(self):
+        """Test that a throttled login is answered 429 without checking the password"""
+        self.login(password='wrong')
+        self.login(password='wrong')
+        with mock.patch.object(hashing, '_check') as check:
+            response = self.login()
+        check.assert_not_called()
+        self.assertContains(response, 'Too many attempts', status_code=429)
+        self.assertEqual(response['Retry-After'], '30')
+        # The form itself is not limited
+        self.assertEqual(self.client.get('/login/').status_code, 200)
+        # Other addresses have their own bucket
+        self.assertEqual(self.login(REMOTE_ADDR='10.0.0.2').status_code, 302)
+    
+    @mock.patch.object(project_settings, 'TODOS_RATE_LIMITS', {'login': {'username': '1/m'}})
+    def test_login_username_bucket(self):
+        """Test that guesses at one username are limited across addresses"""
+        self.assertEqual(self.login(password='wrong', REMOTE_ADDR='10.0.0.1').status_code, 200)
+        self.assertEqual(self.login(username='LIMITED', REMOTE_ADDR='10.0.0.2').status_code, 429)
+        self.assertEqual(self.login(username='other', password='wrong').status_code, 200)
+    
+    @mock.patch.object(project_settings, 'TODOS_RATE_LIMITS', {'signup': {'ip': '1/h'}})
+    def test_signup_limited(self):
+        """Test that signups from one address are limited"""
+        data = {'password': 'secret123', 'password_confirm': 'secret123'}
+        self.client.post('/signup/', dict(data, username='first'))
+        self.client.logout()
+        response = self.client.post('/signup/', dict(data, username='second'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3600')
+        self.assertFalse(User.objects.filter(username='second').exists())
+    
+    @mock.patch.object(project_settings, 'TODOS_RATE_LIMITS', {'todo_write': {'user': '1/m'}})
+    def test_todo_writes_limited_per_user(self):
+        """Test that todo writes answer JSON 429s once a user's bucket is empty"""
+        todo = Todo.objects.create(user=self.user, title='Busy', pub_date=timezone.now())
+        self.client.force_login(self.user)
+        path = '/%d/set_state' % todo.id
+        headers = {'Accept': 'application/json'}
+        post = lambda state: self.client.post(
+            path, json.dumps({'state': state}), content_type='application/json', headers=headers
+        )
+        self.assertEqual(post(True).status_code, 200)
+        response = post(False)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(json.loads(response.content), {'error': 'Too many requests'})
+        self.assertEqual(response['Retry-After'], '60')
+        # Reads are not limited
+        self.assertEqual(self.client.get('/', headers=headers).status_code, 200)
+        other = Client()
+        other.force_login(User.objects.create_user(username='neighbour'))
+        self.assertEqual(other.post('/', {'title': 'Mine'}, headers=headers).status_code, 201)
+    
+    @override_settings(ROOT_URLCONF='todos.async_urls')
+    @mock.patch.object(project_settings, 'TODOS_RATE_LIMITS', {'todo_write': {'user': '1/m'}})
+    def test_async_views_limited(self):
+        """Test that the async todo views share the limits"""
+        client = AsyncClient()
+        async_to_sync(client.aforce_login)(self.user)
+        headers = {'Accept': 'application/json'}
+        self.assertEqual(async_to_sync(client.post)('/', {'title': 'One'}, headers=headers).status_code, 201)
+        self.assertEqual(async_to_sync(client.post)('/', {'title': 'Two'}, headers=headers).status_code, 429)
+    
+    @mock.patch.object(project_settings, 'TODOS_RATE_LIMITS', {'login': {'ip': '1/m'}})
+    @mock.patch.object(project_settings, 'TODOS_RATELIMIT_STORE', 'todosapp.ratelimit.CacheStore')
+    def test_cache_store(self):
+        """Test that the cache store keeps buckets in the configured cache"""
+        caches['todos'].clear()
+        with mock.patch.object(ratelimit, '_store', None):
+            self.assertIsInstance(ratelimit.get_store(), ratelimit.CacheStore)
+            self.login(password='wrong')
+            self.assertEqual(self.login().status_code, 429)
+            self.assertIsNotNone(caches['todos'].get('ratelimit:login:ip:127.0.0.1'))
+        caches['todos'].clear()
+    
+    @mock.patch.object(project_settings, 'TODOS_RATE_LIMITS', {'login': {'ip': '1/m'}})
+    def test_disabled(self):
+        """Test that TODOS_RATELIMIT = False lifts every limit"""
+        with mock.patch.object(project_settings, 'TODOS_RATELIMIT', False):
+            self.login(password='wrong')
+            self.assertEqual(self.login().status_code, 302)
+
+
+class SerializersTest(TestCase):
+    """Test the shared JSON rendering of todos"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='rendered')
+        now = timezone.now().replace(microsecond=0)
+        titles = ['Plain', 'Caf\u00e9 "quoted"', 'Tricky ,{"id":1}', 'Back\\slash\nnewline']
+        Todo.objects.bulk_create(
+            Todo(
+                user=self.user,
+                title='%s %d' % (titles[i % len(titles)], i),
+                state=i % 3 == 0,
+                # Some on whole seconds, some sharing a pub_date
+                pub_date=now - timedelta(seconds=i // 2, microseconds=(i % 3) * 1500)
+            )
+            for i in range(23)
+        )
+        self.todos = Todo.objects.filter(user=self.user)
+    
+    def pages(self, limit):
+        pages = []
+        after = None
+        while True:
+            page = json.loads(serializers.list_page(self.todos, after, limit))
+            pages.append(page['todos'])
+            after = page['next']
+            if after is None:
+                return pages
+    
+    def test_sql_pages_match_python(self):
+        """Test that json_group_array pages match values_list pages exactly"""
+        expected = [
+            serializers.todo_data(todo) for todo in self.todos.order_by('-pub_date', '-id')
+        ]
+        for limit in (1, 5, 23, 100):
+            sql_pages = self.pages(limit)
+            with mock.patch.object(project_settings, 'TODOS_SQL_JSON', False):
+                self.assertEqual(self.pages(limit), sql_pages)
+            self.assertEqual([todo for page in sql_pages for todo in page], expected)
+            self.assertEqual(len(sql_pages), -(-23 // limit))
+    
+    def test_empty_page(self):
+        """Test that a user without todos gets an empty page"""
+        self.todos.delete()
+        self.assertEqual(
+            json.loads(serializers.list_page(self.todos, None, 5)), {'todos': [], 'next': None}
+        )
+    
+    def test_values_format_pub_date(self):
+        """Test that values() rows render like model instances"""
+        self.assertEqual(
+            serializers.data(serializers.values(self.todos.order_by('id'))),
+            [serializers.todo_data(todo) for todo in self.todos.order_by('id')]
+        )
+    
+    def test_dumps_without_orjson(self):
+        """Test that the standard library encoder gives the same JSON"""
+        obj = {'todos': serializers.data(serializers.values(self.todos)), 'when': timezone.now()}
+        with mock.patch.object(serializers, 'orjson', None):
+            fallback = serializers.dumps(obj)
+        self.assertEqual(json.loads(fallback), json.loads(serializers.dumps(obj)))
+        self.assertIn('Caf\u00e9'.encode('utf-8'), fallback)
+    
+    def test_list_view_single_query(self):
+        """Test that a list page is rendered by one todo query"""
+        client = Client()
+        client.force_login(self.user)
+        client.get('/', headers={'Accept': 'application/json'})
+        todo_cache.invalidate(self.user.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/?limit=10', headers={'Accept': 'application/json'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(len(json.loads(response.content)['todos']), 10)
+        todo_queries = [q for q in queries if '"title"' in q['sql']]
+        self.assertEqual(len(todo_queries), 1)
+        self.assertEqual(
+            'json_group_array' in todo_queries[0]['sql'], serializers.sql_json(self.todos)
+        )
+    
+    def test_sql_json_needs_ordered_aggregates(self):
+        """Test that SQLite before 3.44 renders pages from values_list"""
+        with mock.patch.object(connection.Database, 'sqlite_version_info', (3, 43, 2)):
+            self.assertFalse(serializers.sql_json(self.todos))
+            with CaptureQueriesContext(connection) as queries:
+                page = json.loads(serializers.list_page(self.todos, None, 5))
+        self.assertEqual(len(page['todos']), 5)
+        self.assertFalse([q for q in queries if 'json_group_array' in q['sql']])
+        with mock.patch.object(connection.Database, 'sqlite_version_info', (3, 44, 0)):
+            self.assertTrue(serializers.sql_json(self.todos))
+    
+    def test_aggregate_keeps_page_order(self):
+        """Test that json_group_array is given the page's ordering itself"""
+        queryset = keyset_queryset(self.todos)
+        sql, params = serializers._page_sql(queryset, 5)
+        self.assertIn('json_group_array(json(todo_json) ORDER BY "pub_date" DESC, "id" DESC)', sql)
+    
+    def test_async_page_matches_sync(self):
+        """Test that alist_page renders the same pages as list_page"""
+        after = json.loads(serializers.list_page(self.todos, None, 7))['next']
+        for cursor in (None, after):
+            self.assertEqual(
+                async_to_sync(serializers.alist_page)(self.todos, cursor, 7),
+                serializers.list_page(self.todos, cursor, 7)
+            )
+
+
+class IdempotencyTest(TestCase):
+    """Test Idempotency-Key replays on the todo write views"""
+    
+    def setUp(self):
+        idempotency.get_store().clear()
+        self.user = User.objects.create_user(username='retrier')
+        self.client = Client()
+        self.client.force_login(self.user)
+    
+    def post(self, path, data, key='key-1', client=None):
+        headers = {'Accept': 'application/json'}
+        if key is not None:
+            headers['Idempotency-Key'] = key
+        return (client or self.client).post(
+            path, json.dumps(data), content_type='application/json', headers=headers
+        )
+    
+    def test_create_replayed(self):
+        """Test that a retried create returns the first response and makes one todo"""
+        first = self.post('/', {'title': 'Once'})
+        self.assertEqual(first.status_code, 201)
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.post('/', {'title': 'Once'})
+        self.assertFalse([q for q in queries if 'todosapp_todo' in q['sql']])
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Content-Type'], 'application/json')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        self.assertEqual(Todo.objects.filter(user=self.user).count(), 1)
+        # A new key is a new request
+        self.post('/', {'title': 'Once'}, key='key-2')
+        self.assertEqual(Todo.objects.filter(user=self.user).count(), 2)
+    
+    def test_without_key(self):
+        """Test that requests without a key are not deduplicated"""
+        self.post('/', {'title': 'Twice'}, key=None)
+        self.post('/', {'title': 'Twice'}, key=None)
+        self.assertEqual(Todo.objects.filter(user=self.user).count(), 2)
+    
+    def test_form_redirect_replayed(self):
+        """Test that a replayed form post redirects like the first one"""
+        headers = {'Idempotency-Key': 'form'}
+        self.client.post('/', {'title': 'Form'}, headers=headers)
+        retry = self.client.post('/', {'title': 'Form'}, headers=headers)
+        self.assertEqual(retry.status_code, 302)
+        self.assertEqual(retry['Location'], '/')
+        self.assertEqual(Todo.objects.filter(user=self.user).count(), 1)
+    
+    def test_mutations_replayed(self):
+        """Test that set_state, update_title and delete replay their responses"""
+        todo = Todo.objects.create(user=self.user, title='Old', pub_date=timezone.now())
+        self.post('/%d/update_title' % todo.id, {'title': 'New'}, key='rename')
+        todo.refresh_from_db()
+        todo.title = 'Changed elsewhere'
+        todo.save()
+        retry = self.post('/%d/update_title' % todo.id, {'title': 'New'}, key='rename')
+        self.assertEqual(json.loads(retry.content)['title'], 'New')
+        todo.refresh_from_db()
+        self.assertEqual(todo.title, 'Changed elsewhere')
+        
+        self.assertEqual(self.post('/%d/set_state' % todo.id, {'state': True}, key='done').status_code, 200)
+        self.assertEqual(self.post('/%d/set_state' % todo.id, {'state': True}, key='done').status_code, 200)
+        
+        delete = self.client.delete('/%d/delete' % todo.id, headers={'Idempotency-Key': 'gone', 'Accept': 'application/json'})
+        self.assertEqual(delete.status_code, 200)
+        retry = self.client.delete('/%d/delete' % todo.id, headers={'Idempotency-Key': 'gone', 'Accept': 'application/json'})
+        # Not a 404: the retry gets the first answer
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.content, delete.content)
+    
+    def test_key_reuse_rejected(self):
+        """Test that a key reused for a different request answers 422"""
+        self.post('/', {'title': 'First'})
+        response = self.post('/', {'title': 'Second'})
+        self.assertEqual(response.status_code, 422)
+        self.assertIn('error', json.loads(response.content))
+        self.assertFalse(Todo.objects.filter(title='Second').exists())
+    
+    def test_keys_scoped_per_user(self):
+        """Test that another user's identical key runs their own request"""
+        other = Client()
+        other.force_login(User.objects.create_user(username='other'))
+        self.post('/', {'title': 'Mine'})
+        response = self.post('/', {'title': 'Mine'}, client=other)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(Todo.objects.filter(title='Mine').count(), 2)
+    
+    def test_in_progress_conflict(self):
+        """Test that a retry during the first request answers 409"""
+        fingerprint = 'in flight'
+        idempotency.get_store().begin('%s:key-1' % self.user.pk, fingerprint)
+        self.assertEqual(self.post('/', {'title': 'Racing'}).status_code, 409)
+        self.assertFalse(Todo.objects.filter(title='Racing').exists())
+    
+    def test_failures_not_kept(self):
+        """Test that an exception frees the key for a retry"""
+        with mock.patch.object(Todo.objects, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.post('/', {'title': 'Flaky'})
+        response = self.post('/', {'title': 'Flaky'})
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+    
+    def test_expiry_and_eviction(self):
+        """Test that kept responses expire and the oldest are evicted first"""
+        self.post('/', {'title': 'Expiring'})
+        later = time.monotonic() + project_settings.TODOS_IDEMPOTENCY_TTL + 1
+        # Only the store's clock moves; the rate limits keep real time
+        with mock.patch.object(idempotency, 'time', mock.Mock(monotonic=mock.Mock(return_value=later))):
+            self.post('/', {'title': 'Expiring'})
+        self.assertEqual(Todo.objects.filter(title='Expiring').count(), 2)
+        
+        store = idempotency.InProcessStore()
+        with mock.patch.object(project_settings, 'TODOS_IDEMPOTENCY_MAX_KEYS', 2):
+            for key in 'abc':
+                store.begin(key, key)
+        self.assertIsNone(store.begin('a', 'again'))
+        self.assertEqual(store.begin('c', 'again').fingerprint, 'c')
+    
+    def test_invalid_key(self):
+        """Test that an over-long key is refused"""
+        self.assertEqual(self.post('/', {'title': 'Long'}, key='k' * 256).status_code, 400)
+        self.assertFalse(Todo.objects.exists())
+    
+    @override_settings(ROOT_URLCONF='todos.async_urls')
+    def test_async_views_replayed(self):
+        """Test that the async views replay too"""
+        client = AsyncClient()
+        async_to_sync(client.aforce_login)(self.user)
+        post = lambda: async_to_sync(client.post)(
+            '/', json.dumps({'title': 'Async'}), content_type='application/json',
+            headers={'Accept': 'application/json', 'Idempotency-Key': 'async'}
+        )
+        first = post()
+        retry = post()
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Todo.objects.filter(title='Async').count(), 1)
+    
+    @mock.patch.object(project_settings, 'TODOS_IDEMPOTENCY_STORE', 'todosapp.idempotency.CacheStore')
+    def test_cache_store(self):
+        """Test that the cache store keeps responses in the configured cache"""
+        caches['todos'].clear()
+        with mock.patch.object(idempotency, '_store', None):
+            self.assertIsInstance(idempotency.get_store(), idempotency.CacheStore)
+            first = self.post('/', {'title': 'Cached'})
+            retry = self.post('/', {'title': 'Cached'})
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(Todo.objects.filter(title='Cached').count(), 1)
+        self.assertIsNotNone(caches['todos'].get('idempotency:%s:key-1' % self.user.pk))
+        caches['todos'].clear()
@@ -8,6 +8,14 @@ urlpatterns = [
     path("login/", auth_views.login_view, name="login"),
     path("signup/", auth_views.signup_view, name="signup"),
     path("logout/", auth_views.logout_view, name="logout"),
+    path("batch", views.batch, name="batch"),
+    path("sync", views.sync, name="sync"),
+    path("events", views.event_stream, name="events"),
+    path("export", views.export_todos, name="export_todos"),
+    path("import", views.import_todos, name="import_todos"),
+    path("search", views.search_todos, name="search"),
+    path("cache_stats", views.cache_stats, name="cache_stats"),
+    path("metrics", views.prometheus_metrics, name="metrics"),
     path("<int:todo_id>/", views.detail, name="detail"),
     path("<int:todo_id>/set_state", views.set_state, name="set_state"),
     path("<int:todo_id>/update_title", views.update_title, name="update_title"),
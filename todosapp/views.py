@@ -1,19 +1,34 @@
-import mimetypes
-import os
 from django.shortcuts import get_object_or_404, render, redirect
-from django.http import Http404, HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 import json
 
 from todos import settings
 
+from . import assets, cache, export, importer, metrics, search, serializers, spa
+from .idempotency import idempotent
+from .batch import apply_batch
+from .etags import detail_etag, list_etag
 from .models import Todo
+from .pagination import InvalidCursor, parse_limit
+from .ratelimit import rate_limit
+from .routers import reading_from_replica, replica_reads
+from .sharding import shard_for
+from .sync import ExpiredToken, InvalidToken, changes_since, decode_token
 
 
 @login_required
+@rate_limit('todo_write')
+@idempotent
+@replica_reads
+@vary_on_headers('Accept')
+@condition(etag_func=list_etag)
 def index(request):
     if request.method == 'POST':
         # Handle JSON POST data
@@ -33,38 +48,47 @@ def index(request):
                 pub_date=timezone.now()
             )
             if request.headers.get('Accept') == 'application/json' or request.content_type == 'application/json':
-                return JsonResponse({
-                    'id': todo.id,
-                    'title': todo.title,
-                    'state': todo.state,
-                    'pub_date': todo.pub_date.isoformat()
-                }, status=201)
+                return serializers.json_response(serializers.todo_data(todo), status=201)
             return redirect('index')
     
-    # Get todos for the current user only
-    todos = Todo.objects.filter(user=request.user).order_by("-pub_date")[:5]
-    
     if request.headers.get('Accept') == 'application/json':
-        todos_data = [{
-            'id': todo.id,
-            'title': todo.title,
-            'state': todo.state,
-            'pub_date': todo.pub_date.isoformat()
-        } for todo in todos]
-        return JsonResponse({'todos': todos_data})
-    
-    dist_path = os.path.join(settings.BASE_DIR, 'vite-project', 'dist')
-    index_path = os.path.join(dist_path, 'index.html')
+        try:
+            limit = parse_limit(
+                request.GET.get('limit'),
+                settings.TODOS_PAGE_SIZE,
+                settings.TODOS_MAX_PAGE_SIZE
+            )
+        except ValueError:
+            return JsonResponse({'error': 'Invalid limit'}, status=400)
+        
+        after = request.GET.get('after')
+        page = '%s:%s' % (after or '', limit)
+        content, generation = cache.get_list(request.user.id, page)
+        if content is not None:
+            return HttpResponse(content, content_type='application/json')
+        
+        # Get todos for the current user only, one keyset page at a time
+        try:
+            content = serializers.list_page(
+                Todo.objects.filter(user=request.user),
+                after,
+                limit
+            )
+        except InvalidCursor:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        
+        response = HttpResponse(content, content_type='application/json')
+        # A replica may lag behind the write that bumped the generation
+        if not reading_from_replica():
+            cache.set_list(request.user.id, page, response.content, generation)
+        return response
     
-    if os.path.exists(index_path):
-        with open(index_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return HttpResponse(content, content_type='text/html')
-    else:
-        raise Http404("vite app not found. Make sure to run 'make runvite' first.")
+    return spa.spa_shell.response(request)
 
 
 @login_required
+@rate_limit('todo_write')
+@idempotent
 def set_state(request, todo_id):
     todo = get_object_or_404(Todo, pk=todo_id, user=request.user)
     
@@ -80,15 +104,10 @@ def set_state(request, todo_id):
         
         if state is not None:
             todo.state = state
-            todo.save()
+            todo.save(update_fields=['state', 'updated_at'])
             
             if request.headers.get('Accept') == 'application/json' or request.content_type == 'application/json':
-                return JsonResponse({
-                    'id': todo.id,
-                    'title': todo.title,
-                    'state': todo.state,
-                    'pub_date': todo.pub_date.isoformat()
-                })
+                return serializers.json_response(serializers.todo_data(todo))
             return redirect('index')
         else:
             if request.headers.get('Accept') == 'application/json' or request.content_type == 'application/json':
@@ -96,17 +115,15 @@ def set_state(request, todo_id):
             return HttpResponse("State value is required", status=400)
     
     if request.headers.get('Accept') == 'application/json':
-        return JsonResponse({
-            'id': todo.id,
-            'title': todo.title,
-            'state': getattr(todo, 'state', None),
-            'pub_date': todo.pub_date.isoformat()
-        })
+        return serializers.json_response(serializers.todo_data(todo))
     
     return HttpResponse("state for %s." % todo.id)
 
 
 @login_required
+@replica_reads
+@vary_on_headers('Accept')
+@condition(etag_func=detail_etag)
 def detail(request, todo_id):
     todo = get_object_or_404(Todo, pk=todo_id, user=request.user)
     
@@ -123,37 +140,19 @@ def detail(request, todo_id):
 
 def vite_app(request):
     """Serve the main vite app (index.html)"""
-    dist_path = os.path.join(settings.BASE_DIR, 'vite-project', 'dist')
-    index_path = os.path.join(dist_path, 'index.html')
-    
-    if os.path.exists(index_path):
-        with open(index_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return HttpResponse(content, content_type='text/html')
-    else:
-        raise Http404("vite app not found. Make sure to run 'make runvite' first.")
+    return spa.spa_shell.response(request)
 
 
 def vite_static(request, path):
     """Serve static files from vite-project/dist"""
-    dist_path = os.path.join(settings.BASE_DIR, 'vite-project', 'dist')
-    file_path = os.path.join(dist_path, path)
-    
-    if not file_path.startswith(dist_path):
-        raise Http404("Invalid path")
-    
-    if os.path.exists(file_path) and os.path.isfile(file_path):
-        content_type, _ = mimetypes.guess_type(file_path)
-        if content_type is None:
-            content_type = 'application/octet-stream'
-        
-        with open(file_path, 'rb') as f:
-            response = HttpResponse(f.read(), content_type=content_type)
-            return response
-    else:
+    asset = assets.manifest.lookup(path)
+    if asset is None:
         raise Http404("File not found")
+    return assets.serve(request, asset)
 
 @login_required
+@rate_limit('todo_write')
+@idempotent
 def delete_todo(request, todo_id):
     todo = get_object_or_404(Todo, pk=todo_id, user=request.user)
     
@@ -171,6 +170,8 @@ def delete_todo(request, todo_id):
 
 
 @login_required
+@rate_limit('todo_write')
+@idempotent
 def update_title(request, todo_id):
     todo = get_object_or_404(Todo, pk=todo_id, user=request.user)
     
@@ -186,15 +187,10 @@ def update_title(request, todo_id):
         
         if title is not None and title.strip():
             todo.title = title.strip()
-            todo.save()
+            todo.save(update_fields=['title', 'updated_at'])
             
             if request.headers.get('Accept') == 'application/json' or request.content_type == 'application/json':
-                return JsonResponse({
-                    'id': todo.id,
-                    'title': todo.title,
-                    'state': todo.state,
-                    'pub_date': todo.pub_date.isoformat()
-                })
+                return serializers.json_response(serializers.todo_data(todo))
             return redirect('index')
         else:
             if request.headers.get('Accept') == 'application/json' or request.content_type == 'application/json':
@@ -202,12 +198,139 @@ def update_title(request, todo_id):
             return HttpResponse("Title value is required and cannot be empty", status=400)
     
     if request.headers.get('Accept') == 'application/json':
-        return JsonResponse({
-            'id': todo.id,
-            'title': todo.title,
-            'state': todo.state,
-            'pub_date': todo.pub_date.isoformat()
-        })
+        return serializers.json_response(serializers.todo_data(todo))
     
     return HttpResponse("title for %s." % todo.id)
 
+
+
+@login_required
+@rate_limit('todo_write')
+def batch(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list):
+        return JsonResponse({'error': 'A list of operations is required'}, status=400)
+    if len(operations) > settings.TODOS_BATCH_MAX_OPERATIONS:
+        return JsonResponse({
+            'error': 'Too many operations (at most %d per batch)' % settings.TODOS_BATCH_MAX_OPERATIONS
+        }, status=400)
+    
+    return JsonResponse({'results': apply_batch(request.user, operations)})
+
+
+@login_required
+def sync(request):
+    since = request.GET.get('since')
+    try:
+        since = decode_token(since) if since else None
+        todos, deleted, token = changes_since(request.user, since)
+    except InvalidToken:
+        return JsonResponse({'error': 'Invalid sync token'}, status=400)
+    except ExpiredToken:
+        return JsonResponse({'error': 'Sync token expired, full resync required'}, status=410)
+    return serializers.json_response({
+        'todos': todos,
+        'deleted': deleted,
+        'full': since is None,
+        'token': token
+    })
+
+
+def event_stream(request):
+    """
+    The change stream is only served under ASGI (todos.asgi), where
+    todos.async_urls routes /events to async_views.event_stream. Under WSGI
+    an open stream would hold a worker thread for as long as it stays open.
+    """
+    return JsonResponse({
+        'error': 'The event stream is only available when the app is served over ASGI (todos.asgi)'
+    }, status=501)
+
+
+@login_required
+def search_todos(request):
+    try:
+        limit = parse_limit(
+            request.GET.get('limit'),
+            settings.TODOS_PAGE_SIZE,
+            settings.TODOS_MAX_PAGE_SIZE
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    
+    try:
+        todos, next_cursor = search.search(
+            request.user,
+            request.GET.get('q'),
+            limit,
+            request.GET.get('after'),
+            using=shard_for(request.user.id)
+        )
+    except search.InvalidQuery:
+        return JsonResponse({'error': 'Search query is required'}, status=400)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    
+    return serializers.json_response({
+        'todos': [serializers.todo_data(todo) for todo in todos],
+        'next': next_cursor
+    })
+
+
+@login_required
+def cache_stats(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return JsonResponse(cache.stats())
+
+
+def prometheus_metrics(request):
+    token = settings.TODOS_METRICS_TOKEN
+    bearer = token and constant_time_compare(request.headers.get('Authorization', ''), 'Bearer %s' % token)
+    if not bearer and not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+def export_todos(request):
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in export.FORMATS:
+        return JsonResponse({'error': 'Unsupported format'}, status=400)
+    
+    response = StreamingHttpResponse(
+        export.export(request.user, export_format, settings.TODOS_EXPORT_CHUNK_SIZE),
+        content_type=export.FORMATS[export_format]
+    )
+    response['Content-Disposition'] = 'attachment; filename="todos.%s"' % export_format
+    return response
+
+
+@login_required
+@rate_limit('todo_write')
+def import_todos(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    import_format = request.GET.get('format')
+    if import_format is None:
+        import_format = 'csv' if request.content_type == 'text/csv' else 'ndjson'
+    if import_format not in importer.FORMATS:
+        return JsonResponse({'error': 'Unsupported format'}, status=400)
+    
+    parse = importer.parse_csv if import_format == 'csv' else importer.parse_ndjson
+    # Read the body a line at a time rather than through request.body
+    records = parse(importer.decode_lines(request))
+    # At normal durability: sqlite_bulk_load() is for offline loads only
+    result = importer.import_todos(
+        request.user, records, settings.TODOS_IMPORT_BATCH_SIZE, using=shard_for(request.user.id)
+    )
+    return JsonResponse(result.as_dict())